@@ -1,6 +1,82 @@
 from django.contrib import admin
-from django.contrib.auth.admin import UserAdmin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.contrib.auth import admin as auth_admin
+from django.db.models import Q
+from django.db.models.functions import Lower
 
-from .models import User
+from mysite.pagination import EstimatedCountPaginator
 
-admin.site.register(User, UserAdmin)
+from . import usernames
+from .models import FriendShip, User
+
+BEFORE_VAR = "before"
+# 前方一致の範囲検索の上限に付ける文字（LIKE 'x%' は式インデックスを使えないので範囲で書く）
+PREFIX_END = "\U0010ffff"
+
+
+class KeysetChangeList(ChangeList):
+    # ID の降順に並べ、?before=<ID> より前の1ページを表示する。OFFSET で深いページを読み飛ばさない
+    def get_queryset(self, request):
+        # 絞り込みの条件と見なされないよう、ほかの処理より先に取り除く
+        before = self.params.pop(BEFORE_VAR, None)
+        try:
+            self.before = int(before) if before else None
+        except ValueError:
+            raise IncorrectLookupParameters("Invalid cursor.")
+        queryset = super().get_queryset(request)
+        if self.before is not None:
+            queryset = queryset.filter(pk__lt=self.before)
+        return queryset
+
+    def get_results(self, request):
+        super().get_results(request)
+        # 件数は見積もりなので、ページ番号や「すべて表示」に関係なく先頭の1ページだけを読む
+        self.result_list = list(self.queryset[: self.list_per_page])
+        self.first_url = self.get_query_string()
+        self.next_url = None
+        if len(self.result_list) == self.list_per_page:
+            self.next_url = self.get_query_string({BEFORE_VAR: self.result_list[-1].pk})
+
+
+class ScalableAdminMixin:
+    # 何百万行あっても一覧を開けるようにする（件数は見積もり、ページ送りは keyset、並べ替えは ID のみ）
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_max_show_all = 0
+    ordering = ("-id",)
+    sortable_by = ()
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+
+@admin.register(User)
+class UserAdmin(ScalableAdminMixin, auth_admin.UserAdmin):
+    # 件数は非正規化した列を表示する（行ごとに COUNT しない）
+    list_display = ("username", "email", "follower_count", "following_count", "tweet_count", "is_staff")
+    # グループでの絞り込みは JOIN と DISTINCT になるので外す
+    list_filter = ("is_staff", "is_superuser", "is_active")
+    search_fields = ("username", "email")
+    search_help_text = "ID、またはユーザー名・メールアドレスの先頭で検索します。"
+
+    def get_search_results(self, request, queryset, search_term):
+        # icontains は全件を走査するので、ID の完全一致と、LOWER() の式インデックスでの前方一致に限る
+        term = usernames.normalize(search_term.strip())
+        if not term:
+            return queryset, False
+        condition = Q(username_lower__gte=term, username_lower__lt=term + PREFIX_END) | Q(
+            email_lower__gte=term, email_lower__lt=term + PREFIX_END
+        )
+        if term.isdigit():
+            condition |= Q(pk=int(term))
+        queryset = queryset.alias(username_lower=Lower("username"), email_lower=Lower("email")).filter(condition)
+        return queryset, False
+
+
+@admin.register(FriendShip)
+class FriendShipAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    list_display = ("id", "follower", "following", "created_at")
+    list_select_related = ("follower", "following")
+    # ユーザーの選択肢を全件の <select> にしない
+    raw_id_fields = ("follower", "following")
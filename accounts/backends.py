@@ -0,0 +1,39 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+CACHE_KEY = "accounts:user:{}"
+CACHE_TIMEOUT = 60 * 15
+
+
+def cached_user(user_id):
+    # User.save() / delete() のたびに accounts.signals で削除する
+    key = CACHE_KEY.format(user_id)
+    user = cache.get(key)
+    if user is None:
+        user = get_user_model()._default_manager.filter(pk=user_id).first()
+        if user is not None:
+            cache.set(key, user, CACHE_TIMEOUT)
+    return user
+
+
+async def acached_user(user_id):
+    key = CACHE_KEY.format(user_id)
+    user = await cache.aget(key)
+    if user is None:
+        user = await get_user_model()._default_manager.filter(pk=user_id).afirst()
+        if user is not None:
+            await cache.aset(key, user, CACHE_TIMEOUT)
+    return user
+
+
+class CachedModelBackend(ModelBackend):
+    # AuthenticationMiddleware が毎リクエスト行うユーザーの読み込みをキャッシュから返す
+    def get_user(self, user_id):
+        user = cached_user(user_id)
+        return user if user is not None and self.user_can_authenticate(user) else None
+
+
+def invalidate_user(*user_ids):
+    # QuerySet.update() で件数を変えたときは post_save が送られないので、書き込んだ側で呼ぶ
+    cache.delete_many([CACHE_KEY.format(user_id) for user_id in user_ids])
@@ -1,5 +1,8 @@
 from django.contrib.auth import get_user_model
 from django.contrib.auth.forms import UserCreationForm
+from django.core.exceptions import ValidationError
+
+from . import usernames
 
 User = get_user_model()  # こっちで先に変数代入する！
 
@@ -9,6 +12,13 @@ class SignupForm(UserCreationForm):
         model = User  # model = get_user_model() は NG
         fields = ("username", "email")
 
+    def clean_username(self):
+        # プロフィールの URL は大文字と小文字を区別しないので、それだけが違う名前は登録させない
+        username = self.cleaned_data.get("username")
+        if username and usernames.is_taken(username):
+            raise ValidationError(self.instance.unique_error_message(User, ["username"]))
+        return username
+
 
 # password1, password2というフィールドはUserCreationFormの方で設定されているため、
 # fieldsの欄には、Userモデルの中にある、
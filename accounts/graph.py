@@ -0,0 +1,136 @@
+from array import array
+from bisect import bisect_left
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from mysite import versions
+from mysite.db import retry_on_lock
+from tasks import queue
+from tweets import tasks, timeline
+
+from .backends import invalidate_user
+from .models import FriendShip, User
+
+# ユーザーごとのフォロー中ユーザー ID の集合を、ソート済みの 64bit 整数配列としてキャッシュする。
+# フォロー／フォロー解除のたびにキャッシュを消し、次に読んだときに DB から作り直す。
+# （書き込み側で作り直すと、同時に変えたときに古い集合が後から書き込まれることがある）
+CACHE_KEY = "accounts:followees:{}"
+CACHE_TIMEOUT = 60 * 60 * 24
+
+
+class FolloweeSet:
+    def __init__(self, ids):
+        self._ids = ids
+
+    def __contains__(self, user_id):
+        i = bisect_left(self._ids, user_id)
+        return i < len(self._ids) and self._ids[i] == user_id
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __len__(self):
+        return len(self._ids)
+
+
+def _followees(user_id):
+    return (
+        FriendShip.objects.filter(follower_id=user_id).order_by("following_id").values_list("following_id", flat=True)
+    )
+
+
+def _load(user_id):
+    ids = array("q", _followees(user_id))
+    cache.set(CACHE_KEY.format(user_id), ids.tobytes(), CACHE_TIMEOUT)
+    return ids
+
+
+async def _aload(user_id):
+    ids = array("q", [pk async for pk in _followees(user_id)])
+    await cache.aset(CACHE_KEY.format(user_id), ids.tobytes(), CACHE_TIMEOUT)
+    return ids
+
+
+def _from_bytes(data):
+    ids = array("q")
+    ids.frombytes(data)
+    return FolloweeSet(ids)
+
+
+def followee_ids(user_id):
+    data = cache.get(CACHE_KEY.format(user_id))
+    if data is None:
+        return FolloweeSet(_load(user_id))
+    return _from_bytes(data)
+
+
+async def afollowee_ids(user_id):
+    data = await cache.aget(CACHE_KEY.format(user_id))
+    if data is None:
+        return FolloweeSet(await _aload(user_id))
+    return _from_bytes(data)
+
+
+def is_following(follower_id, followee_id):
+    return followee_id in followee_ids(follower_id)
+
+
+async def ais_following(follower_id, followee_id):
+    return followee_id in await afollowee_ids(follower_id)
+
+
+@retry_on_lock
+def _add_edge(follower, followee):
+    try:
+        with transaction.atomic():
+            FriendShip.objects.create(follower=follower, following=followee)
+            User.objects.filter(pk=follower.pk).update(following_count=F("following_count") + 1)
+            User.objects.filter(pk=followee.pk).update(follower_count=F("follower_count") + 1)
+            # 相手の最近のツイートをタイムラインに取り込む
+            queue.enqueue(tasks.backfill, follower.pk, followee.pk)
+    except IntegrityError:
+        # フォロー済み
+        return False
+    return True
+
+
+@retry_on_lock
+def _remove_edge(follower, followee):
+    with transaction.atomic():
+        deleted, _ = FriendShip.objects.filter(follower=follower, following=followee).delete()
+        if not deleted:
+            return False
+        User.objects.filter(pk=follower.pk).update(following_count=F("following_count") - 1)
+        User.objects.filter(pk=followee.pk).update(follower_count=F("follower_count") - 1)
+    return True
+
+
+def follow(follower, followee):
+    if not _add_edge(follower, followee):
+        return False
+    cache.delete(CACHE_KEY.format(follower.pk))
+    _bump_versions(follower, followee)
+    return True
+
+
+def unfollow(follower, followee):
+    if not _remove_edge(follower, followee):
+        return False
+    cache.delete(CACHE_KEY.format(follower.pk))
+    _bump_versions(follower, followee)
+    timeline.purge(follower.pk, followee.pk)
+    return True
+
+
+def _bump_versions(follower, followee):
+    # 件数・フォローボタン・タイムラインの中身が変わる（件数は update() で変えたのでキャッシュしたユーザーも消す）
+    invalidate_user(follower.pk, followee.pk)
+    versions.bump(
+        versions.user(follower.pk),
+        versions.user(followee.pk),
+        versions.profile(follower.username),
+        versions.profile(followee.username),
+        versions.timeline(follower.pk),
+    )
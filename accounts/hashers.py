@@ -0,0 +1,10 @@
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class ConfigurablePBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    # 反復回数を settings.PASSWORD_HASH_ITERATIONS で環境ごとに変えられるようにする。
+    # 保存済みのハッシュと回数が違えば、ログイン成功時に Django が新しい回数で作り直す。
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASH_ITERATIONS
@@ -0,0 +1,67 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from accounts.backends import invalidate_user
+from accounts.models import FriendShip
+from mysite.routers import use_primary
+from tweets.models import Tweet
+
+User = get_user_model()
+
+COUNTER_FIELDS = ("follower_count", "following_count", "tweet_count")
+
+
+def _count(queryset, field):
+    counted = queryset.filter(**{field: OuterRef("pk")}).order_by().values(field).annotate(n=Count("pk")).values("n")
+    return Coalesce(Subquery(counted, output_field=IntegerField()), 0)
+
+
+def _tweet_counts(user_ids):
+    counts = {}
+    for tweets in Tweet.objects.shards():
+        counted = tweets.filter(author_id__in=user_ids).order_by().values("author").annotate(n=Count("pk"))
+        counts.update(counted.values_list("author", "n"))
+    return counts
+
+
+class Command(BaseCommand):
+    help = "ユーザーのフォロワー数・フォロー数・ツイート数を実データから数え直します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    # 遅れているレプリカの件数で上書きしないよう、プライマリだけを読む
+    @use_primary()
+    def handle(self, *args, chunk_size, **options):
+        checked = repaired = 0
+        last_pk = 0
+        while True:
+            rows = list(
+                User.objects.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .annotate(
+                    actual_follower_count=_count(FriendShip.objects.all(), "following"),
+                    actual_following_count=_count(FriendShip.objects.all(), "follower"),
+                )
+                .values("pk", *COUNTER_FIELDS, "actual_follower_count", "actual_following_count")[:chunk_size]
+            )
+            if not rows:
+                break
+            last_pk = rows[-1]["pk"]
+            # ツイートは別のシャードにあることがあるので、サブクエリにせずシャードごとに数える
+            tweet_counts = _tweet_counts([row["pk"] for row in rows])
+            for row in rows:
+                row["actual_tweet_count"] = tweet_counts.get(row["pk"], 0)
+            drifted = [
+                User(pk=row["pk"], **{field: row[f"actual_{field}"] for field in COUNTER_FIELDS})
+                for row in rows
+                if any(row[field] != row[f"actual_{field}"] for field in COUNTER_FIELDS)
+            ]
+            User.objects.bulk_update(drifted, COUNTER_FIELDS)
+            invalidate_user(*(user.pk for user in drifted))
+            checked += len(rows)
+            repaired += len(drifted)
+
+        self.stdout.write(f"Checked {checked} users, repaired {repaired}.")
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:05
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0006_user_email_lower_idx"),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name="user",
+            constraint=models.UniqueConstraint(
+                django.db.models.functions.text.Lower("username"),
+                name="user_username_lower_unique",
+                violation_error_message="同じユーザー名が既に登録済みです。",
+            ),
+        ),
+        # 一意制約のインデックスで引けるので、作ってから消す
+        migrations.RemoveIndex(
+            model_name="user",
+            name="user_username_lower_idx",
+        ),
+    ]
@@ -0,0 +1,13 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user
+from django.contrib.auth.mixins import AccessMixin
+
+
+class AsyncLoginRequiredMixin(AccessMixin):
+    # LoginRequiredMixin の async ビュー版。
+    # request.user は遅延評価でセッションと DB を同期的に読むので、イベントループの外で解決しておく。
+    async def dispatch(self, request, *args, **kwargs):
+        request.user = await sync_to_async(get_user)(request)
+        if not request.user.is_authenticated:
+            return self.handle_no_permission()
+        return await super().dispatch(request, *args, **kwargs)
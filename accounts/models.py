@@ -1,6 +1,49 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models.functions import Lower
 
 
 class User(AbstractUser):
     email = models.EmailField()
+    # プロフィールに表示する件数。フォロー・ツイートの書き込みと同じトランザクションで更新する
+    follower_count = models.IntegerField(default=0)
+    following_count = models.IntegerField(default=0)
+    tweet_count = models.IntegerField(default=0)
+
+    class Meta(AbstractUser.Meta):
+        # プロフィールの URL のユーザー名は大文字と小文字を区別せずに引く（accounts.usernames）ので、
+        # 大文字と小文字だけが違う名前は登録させない。このインデックスで引く
+        constraints = [
+            models.UniqueConstraint(
+                Lower("username"),
+                name="user_username_lower_unique",
+                violation_error_message="同じユーザー名が既に登録済みです。",
+            )
+        ]
+        # 管理画面の検索はメールアドレスの前方一致も範囲で引く（accounts.admin）
+        indexes = [models.Index(Lower("email"), name="user_email_lower_idx")]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        user = super().from_db(db, field_names, values)
+        # ユーザー名を変えたときに古い名前のキャッシュを消せるよう、読み込んだときの名前を覚えておく
+        user._loaded_username = user.__dict__.get("username")
+        return user
+
+
+class FriendShip(models.Model):
+    # follower が following をフォローしている
+    follower = models.ForeignKey(User, on_delete=models.CASCADE, related_name="following_relations")
+    following = models.ForeignKey(User, on_delete=models.CASCADE, related_name="follower_relations")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["follower", "following"], name="unique_friendship"),
+            models.CheckConstraint(check=~models.Q(follower=models.F("following")), name="friendship_not_self"),
+        ]
+        # フォロー一覧・フォロワー一覧（と fan-out）をそれぞれの向きで範囲走査できるようにする
+        indexes = [
+            models.Index(fields=["follower", "-created_at", "-id"], name="friendship_follower_idx"),
+            models.Index(fields=["following", "-created_at", "-id"], name="friendship_following_idx"),
+        ]
@@ -0,0 +1,23 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from mysite import versions
+
+from . import usernames
+from .backends import invalidate_user
+from .models import User
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+    # 新しく使われた名前（存在しないと覚えているかもしれない）と、変える前の名前
+    names = {instance.username, getattr(instance, "_loaded_username", None)} - {None}
+    usernames.invalidate(*names)
+    stale = [versions.user(instance.pk), *(versions.profile(name) for name in names)]
+    if len(names) > 1 or kwargs["signal"] is post_delete:
+        # 名前はフォロワーのホームに並ぶツイートにも出る
+        stale.append(versions.author(instance.pk))
+    versions.bump(*stale)
+    instance._loaded_username = instance.username
@@ -1,8 +1,23 @@
+from io import StringIO
+from unittest import mock
+
 from django.contrib.auth import SESSION_KEY, get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from mysite.settings import LOGIN_REDIRECT_URL, LOGOUT_REDIRECT_URL
+from mysite.testing import QueryBudgetTestMixin, seed_follow_graph
+from tweets import likes
+from tweets.models import TimelineEntry, Tweet
+
+from . import backends, graph, usernames
+from .admin import UserAdmin
+from .hashers import ConfigurablePBKDF2PasswordHasher
+from .models import FriendShip
 
 User = get_user_model()
 
@@ -38,6 +53,26 @@ class TestSignupView(TestCase):
         # 3の確認 = ログイン状態になること
         self.assertIn(SESSION_KEY, self.client.session)
 
+    def test_success_post_hashes_password_once(self):
+        valid_data = {
+            "username": "testuser",
+            "email": "test@test.com",
+            "password1": "testpassword",
+            "password2": "testpassword",
+        }
+
+        with mock.patch.object(
+            ConfigurablePBKDF2PasswordHasher,
+            "encode",
+            autospec=True,
+            side_effect=ConfigurablePBKDF2PasswordHasher.encode,
+        ) as encode:
+            response = self.client.post(self.url, valid_data)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(encode.call_count, 1)
+        self.assertIn(SESSION_KEY, self.client.session)
+
     def test_failure_post_with_empty_form(self):
         invalid_data = {
             "username": "",
@@ -132,6 +167,23 @@ class TestSignupView(TestCase):
         # 「同じユーザー名が既に登録済みです。」しか指定できない
         self.assertIn("同じユーザー名が既に登録済みです。", form.errors["username"])
 
+    def test_failure_post_with_username_differing_only_in_case(self):
+        User.objects.create_user(username="Tester", password="testpassword")
+
+        invalid_data = {
+            "username": "tester",
+            "email": "test@test.com",
+            "password1": "testpassword",
+            "password2": "testpassword",
+        }
+
+        response = self.client.post(self.url, invalid_data)
+        form = response.context["form"]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(User.objects.count(), 1)
+        self.assertEqual(form.errors["username"], ["同じユーザー名が既に登録済みです。"])
+
     def test_failure_post_with_invalid_email(self):
         invalid_data = {
             "username": "user1",
@@ -223,6 +275,28 @@ class TestSignupView(TestCase):
         self.assertIn("確認用パスワードが一致しません。", form.errors["password2"])
 
 
+class TestSignupViewQueryBudget(QueryBudgetTestMixin, TestCase):
+    def setUp(self):
+        seed_follow_graph(User.objects.create_user(username="seeder", password="testpassword"))
+
+    def test_success_get_within_budget(self):
+        response = self.client.get(reverse("accounts:signup"))
+        self.assertWithinQueryBudget(response)
+
+    def test_success_post_within_budget(self):
+        valid_data = {
+            "username": "testuser",
+            "email": "test@test.com",
+            "password1": "testpassword",
+            "password2": "testpassword",
+        }
+
+        response = self.client.post(reverse("accounts:signup"), valid_data)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertWithinQueryBudget(response)
+
+
 class TestLoginView(TestCase):
     def setUp(self):
         self.url = reverse("accounts:login")
@@ -245,6 +319,19 @@ class TestLoginView(TestCase):
         )
         self.assertIn(SESSION_KEY, self.client.session)
 
+    @override_settings(PASSWORD_HASH_ITERATIONS=2000)
+    def test_success_post_rehashes_password_with_new_cost(self):
+        with self.settings(PASSWORD_HASH_ITERATIONS=1000):
+            self.user.set_password("testpassword")
+            self.user.save()
+
+        response = self.client.post(self.url, {"username": "testuser", "password": "testpassword"})
+
+        self.assertEqual(response.status_code, 302)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith("pbkdf2_sha256$2000$"))
+        self.assertTrue(self.user.check_password("testpassword"))
+
     def test_failure_post_with_not_exists_user(self):
         invalid_data = {
             "username": "unknown",
@@ -275,6 +362,40 @@ class TestLoginView(TestCase):
         self.assertIn("このフィールドは必須です。", form.errors["password"])
 
 
+class TestCachedAuthentication(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="tester", password="testpassword")
+        self.client.login(username="tester", password="testpassword")
+
+    def test_warm_request_needs_no_auth_queries(self):
+        url = reverse("welcome:welcome")
+        self.client.get(url)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertTrue(response.context["user"].is_authenticated)
+
+    def test_cached_user_is_invalidated_on_save(self):
+        url = reverse("welcome:welcome")
+        self.client.get(url)
+
+        self.user.first_name = "renamed"
+        self.user.save()
+
+        response = self.client.get(url)
+        self.assertEqual(response.context["user"].first_name, "renamed")
+
+    def test_password_change_logs_out_other_sessions(self):
+        self.client.get(reverse("welcome:welcome"))
+
+        self.user.set_password("newpassword")
+        self.user.save()
+
+        response = self.client.get(reverse("welcome:welcome"))
+        self.assertFalse(response.context["user"].is_authenticated)
+
+
 class TestLogoutView(TestCase):
     def setUp(self):
         self.url = reverse("accounts:logout")  # logoutページのURLを取得
@@ -285,8 +406,99 @@ class TestLogoutView(TestCase):
         self.assertNotIn(SESSION_KEY, self.client.session)
 
 
-# class TestUserProfileView(TestCase):
-#     def test_success_get(self):
+class TestUserProfileView(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="tester", password="testpassword")
+        self.client.login(username="tester", password="testpassword")
+        self.url = reverse("accounts:user_profile", kwargs={"username": "tester"})
+
+    def test_success_get(self):
+        Tweet.objects.create(author=self.user, content="testtweet")
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "accounts/user_profile.html")
+        self.assertEqual([tweet.content for tweet in response.context["tweet_list"]], ["testtweet"])
+
+    @override_settings(TIMELINE_PAGE_SIZE=2)
+    def test_success_get_with_cursor(self):
+        for i in range(3):
+            Tweet.objects.create(author=self.user, content=str(i))
+
+        response = self.client.get(self.url)
+        first_page = response.context["page_obj"]
+        response = self.client.get(self.url, {"cursor": first_page.next_cursor})
+        second_page = response.context["page_obj"]
+
+        self.assertEqual([tweet.content for tweet in first_page], ["2", "1"])
+        self.assertEqual([tweet.content for tweet in second_page], ["0"])
+        self.assertFalse(second_page.has_next())
+
+    def test_failure_get_with_not_exists_user(self):
+        response = self.client.get(reverse("accounts:user_profile", kwargs={"username": "nobody"}))
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_success_get_redirects_to_canonical_username(self):
+        response = self.client.get(reverse("accounts:user_profile", kwargs={"username": "TESTER"}))
+
+        self.assertRedirects(response, self.url)
+
+    def test_success_get_after_rename(self):
+        self.client.get(self.url)
+
+        self.user.username = "renamed"
+        self.user.save()
+
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        response = self.client.get(reverse("accounts:user_profile", kwargs={"username": "renamed"}))
+        self.assertEqual(response.context["user"], self.user)
+
+
+class TestUsernameResolver(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="tester", password="testpassword")
+
+    def test_warm_lookup_needs_no_queries(self):
+        usernames.get_user_or_404("tester")
+
+        with self.assertNumQueries(0):
+            self.assertEqual(usernames.get_user_or_404("Tester"), self.user)
+
+    def test_missing_names_are_cached_until_created(self):
+        self.assertIsNone(usernames.resolve("nobody"))
+        with self.assertNumQueries(0):
+            self.assertIsNone(usernames.resolve("nobody"))
+
+        nobody = User.objects.create_user(username="nobody", password="testpassword")
+
+        self.assertEqual(usernames.resolve("nobody"), nobody.pk)
+
+    def test_invalid_names_are_not_looked_up(self):
+        with self.assertNumQueries(0):
+            self.assertIsNone(usernames.resolve("no body"))
+            self.assertIsNone(usernames.resolve("a" * 151))
+
+    def test_stale_entry_from_another_process_is_refreshed(self):
+        other = User.objects.create_user(username="other", password="testpassword")
+        # ほかのプロセスで other が tester に名前を変える前の対応が残っている
+        usernames._set_local("other", self.user.pk)
+
+        self.assertEqual(usernames.get_user_or_404("other"), other)
+
+    def test_names_differing_only_in_case_are_rejected(self):
+        with self.assertRaises(IntegrityError):
+            User.objects.create_user(username="TESTER", password="testpassword")
+
+    def test_local_cache_is_bounded(self):
+        with mock.patch.object(usernames, "LOCAL_SIZE", 2):
+            for name in ["a", "b", "tester"]:
+                usernames.resolve(name)
+
+            self.assertEqual(list(usernames._local), ["b", "tester"])
 
 
 # class TestUserProfileEditView(TestCase):
@@ -299,25 +511,326 @@ class TestLogoutView(TestCase):
 #     def test_failure_post_with_incorrect_user(self):
 
 
-# class TestFollowView(TestCase):
-#     def test_success_post(self):
+class TestUserProfileViewQueryBudget(QueryBudgetTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="tester", password="testpassword")
+        self.followees = seed_follow_graph(self.user)
+        self.client.login(username="tester", password="testpassword")
 
-#     def test_failure_post_with_not_exist_user(self):
+    def test_success_get_own_profile_within_budget(self):
+        response = self.client.get(reverse("accounts:user_profile", kwargs={"username": "tester"}))
 
-#     def test_failure_post_with_self(self):
+        self.assertEqual(len(response.context["tweet_list"]), 10)
+        self.assertWithinQueryBudget(response)
 
+    def test_success_get_other_profile_within_budget(self):
+        username = self.followees[0].username
+        response = self.client.get(reverse("accounts:user_profile", kwargs={"username": username}))
 
-# class TestUnfollowView(TestCase):
-#     def test_success_post(self):
+        self.assertTrue(response.context["is_following"])
+        self.assertWithinQueryBudget(response)
 
-#     def test_failure_post_with_not_exist_tweet(self):
 
-#     def test_failure_post_with_incorrect_user(self):
+class TestAsyncUserProfileView(QueryBudgetTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="tester", password="testpassword")
+        self.followees = seed_follow_graph(self.user)
+        self.async_client.force_login(self.user)
 
+    async def test_success_get(self):
+        username = self.followees[0].username
+        response = await self.async_client.get(reverse("accounts:user_profile_async", kwargs={"username": username}))
 
-# class TestFollowingListView(TestCase):
-#     def test_success_get(self):
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "accounts/user_profile.html")
+        self.assertEqual(response.context["user"].username, username)
+        self.assertTrue(response.context["is_following"])
+        self.assertEqual(len(response.context["tweet_list"]), 10)
+        self.assertWithinQueryBudget(response)
 
+    async def test_failure_get_with_not_exists_user(self):
+        response = await self.async_client.get(reverse("accounts:user_profile_async", kwargs={"username": "nobody"}))
 
-# class TestFollowerListView(TestCase):
-#     def test_success_get(self):
+        self.assertEqual(response.status_code, 404)
+
+
+class TestUserProfileViewConditionalGet(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="tester", password="testpassword")
+        self.other = User.objects.create_user(username="other", password="testpassword")
+        self.client.login(username="tester", password="testpassword")
+        # ログインも last_login を保存してスタンプを更新するので、先に済ませておく
+        self.other_client = Client()
+        self.other_client.login(username="other", password="testpassword")
+        self.url = reverse("accounts:user_profile", kwargs={"username": "other"})
+
+    def test_success_get_not_modified_without_queries(self):
+        etag = self.client.get(self.url)["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_success_get_modified_after_follow(self):
+        etag = self.client.get(self.url)["ETag"]
+        graph.follow(self.user, self.other)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context["is_following"])
+
+    def test_success_get_modified_after_tweet(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.other_client.post(reverse("tweets:create"), {"content": "new tweet"})
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertContains(response, "new tweet")
+
+    def test_success_get_modified_after_like_counts_change(self):
+        tweet = Tweet.objects.create(author=self.other, content="tweet")
+        etag = self.client.get(self.url)["ETag"]
+        likes.like(self.other, tweet)
+        likes.flush()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_success_get_not_modified_after_unrelated_like(self):
+        tweet = Tweet.objects.create(author=self.user, content="tweet")
+        etag = self.client.get(self.url)["ETag"]
+        likes.like(self.other, tweet)
+        likes.flush()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+
+
+class TestFollowView(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="tester", password="testpassword")
+        self.followee = User.objects.create_user(username="followee", password="testpassword")
+        self.client.login(username="tester", password="testpassword")
+
+    def test_success_post(self):
+        Tweet.objects.create(author=self.followee, content="before follow")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("accounts:follow", kwargs={"username": "followee"}))
+
+        self.assertRedirects(response, reverse("tweets:home"), status_code=302, target_status_code=200)
+        self.assertTrue(FriendShip.objects.filter(follower=self.user, following=self.followee).exists())
+        self.assertTrue(graph.is_following(self.user.pk, self.followee.pk))
+        self.user.refresh_from_db()
+        self.followee.refresh_from_db()
+        self.assertEqual((self.user.following_count, self.followee.follower_count), (1, 1))
+        # 相手の過去のツイートがタイムラインに取り込まれる
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.user, tweet__author=self.followee).exists())
+
+    def test_success_post_updates_cached_profile_counts(self):
+        # プロフィールを表示してユーザーをキャッシュに入れておく
+        self.client.get(reverse("accounts:user_profile", kwargs={"username": "followee"}))
+
+        self.client.post(reverse("accounts:follow", kwargs={"username": "followee"}))
+
+        response = self.client.get(reverse("accounts:user_profile", kwargs={"username": "followee"}))
+        self.assertEqual(response.context["user"].follower_count, 1)
+        response = self.client.get(reverse("accounts:user_profile", kwargs={"username": "tester"}))
+        self.assertEqual(response.context["user"].following_count, 1)
+
+        self.client.post(reverse("accounts:unfollow", kwargs={"username": "followee"}))
+
+        response = self.client.get(reverse("accounts:user_profile", kwargs={"username": "followee"}))
+        self.assertEqual(response.context["user"].follower_count, 0)
+
+    def test_failure_post_with_not_exist_user(self):
+        response = self.client.post(reverse("accounts:follow", kwargs={"username": "unknown"}))
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(FriendShip.objects.exists())
+
+    def test_failure_post_with_self(self):
+        response = self.client.post(reverse("accounts:follow", kwargs={"username": "tester"}))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(FriendShip.objects.exists())
+
+
+class TestUnfollowView(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="tester", password="testpassword")
+        self.followee = User.objects.create_user(username="followee", password="testpassword")
+        self.client.login(username="tester", password="testpassword")
+        graph.follow(self.user, self.followee)
+
+    def test_success_post(self):
+        response = self.client.post(reverse("accounts:unfollow", kwargs={"username": "followee"}))
+
+        self.assertRedirects(response, reverse("tweets:home"), status_code=302, target_status_code=200)
+        self.assertFalse(FriendShip.objects.exists())
+        self.assertFalse(graph.is_following(self.user.pk, self.followee.pk))
+        self.user.refresh_from_db()
+        self.followee.refresh_from_db()
+        self.assertEqual((self.user.following_count, self.followee.follower_count), (0, 0))
+
+    def test_failure_post_with_not_exist_tweet(self):
+        response = self.client.post(reverse("accounts:unfollow", kwargs={"username": "unknown"}))
+
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(FriendShip.objects.exists())
+
+    def test_failure_post_with_incorrect_user(self):
+        response = self.client.post(reverse("accounts:unfollow", kwargs={"username": "tester"}))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(FriendShip.objects.exists())
+
+
+class TestFollowingListView(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="tester", password="testpassword")
+        self.client.login(username="tester", password="testpassword")
+
+    def test_success_get(self):
+        followee = User.objects.create_user(username="followee", password="testpassword")
+        graph.follow(self.user, followee)
+
+        response = self.client.get(reverse("accounts:following_list", kwargs={"username": "tester"}))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["user_list"], [followee])
+
+
+class TestFollowerListView(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="tester", password="testpassword")
+        self.client.login(username="tester", password="testpassword")
+
+    def test_success_get(self):
+        follower = User.objects.create_user(username="follower", password="testpassword")
+        graph.follow(follower, self.user)
+
+        response = self.client.get(reverse("accounts:follower_list", kwargs={"username": "tester"}))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["user_list"], [follower])
+
+
+class TestFollowGraph(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create_user(username=f"user{i}", password="testpassword") for i in range(4)]
+
+    def test_followee_ids_are_cached(self):
+        for followee in reversed(self.users[1:]):
+            graph.follow(self.users[0], followee)
+        graph.followee_ids(self.users[0].pk)
+
+        with self.assertNumQueries(0):
+            followees = graph.followee_ids(self.users[0].pk)
+            self.assertEqual(list(followees), [user.pk for user in self.users[1:]])
+            self.assertIn(self.users[2].pk, followees)
+            self.assertNotIn(self.users[0].pk, followees)
+
+    def test_follow_invalidates_cache(self):
+        graph.followee_ids(self.users[0].pk)
+
+        graph.follow(self.users[0], self.users[1])
+
+        with self.assertNumQueries(1):
+            self.assertTrue(graph.is_following(self.users[0].pk, self.users[1].pk))
+        with self.assertNumQueries(0):
+            self.assertTrue(graph.is_following(self.users[0].pk, self.users[1].pk))
+
+    def test_unfollow_invalidates_cache(self):
+        graph.follow(self.users[0], self.users[1])
+        graph.followee_ids(self.users[0].pk)
+
+        graph.unfollow(self.users[0], self.users[1])
+
+        with self.assertNumQueries(1):
+            self.assertFalse(graph.is_following(self.users[0].pk, self.users[1].pk))
+        with self.assertNumQueries(0):
+            self.assertFalse(graph.is_following(self.users[0].pk, self.users[1].pk))
+
+
+class TestUserAdmin(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username="admin", password="testpassword")
+        self.client.force_login(self.admin)
+        for username in ["Alice", "alex", "malice"]:
+            User.objects.create_user(username=username, email=f"{username.lower()}@example.com")
+        self.url = reverse("admin:accounts_user_changelist")
+
+    def usernames(self, response):
+        return [user.username for user in response.context["cl"].result_list]
+
+    def test_success_get_without_counting_all_rows(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.usernames(response), ["malice", "alex", "Alice", "admin"])
+        self.assertFalse([query["sql"] for query in queries if "COUNT(" in query["sql"]])
+
+    def test_search_by_prefix(self):
+        response = self.client.get(self.url, {"q": "AL"})
+
+        self.assertEqual(self.usernames(response), ["alex", "Alice"])
+
+    def test_search_by_email_prefix_and_id(self):
+        alex = User.objects.get(username="alex")
+
+        self.assertEqual(self.usernames(self.client.get(self.url, {"q": "alex@"})), ["alex"])
+        self.assertEqual(self.usernames(self.client.get(self.url, {"q": str(alex.pk)})), ["alex"])
+
+    def test_keyset_pagination(self):
+        with mock.patch.object(UserAdmin, "list_per_page", 3):
+            first_page = self.client.get(self.url)
+            second_page = self.client.get(self.url + first_page.context["cl"].next_url)
+
+        self.assertEqual(self.usernames(first_page), ["malice", "alex", "Alice"])
+        self.assertEqual(self.usernames(second_page), ["admin"])
+        self.assertIsNone(second_page.context["cl"].next_url)
+        self.assertContains(second_page, "最初へ")
+
+    def test_failure_get_with_invalid_cursor(self):
+        response = self.client.get(self.url, {"before": "x"})
+
+        self.assertRedirects(response, f"{self.url}?e=1", fetch_redirect_response=False)
+
+
+class TestRecountCommand(TestCase):
+    def test_recount_repairs_counters(self):
+        users = [User.objects.create_user(username=f"user{i}", password="testpassword") for i in range(3)]
+        FriendShip.objects.create(follower=users[0], following=users[1])
+        FriendShip.objects.create(follower=users[2], following=users[1])
+        Tweet.objects.create(author=users[1], content="testtweet")
+        User.objects.filter(pk=users[0].pk).update(follower_count=5)
+
+        call_command("recount", "--chunk-size=2", stdout=StringIO())
+
+        self.assertEqual(
+            list(User.objects.order_by("pk").values_list("follower_count", "following_count", "tweet_count")),
+            [(0, 1, 0), (2, 0, 1), (0, 1, 0)],
+        )
+
+    def test_recount_clears_cached_users(self):
+        cache.clear()
+        user = User.objects.create_user(username="user0", password="testpassword")
+        backends.cached_user(user.pk)
+        User.objects.filter(pk=user.pk).update(tweet_count=5)
+
+        call_command("recount", stdout=StringIO())
+
+        self.assertEqual(backends.cached_user(user.pk).tweet_count, 0)
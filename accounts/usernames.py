@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.core.cache import cache
+from django.db.models.functions import Lower
+from django.http import Http404
+
+from .backends import acached_user, cached_user
+from .models import User
+
+# プロフィールの URL のユーザー名からユーザーを引く。大文字と小文字は区別しない。
+# ユーザー名 → ID は、プロセス内の LRU（LOCAL_SIZE 件・LOCAL_TIMEOUT 秒）→ 共有キャッシュ → DB の順に引き、
+# 存在しない名前も NEGATIVE_TIMEOUT 秒覚えておく（存在しない名前を総当たりするクローラーに DB を叩かせない）。
+# ID からユーザーは accounts.backends のキャッシュから読む。
+# ユーザー名を変えたら accounts.signals で新旧の名前を invalidate() する。ほかのプロセスの LRU は消せないので、
+# 引いたユーザーの名前が違っていたら古い対応とみなして引き直す。
+CACHE_KEY = "accounts:username:{}"
+CACHE_TIMEOUT = 60 * 60 * 24
+NEGATIVE_TIMEOUT = 60 * 5
+LOCAL_SIZE = 10000
+LOCAL_TIMEOUT = 30
+# キャッシュに「存在しない」を入れるときの値（get() が返す None と区別する）
+MISSING = 0
+
+_lock = threading.Lock()
+_local = OrderedDict()
+_validator = UnicodeUsernameValidator()
+
+
+def normalize(username):
+    # SQLite の LOWER() は ASCII の文字しか変えないので、それに合わせる
+    return "".join(c.lower() if c.isascii() else c for c in username)
+
+
+def _is_valid(username):
+    # ユーザー名に使えない文字を含む URL はキャッシュにも入れずに 404 にする
+    return len(username) <= User._meta.get_field("username").max_length and bool(_validator.regex.search(username))
+
+
+def _get_local(key):
+    with _lock:
+        entry = _local.get(key)
+        if entry is None:
+            return None
+        user_id, expires_at = entry
+        if expires_at < time.monotonic():
+            del _local[key]
+            return None
+        _local.move_to_end(key)
+        return user_id
+
+
+def _set_local(key, user_id):
+    with _lock:
+        _local[key] = (user_id, time.monotonic() + LOCAL_TIMEOUT)
+        _local.move_to_end(key)
+        while len(_local) > LOCAL_SIZE:
+            _local.popitem(last=False)
+
+
+def _query(key):
+    # user_username_lower_unique の一意インデックスを使う
+    return (
+        User.objects.alias(username_lower=Lower("username"))
+        .filter(username_lower=key)
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+
+
+def is_taken(username):
+    # 大文字と小文字だけが違う名前も使われているとみなす（キャッシュは見ない）
+    return _query(normalize(username)).exists()
+
+
+def _timeout(user_id):
+    return CACHE_TIMEOUT if user_id else NEGATIVE_TIMEOUT
+
+
+def resolve(username):
+    if not _is_valid(username):
+        return None
+    key = normalize(username)
+    user_id = _get_local(key)
+    if user_id is None:
+        user_id = cache.get(CACHE_KEY.format(key))
+        if user_id is None:
+            user_id = _query(key).first() or MISSING
+            cache.set(CACHE_KEY.format(key), user_id, _timeout(user_id))
+        _set_local(key, user_id)
+    return user_id or None
+
+
+async def aresolve(username):
+    if not _is_valid(username):
+        return None
+    key = normalize(username)
+    user_id = _get_local(key)
+    if user_id is None:
+        user_id = await cache.aget(CACHE_KEY.format(key))
+        if user_id is None:
+            user_id = await _query(key).afirst() or MISSING
+            await cache.aset(CACHE_KEY.format(key), user_id, _timeout(user_id))
+        _set_local(key, user_id)
+    return user_id or None
+
+
+def _matches(user, username):
+    return user is not None and normalize(user.username) == normalize(username)
+
+
+def get_user_or_404(username):
+    # 古い対応を消したら1回だけ引き直す
+    for _ in range(2):
+        user_id = resolve(username)
+        if user_id is None:
+            break
+        user = cached_user(user_id)
+        if _matches(user, username):
+            return user
+        invalidate(username)
+    raise Http404("No user matches the given username.")
+
+
+async def aget_user_or_404(username):
+    for _ in range(2):
+        user_id = await aresolve(username)
+        if user_id is None:
+            break
+        user = await acached_user(user_id)
+        if _matches(user, username):
+            return user
+        await cache.adelete_many(_forget_local([username]))
+    raise Http404("No user matches the given username.")
+
+
+def _forget_local(usernames):
+    # 共有キャッシュから消すキーを返す
+    keys = {normalize(username) for username in usernames if username}
+    with _lock:
+        for key in keys:
+            _local.pop(key, None)
+    return [CACHE_KEY.format(key) for key in keys]
+
+
+def invalidate(*usernames):
+    cache.delete_many(_forget_local(usernames))
@@ -1,37 +1,142 @@
 from django.conf import settings
-from django.contrib.auth import authenticate, login
+from django.contrib.auth import get_user_model, login
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.contrib.auth.models import User
+from django.http import HttpResponseBadRequest
+from django.shortcuts import redirect
 from django.urls import reverse_lazy
-from django.views.generic import CreateView, TemplateView
+from django.views.generic import CreateView, TemplateView, View
 
+from mysite import versions
+from mysite.pagination import CursorPaginator
+from tweets import cards
+from tweets.models import Tweet
+
+from . import graph, usernames
 from .forms import SignupForm
+from .mixins import AsyncLoginRequiredMixin
+from .models import FriendShip
+
+User = get_user_model()
 
 
 class SignupView(CreateView):
     form_class = SignupForm
+    # ユーザー名の重複は、大文字と小文字を区別しない確認・一意制約（username と LOWER(username)）の検証で3回引く
+    query_budget = 12
     template_name = "accounts/signup.html"
     success_url = reverse_lazy(settings.LOGIN_REDIRECT_URL)
 
     def form_valid(self, form):
         response = super().form_valid(form)
-        username = form.cleaned_data["username"]
-        password = form.cleaned_data["password1"]
-        user = authenticate(self.request, username=username, password=password)
-        login(self.request, user)
+        # 作成したユーザーでそのままログインする（authenticate() でパスワードを再度ハッシュしない）
+        login(self.request, self.object)
         return response
 
 
+@versions.conditional(
+    lambda request, **kwargs: [
+        versions.profile(kwargs["username"]),
+        versions.user(request.user.pk),
+        versions.author(usernames.resolve(kwargs["username"])),
+    ]
+)
 class UserProfileView(LoginRequiredMixin, TemplateView):
-    model = User
+    # ユーザーとフォロー中 ID・表示するユーザーの ID とユーザー（キャッシュが無いとき）・ツイート・いいね済みか
+    query_budget = 6
+    template_name = "accounts/user_profile.html"
+
+    def get(self, request, *args, **kwargs):
+        self.profile_user = usernames.get_user_or_404(kwargs["username"])
+        # 大文字と小文字が違う URL は正しい名前の URL に寄せる
+        if self.profile_user.username != kwargs["username"]:
+            return redirect("accounts:user_profile", username=self.profile_user.username)
+        return super().get(request, *args, **kwargs)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["user"] = user = self.profile_user
+        context["is_following"] = graph.is_following(self.request.user.pk, user.pk)
+        paginator = CursorPaginator(settings.TIMELINE_PAGE_SIZE)
+        context["page_obj"] = page = paginator.paginate_queryset(
+            Tweet.objects.for_author(user.pk), self.request.GET.get("cursor")
+        )
+        # 作者は表示しているユーザーなので、シャードによらず読み直さない
+        for tweet in page.object_list:
+            tweet.author = user
+        cards.prefetch(page.object_list)
+        cards.annotate(page.object_list, self.request.user)
+        context["tweet_list"] = page.object_list
+        return context
+
+
+class AsyncUserProfileView(AsyncLoginRequiredMixin, TemplateView):
+    query_budget = 6
     template_name = "accounts/user_profile.html"
-    context_object_name = "user"
-    slug_field = "username"
-    slug_url_kwarg = "username"
+
+    async def get(self, request, *args, **kwargs):
+        user = await usernames.aget_user_or_404(kwargs["username"])
+        if user.username != kwargs["username"]:
+            return redirect("accounts:user_profile_async", username=user.username)
+        paginator = CursorPaginator(settings.TIMELINE_PAGE_SIZE)
+        page = await paginator.apaginate_queryset(Tweet.objects.for_author(user.pk), request.GET.get("cursor"))
+        for tweet in page.object_list:
+            tweet.author = user
+        await cards.aprefetch(page.object_list)
+        await cards.aannotate(page.object_list, request.user)
+        context = self.get_context_data(
+            user=user,
+            is_following=await graph.ais_following(request.user.pk, user.pk),
+            page_obj=page,
+            tweet_list=page.object_list,
+        )
+        return self.render_to_response(context)
+
+
+class FollowView(LoginRequiredMixin, View):
+    def post(self, request, *args, **kwargs):
+        followee = usernames.get_user_or_404(kwargs["username"])
+        if followee == request.user:
+            return HttpResponseBadRequest("自分自身をフォローすることはできません。")
+        graph.follow(request.user, followee)
+        return redirect("tweets:home")
+
+
+class UnFollowView(LoginRequiredMixin, View):
+    def post(self, request, *args, **kwargs):
+        followee = usernames.get_user_or_404(kwargs["username"])
+        if followee == request.user:
+            return HttpResponseBadRequest("自分自身のフォローを解除することはできません。")
+        graph.unfollow(request.user, followee)
+        return redirect("tweets:home")
+
+
+class FollowingListView(LoginRequiredMixin, TemplateView):
+    template_name = "accounts/following_list.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        profile_user = usernames.get_user_or_404(self.kwargs["username"])
+        paginator = CursorPaginator(settings.TIMELINE_PAGE_SIZE)
+        context["profile_user"] = profile_user
+        context["page_obj"] = page = paginator.paginate_queryset(
+            FriendShip.objects.filter(follower=profile_user).select_related("following"),
+            self.request.GET.get("cursor"),
+        )
+        context["user_list"] = [friendship.following for friendship in page]
+        return context
+
+
+class FollowerListView(LoginRequiredMixin, TemplateView):
+    template_name = "accounts/follower_list.html"
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        username = self.kwargs.get("username")
-        user = User.objects.get(username=username)
-        context["user"] = user
+        profile_user = usernames.get_user_or_404(self.kwargs["username"])
+        paginator = CursorPaginator(settings.TIMELINE_PAGE_SIZE)
+        context["profile_user"] = profile_user
+        context["page_obj"] = page = paginator.paginate_queryset(
+            FriendShip.objects.filter(following=profile_user).select_related("follower"),
+            self.request.GET.get("cursor"),
+        )
+        context["user_list"] = [friendship.follower for friendship in page]
         return context
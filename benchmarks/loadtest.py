@@ -0,0 +1,254 @@
+import asyncio
+import random
+import time
+from collections import Counter
+from itertools import islice
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.signals import request_finished
+from django.db import connections
+from django.middleware.csrf import CSRF_ALLOWED_CHARS, CSRF_SECRET_LENGTH
+from django.test import Client
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from tweets import sharding
+from tweets.models import Tweet
+
+from .stats import summarize
+
+User = get_user_model()
+
+# レイテンシのヒストグラムの区切り（ミリ秒）
+HISTOGRAM_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+DEFAULT_MIX = {"read_timeline": 80, "post_tweet": 10, "like": 8, "follow": 2}
+
+# 同じページの同期ビューと async ビューの組（compare_async で使う）
+READ_SCENARIOS = {
+    "read_timeline": "read_timeline_async",
+    "read_profile": "read_profile_async",
+    "read_welcome": "read_welcome_async",
+}
+SCENARIOS = (*DEFAULT_MIX, *READ_SCENARIOS, *READ_SCENARIOS.values())
+
+
+def parse_mix(value):
+    # "read_timeline=80,post_tweet=10" の形式
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario: {name}")
+        mix[name] = int(weight)
+    return mix
+
+
+def login_sessions(num_users, host):
+    # フォローの多いユーザーから順にログインさせ、(ユーザー, セッションキー) を返す
+    sessions = []
+    for user in User.objects.order_by("-following_count", "pk")[:num_users]:
+        client = Client(HTTP_HOST=host)
+        client.force_login(user)
+        sessions.append((user, client.session.session_key))
+    return sessions
+
+
+def load_targets():
+    recent = [tweets.order_by("-pk").values_list("pk", flat=True)[:1000] for tweets in Tweet.objects.shards()]
+    return {
+        "tweet_ids": list(islice(sharding.merge(recent, key=None, reverse=True), 1000)),
+        "usernames": list(User.objects.order_by("-follower_count").values_list("username", flat=True)[:1000]),
+    }
+
+
+class ASGIClient:
+    # ネットワークを通さずに ASGI アプリケーションを直接呼び出す
+    def __init__(self, application, host):
+        self.application = application
+        self.host = host
+
+    async def request(self, method, path, headers=(), body=b""):
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": b"",
+            "root_path": "",
+            "headers": [(b"host", self.host.encode()), *headers],
+            "client": ("127.0.0.1", 0),
+            "server": (self.host, 80),
+        }
+        request_sent = False
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # クライアントは切断しない
+            await asyncio.Event().wait()
+
+        status = "no_response"
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        await self.application(scope, receive, send)
+        return status
+
+
+class VirtualUser:
+    def __init__(self, client, user, session_key, targets, rng):
+        self.client = client
+        self.user = user
+        self.targets = targets
+        self.random = rng
+        self.csrf_token = get_random_string(CSRF_SECRET_LENGTH, allowed_chars=CSRF_ALLOWED_CHARS)
+        cookie = f"{settings.SESSION_COOKIE_NAME}={session_key}; {settings.CSRF_COOKIE_NAME}={self.csrf_token}"
+        self.headers = [(b"cookie", cookie.encode())]
+
+    async def get(self, path):
+        return await self.client.request("GET", path, self.headers)
+
+    async def post(self, path, data=None):
+        headers = [
+            *self.headers,
+            (b"content-type", b"application/x-www-form-urlencoded"),
+            (b"x-csrftoken", self.csrf_token.encode()),
+        ]
+        return await self.client.request("POST", path, headers, urlencode(data or {}).encode())
+
+    async def read_timeline(self):
+        return await self.get(reverse("tweets:home"))
+
+    async def read_timeline_async(self):
+        return await self.get(reverse("tweets:home_async"))
+
+    async def read_profile(self):
+        username = self.random.choice(self.targets["usernames"])
+        return await self.get(reverse("accounts:user_profile", kwargs={"username": username}))
+
+    async def read_profile_async(self):
+        username = self.random.choice(self.targets["usernames"])
+        return await self.get(reverse("accounts:user_profile_async", kwargs={"username": username}))
+
+    async def read_welcome(self):
+        return await self.get(reverse("welcome:welcome"))
+
+    async def read_welcome_async(self):
+        return await self.get(reverse("welcome:welcome_async"))
+
+    async def post_tweet(self):
+        return await self.post(reverse("tweets:create"), {"content": f"load test {self.random.random()}"})
+
+    async def like(self):
+        tweet_id = self.random.choice(self.targets["tweet_ids"])
+        return await self.post(reverse("tweets:like", kwargs={"pk": tweet_id}))
+
+    async def follow(self):
+        username = self.random.choice(self.targets["usernames"])
+        if username == self.user.username:
+            return await self.read_timeline()
+        return await self.post(reverse("accounts:follow", kwargs={"username": username}))
+
+
+class LoadTest:
+    def __init__(self, application, sessions, targets, mix=None, host="localhost", seed=0):
+        # sessions は (ユーザー, セッションキー) のリスト。1件が1仮想ユーザーになる
+        self.client = ASGIClient(application, host)
+        self.mix = mix or DEFAULT_MIX
+        self.random = random.Random(seed)
+        self.virtual_users = [
+            VirtualUser(self.client, user, session_key, targets, random.Random(self.random.random()))
+            for user, session_key in sessions
+        ]
+        self.durations = {name: [] for name in self.mix}
+        self.statuses = {name: Counter() for name in self.mix}
+        self.exceptions = Counter()
+
+    async def run(self, duration=None, requests=None):
+        # asyncio.run() で呼ぶ。async_to_sync() で呼ぶと同期ビューがすべて呼び出し元のスレッドに戻され、
+        # 1件ずつしか実行されない（ASGIHandler がリクエストごとに作る ThreadSensitiveContext が効かない）
+        self.deadline = time.perf_counter() + duration if duration else None
+        self.remaining = requests
+        # リクエストごとに別のスレッドで DB に接続するので、終わったスレッドの接続を残さない
+        request_finished.connect(_close_connections)
+        try:
+            start = time.perf_counter()
+            await asyncio.gather(*(self.run_virtual_user(virtual_user) for virtual_user in self.virtual_users))
+            elapsed = time.perf_counter() - start
+        finally:
+            request_finished.disconnect(_close_connections)
+        return self.report(elapsed)
+
+    def should_continue(self):
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            return False
+        if self.remaining is not None:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+        return True
+
+    async def run_virtual_user(self, virtual_user):
+        names = list(self.mix)
+        weights = list(self.mix.values())
+        while self.should_continue():
+            name = virtual_user.random.choices(names, weights=weights)[0]
+            start = time.perf_counter()
+            try:
+                status = await getattr(virtual_user, name)()
+            except Exception as e:
+                self.exceptions[type(e).__name__] += 1
+                status = "exception"
+            self.durations[name].append(time.perf_counter() - start)
+            self.statuses[name][status] += 1
+
+    def report(self, elapsed):
+        scenarios = {}
+        total = errors = 0
+        for name, durations in self.durations.items():
+            if not durations:
+                continue
+            statuses = self.statuses[name]
+            scenario_errors = sum(n for status, n in statuses.items() if not isinstance(status, int) or status >= 400)
+            total += len(durations)
+            errors += scenario_errors
+            scenarios[name] = {
+                **summarize(durations),
+                "error_rate": scenario_errors / len(durations),
+                "statuses": {str(status): n for status, n in sorted(statuses.items(), key=lambda item: str(item[0]))},
+                "histogram_ms": histogram(durations),
+            }
+        return {
+            "virtual_users": len(self.virtual_users),
+            "elapsed_s": round(elapsed, 3),
+            "requests": total,
+            "requests_per_s": round(total / elapsed, 2) if elapsed else None,
+            "error_rate": errors / total if total else 0,
+            "exceptions": dict(self.exceptions),
+            "scenarios": scenarios,
+        }
+
+
+def _close_connections(**kwargs):
+    connections.close_all()
+
+
+def histogram(durations):
+    buckets = Counter()
+    for duration in durations:
+        ms = duration * 1000
+        label = next((f"<{bound}" for bound in HISTOGRAM_BUCKETS_MS if ms < bound), f">={HISTOGRAM_BUCKETS_MS[-1]}")
+        buckets[label] += 1
+    labels = [f"<{bound}" for bound in HISTOGRAM_BUCKETS_MS] + [f">={HISTOGRAM_BUCKETS_MS[-1]}"]
+    return {label: buckets[label] for label in labels}
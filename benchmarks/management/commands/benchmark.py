@@ -0,0 +1,128 @@
+import json
+import subprocess
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+
+from benchmarks.stats import summarize
+
+User = get_user_model()
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = "主要なページをテストクライアントで繰り返し叩き、レイテンシとクエリ数を JSON で出力します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200, help="ページごとのリクエスト数")
+        parser.add_argument("--warmup", type=int, default=10)
+        parser.add_argument(
+            "--username", help="ログインして閲覧するユーザー（省略時は最も多くフォローしているユーザー）"
+        )
+        parser.add_argument("--password", default="benchmark-password", help="seed_data で指定したパスワード")
+        parser.add_argument("--host", default="localhost")
+        parser.add_argument("--output", help="結果を書き出すファイル（省略時は標準出力）")
+
+    def handle(self, *args, **options):
+        if options["requests"] < 1:
+            raise CommandError("--requests must be at least 1.")
+        if options["warmup"] < 0:
+            raise CommandError("--warmup must not be negative.")
+        if options["username"]:
+            viewer = User.objects.filter(username=options["username"]).first()
+        else:
+            viewer = User.objects.order_by("-following_count", "pk").first()
+        if viewer is None:
+            raise CommandError("No user to benchmark with. Run seed_data first.")
+
+        self.options = options
+        self.viewer = viewer
+        results = {
+            "revision": _git_revision(),
+            "viewer": viewer.username,
+            "requests": options["requests"],
+            "endpoints": {
+                "tweets:home": self.measure(self.logged_in_client(), self.get_home, 200),
+                "accounts:user_profile": self.measure(self.logged_in_client(), self.get_user_profile, 200),
+                "accounts:login": self.measure(self.client(), self.post_login, 302),
+                "accounts:signup": self.measure(None, self.post_signup, 302),
+            },
+        }
+
+        output = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+    def client(self):
+        return Client(HTTP_HOST=self.options["host"])
+
+    def logged_in_client(self):
+        client = self.client()
+        client.force_login(self.viewer)
+        return client
+
+    def get_home(self, client):
+        return client.get(reverse("tweets:home"))
+
+    def get_user_profile(self, client):
+        return client.get(reverse("accounts:user_profile", kwargs={"username": self.viewer.username}))
+
+    def post_login(self, client):
+        return client.post(
+            reverse("accounts:login"), {"username": self.viewer.username, "password": self.options["password"]}
+        )
+
+    def post_signup(self, client):
+        # 登録するとログイン状態になるので、毎回新しいクライアントを使う
+        username = f"signup_{uuid.uuid4().hex[:12]}"
+        return self.client().post(
+            reverse("accounts:signup"),
+            {
+                "username": username,
+                "email": f"{username}@example.com",
+                "password1": "benchmark-password",
+                "password2": "benchmark-password",
+            },
+        )
+
+    def measure(self, client, request, expected_status):
+        for _ in range(self.options["warmup"]):
+            request(client)
+
+        durations = []
+        cpu_times = []
+        query_counts = []
+        errors = 0
+        for _ in range(self.options["requests"]):
+            start = time.perf_counter()
+            cpu_start = time.process_time()
+            response = request(client)
+            cpu_times.append(time.process_time() - cpu_start)
+            durations.append(time.perf_counter() - start)
+            query_counts.append(getattr(response, "query_count", 0))
+            if response.status_code != expected_status:
+                errors += 1
+
+        return {
+            **summarize(durations),
+            # パスワードハッシュのような CPU を使う処理の重さを見る
+            "cpu_ms_per_request": round(sum(cpu_times) / len(cpu_times) * 1000, 3),
+            "queries_per_request": sum(query_counts) / len(query_counts),
+            "errors": errors,
+        }
@@ -0,0 +1,100 @@
+import copy
+import json
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.template.loader import render_to_string
+from django.test import RequestFactory, override_settings
+from django.urls import reverse
+
+from benchmarks.stats import summarize
+from mysite.pagination import CursorPaginator
+from tweets import cards, sharding
+from tweets.models import Tweet
+
+User = get_user_model()
+
+LOADERS = [
+    "django.template.loaders.filesystem.Loader",
+    "django.template.loaders.app_directories.Loader",
+]
+
+# (テンプレートローダー, カードのキャッシュ時間)
+CONFIGURATIONS = {
+    "uncached_loader": (LOADERS, 0),
+    "cached_loader": ([("django.template.loaders.cached.Loader", LOADERS)], 0),
+    "cached_loader_with_card_cache": ([("django.template.loaders.cached.Loader", LOADERS)], 60 * 60),
+}
+
+
+class Command(BaseCommand):
+    help = "ツイートを並べたホームタイムラインの描画時間を、テンプレートローダーとカードのキャッシュの有無で比べます。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tweets", type=int, default=50, help="1ページに並べるツイート数")
+        parser.add_argument("--requests", type=int, default=200, help="設定ごとの描画回数")
+        parser.add_argument("--warmup", type=int, default=5)
+        parser.add_argument("--host", default="localhost")
+        parser.add_argument("--output", help="結果を書き出すファイル（省略時は標準出力）")
+
+    def handle(self, *args, **options):
+        latest = [
+            tweets.select_users("author").order_by("-created_at", "-id")[: options["tweets"]]
+            for tweets in Tweet.objects.shards()
+        ]
+        tweets = list(
+            islice(
+                sharding.merge(latest, key=lambda tweet: (tweet.created_at, tweet.pk), reverse=True), options["tweets"]
+            )
+        )
+        if len(tweets) < options["tweets"]:
+            raise CommandError(f"Need at least {options['tweets']} tweets. Run seed_data first.")
+        viewer = tweets[0].author
+
+        request = RequestFactory().get(reverse("tweets:home"), HTTP_HOST=options["host"])
+        request.user = viewer
+        # 描画だけを測るので、1件多く渡さずに次ページのリンクなしで組み立てる
+        page = CursorPaginator(len(tweets)).make_page(tweets)
+
+        results = {"tweets": len(tweets), "requests": options["requests"], "configurations": {}}
+        for name, (loaders, timeout) in CONFIGURATIONS.items():
+            template_settings = [
+                {
+                    **settings.TEMPLATES[0],
+                    "APP_DIRS": False,
+                    "OPTIONS": {**settings.TEMPLATES[0]["OPTIONS"], "loaders": loaders},
+                }
+            ]
+            with override_settings(TEMPLATES=template_settings, TWEET_CARD_CACHE_TIMEOUT=timeout):
+                for _ in range(options["warmup"]):
+                    self.render(request, page)
+                durations = []
+                for _ in range(options["requests"]):
+                    start = time.perf_counter()
+                    self.render(request, page)
+                    durations.append(time.perf_counter() - start)
+            results["configurations"][name] = summarize(durations)
+
+        before = results["configurations"]["uncached_loader"]["mean_ms"]
+        after = results["configurations"]["cached_loader_with_card_cache"]["mean_ms"]
+        results["speedup"] = round(before / after, 2) if after else None
+
+        output = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+    def render(self, request, page):
+        # リクエストごとに DB から読み直したのと同じ状態（描画済みのカードを持たない）にする
+        tweet_list = [copy.copy(tweet) for tweet in page.object_list]
+        for tweet in tweet_list:
+            tweet.__dict__.pop("_card_html", None)
+        cards.prefetch(tweet_list)
+        return render_to_string(
+            "tweets/home.html", {"page_obj": page, "tweet_list": tweet_list, "user": request.user}, request=request
+        )
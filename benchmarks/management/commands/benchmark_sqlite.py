@@ -0,0 +1,141 @@
+import json
+import random
+import threading
+import time
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from benchmarks.loadtest import load_targets
+from benchmarks.stats import summarize
+from mysite.db import is_lock_error
+from tweets import likes
+
+User = get_user_model()
+
+# SQLite の既定の設定と、mysite/settings_production.py の SQLITE_PRAGMAS
+PROFILES = {
+    "default": {"journal_mode": "delete", "synchronous": "full"},
+    "production": {
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "cache_size": -64000,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "memory",
+        "busy_timeout": 5000,
+    },
+}
+
+
+class Command(BaseCommand):
+    help = "書き込むスレッドと読み出すスレッドを同時に動かし、SQLite の PRAGMA の設定ごとにスループットとロックエラーを比べます。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--writers", type=int, default=4, help="ツイートといいねを書き込むスレッド数")
+        parser.add_argument("--readers", type=int, default=4, help="ホームタイムラインを読み出すスレッド数")
+        parser.add_argument("--requests", type=int, default=100, help="スレッドごとのリクエスト数")
+        parser.add_argument("--profile", choices=PROFILES, action="append", help="比べる設定（既定はすべて）")
+        parser.add_argument("--host", default="localhost")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="結果を書き出すファイル（省略時は標準出力）")
+
+    def handle(self, *args, **options):
+        users = self.load_users(options["writers"] + options["readers"])
+        targets = load_targets()
+        if not targets["tweet_ids"]:
+            raise CommandError("No tweets to like. Run seed_data first.")
+        rng = random.Random(options["seed"])
+
+        journal_mode = self.pragma("journal_mode")
+        results = {"writers": options["writers"], "readers": options["readers"], "profiles": {}}
+        try:
+            for name in options["profile"] or PROFILES:
+                with override_settings(SQLITE_PRAGMAS=PROFILES[name]):
+                    # 新しい接続から設定が効くので、開いている接続を閉じてから始める
+                    connections.close_all()
+                    results["profiles"][name] = self.run(users, targets, rng, options)
+        finally:
+            # journal_mode はデータベースファイルに残るので元に戻す
+            connections.close_all()
+            self.pragma(f"journal_mode = {journal_mode}")
+        likes.flush()
+
+        output = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+    def load_users(self, count):
+        users = list(User.objects.order_by("pk")[:count])
+        if len(users) < count:
+            raise CommandError(f"Need at least {count} users. Run seed_data first.")
+        return users
+
+    def pragma(self, statement):
+        with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+            return cursor.execute(f"PRAGMA {statement}").fetchone()[0]
+
+    def run(self, users, targets, rng, options):
+        # 書き込みを始める前に、このスレッドの接続で journal_mode を切り替えておく
+        journal_mode = self.pragma("journal_mode")
+        durations = {"write": [], "read": []}
+        errors = Counter()
+        lock = threading.Lock()
+
+        def worker(client, kind, seed):
+            worker_rng = random.Random(seed)
+            try:
+                for _ in range(options["requests"]):
+                    start = time.perf_counter()
+                    try:
+                        if kind == "write":
+                            self.write(client, targets, worker_rng)
+                        else:
+                            client.get(reverse("tweets:home"))
+                    except Exception as e:
+                        with lock:
+                            errors["database_locked" if is_lock_error(e) else type(e).__name__] += 1
+                        continue
+                    elapsed = time.perf_counter() - start
+                    with lock:
+                        durations[kind].append(elapsed)
+            finally:
+                connections.close_all()
+
+        # ログインは計測に含めないので、スレッドを始める前に済ませておく
+        clients = []
+        for user in users:
+            client = Client(HTTP_HOST=options["host"])
+            client.force_login(user)
+            clients.append(client)
+        kinds = ["write"] * options["writers"] + ["read"] * options["readers"]
+        threads = [
+            threading.Thread(target=worker, args=(client, kind, rng.random())) for client, kind in zip(clients, kinds)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        result = {"journal_mode": journal_mode, "elapsed_s": round(elapsed, 3), "errors": dict(errors)}
+        for kind, values in durations.items():
+            if values:
+                result[kind] = {**summarize(values), "per_s": round(len(values) / elapsed, 1)}
+        return result
+
+    def write(self, client, targets, rng):
+        if rng.random() < 0.5:
+            response = client.post(reverse("tweets:create"), {"content": f"sqlite benchmark {rng.random()}"})
+        else:
+            tweet_id = rng.choice(targets["tweet_ids"])
+            response = client.post(reverse("tweets:like", kwargs={"pk": tweet_id}))
+        if response.status_code >= 400:
+            raise RuntimeError(f"HTTP {response.status_code}")
@@ -0,0 +1,76 @@
+import asyncio
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from benchmarks.loadtest import READ_SCENARIOS, LoadTest, load_targets, login_sessions
+from mysite.asgi import application
+
+
+class Command(BaseCommand):
+    help = "読み込み系のページについて、同期ビューと async ビューのスループットを同じ同時実行数で比べます。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100, help="仮想ユーザー数（同時実行数）")
+        parser.add_argument("--requests", type=int, default=2000, help="1回の計測あたりの総リクエスト数")
+        parser.add_argument("--warmup", type=int, default=50)
+        parser.add_argument(
+            "--scenario",
+            action="append",
+            choices=list(READ_SCENARIOS),
+            help="比べるページ（複数指定可。省略時はすべて）",
+        )
+        parser.add_argument("--host", default="localhost")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="結果を書き出すファイル（省略時は標準出力）")
+
+    def handle(self, *args, **options):
+        sessions = login_sessions(options["users"], options["host"])
+        if not sessions:
+            raise CommandError("No users to run the benchmark with. Run seed_data first.")
+        self.options = options
+        self.sessions = sessions
+        self.targets = load_targets()
+
+        results = {"virtual_users": len(sessions), "requests": options["requests"], "scenarios": {}}
+        for sync_name in options["scenario"] or READ_SCENARIOS:
+            async_name = READ_SCENARIOS[sync_name]
+            sync_result = self.run(sync_name)
+            async_result = self.run(async_name)
+            results["scenarios"][sync_name] = {
+                "sync": sync_result,
+                "async": async_result,
+                "speedup": (
+                    round(async_result["requests_per_s"] / sync_result["requests_per_s"], 2)
+                    if sync_result["requests_per_s"]
+                    else None
+                ),
+            }
+
+        output = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+    def run(self, name):
+        def load_test():
+            return LoadTest(
+                application,
+                self.sessions,
+                self.targets,
+                mix={name: 1},
+                host=self.options["host"],
+                seed=self.options["seed"],
+            )
+
+        if self.options["warmup"]:
+            asyncio.run(load_test().run(requests=self.options["warmup"]))
+        report = asyncio.run(load_test().run(requests=self.options["requests"]))
+        return {
+            "requests_per_s": report["requests_per_s"],
+            "error_rate": report["error_rate"],
+            "exceptions": report["exceptions"],
+            **{key: report["scenarios"][name][key] for key in ("p50_ms", "p95_ms", "p99_ms", "max_ms")},
+        }
@@ -0,0 +1,56 @@
+import asyncio
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from benchmarks.loadtest import DEFAULT_MIX, LoadTest, load_targets, login_sessions, parse_mix
+from mysite.asgi import application
+from tweets import likes
+
+
+class Command(BaseCommand):
+    help = "mysite.asgi.application をプロセス内で直接呼び出し、同時アクセス時のスループットを計測します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=20, help="仮想ユーザー数（同時実行数）")
+        parser.add_argument("--duration", type=float, default=10, help="計測時間（秒）")
+        parser.add_argument("--requests", type=int, help="総リクエスト数（指定すると --duration より優先）")
+        parser.add_argument(
+            "--mix",
+            type=parse_mix,
+            default=DEFAULT_MIX,
+            help="シナリオの比率。例: read_timeline=80,post_tweet=10,like=8,follow=2",
+        )
+        parser.add_argument("--host", default="localhost")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="結果を書き出すファイル（省略時は標準出力）")
+
+    def handle(self, *args, **options):
+        sessions = login_sessions(options["users"], options["host"])
+        if not sessions:
+            raise CommandError("No users to run the load test with. Run seed_data first.")
+        targets = load_targets()
+        if not targets["tweet_ids"]:
+            raise CommandError("No tweets to like. Run seed_data first.")
+
+        load_test = LoadTest(
+            application,
+            sessions,
+            targets,
+            mix=options["mix"],
+            host=options["host"],
+            seed=options["seed"],
+        )
+        if options["requests"]:
+            results = asyncio.run(load_test.run(requests=options["requests"]))
+        else:
+            results = asyncio.run(load_test.run(duration=options["duration"]))
+        # 計測中に溜まったいいね数をこのプロセスが終わる前に反映しておく
+        likes.flush()
+
+        output = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,145 @@
+import random
+from itertools import accumulate, islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from accounts.models import FriendShip
+from mysite.routers import use_primary
+from tweets import timeline
+from tweets.models import Like, TimelineEntry, Tweet
+
+User = get_user_model()
+
+
+def _chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = "計測用にユーザー・べき分布のフォローグラフ・ツイート・いいねを生成します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--tweets", type=int, default=10000)
+        parser.add_argument("--likes", type=int, default=20000)
+        parser.add_argument("--follows", type=int, default=20, help="1ユーザーあたりの平均フォロー数")
+        parser.add_argument("--alpha", type=float, default=1.2, help="人気の偏り（Zipf の指数）")
+        parser.add_argument("--prefix", default="bench")
+        parser.add_argument("--password", default="benchmark-password")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+        parser.add_argument("--seed", type=int, default=0)
+
+    # 書き込んだばかりの行を読み直すので、レプリカは使わない
+    @use_primary()
+    def handle(self, *args, **options):
+        self.random = random.Random(options["seed"])
+        self.chunk_size = options["chunk_size"]
+
+        user_ids = self.create_users(options["users"], options["prefix"], options["password"])
+        # 順位 r のユーザーが選ばれる重みを 1 / r^alpha にする（少数の人気ユーザーに集中する）
+        self.cum_weights = list(accumulate(1 / (rank ** options["alpha"]) for rank in range(1, len(user_ids) + 1)))
+        self.user_ids = user_ids
+
+        self.create_follows(options["follows"])
+        tweet_ids = self.create_tweets(options["tweets"])
+        self.create_likes(options["likes"], tweet_ids)
+        self.fill_timelines(tweet_ids)
+
+        call_command("recount", stdout=self.stdout)
+        call_command("reconcile_like_counts", stdout=self.stdout)
+
+    def popular_user_ids(self, k):
+        return self.random.choices(self.user_ids, cum_weights=self.cum_weights, k=k)
+
+    def create_users(self, num_users, prefix, password):
+        # ハッシュ計算は重いので全員同じパスワードハッシュを使う
+        encoded = make_password(password)
+        start = User.objects.filter(username__startswith=f"{prefix}_").count()
+        users = (
+            User(username=f"{prefix}_{i}", email=f"{prefix}_{i}@example.com", password=encoded)
+            for i in range(start, start + num_users)
+        )
+        for chunk in _chunked(users, self.chunk_size):
+            User.objects.bulk_create(chunk)
+        user_ids = list(
+            User.objects.filter(username__startswith=f"{prefix}_").order_by("pk").values_list("pk", flat=True)
+        )
+        self.stdout.write(f"Created {num_users} users.")
+        return user_ids[-num_users:]
+
+    def create_follows(self, average):
+        def edges():
+            for follower_id in self.user_ids:
+                num_follows = min(int(self.random.expovariate(1 / average)) + 1, len(self.user_ids) - 1)
+                for following_id in set(self.popular_user_ids(num_follows)) - {follower_id}:
+                    yield FriendShip(follower_id=follower_id, following_id=following_id)
+
+        created = 0
+        for chunk in _chunked(edges(), self.chunk_size):
+            FriendShip.objects.bulk_create(chunk, ignore_conflicts=True)
+            created += len(chunk)
+        self.stdout.write(f"Created {created} follows.")
+
+    def create_tweets(self, num_tweets):
+        tweets = (
+            Tweet(author_id=author_id, content=f"tweet {i}")
+            for i, author_id in enumerate(self.popular_user_ids(num_tweets))
+        )
+        tweet_ids = []
+        for chunk in _chunked(tweets, self.chunk_size):
+            tweet_ids.extend(tweet.pk for tweet in Tweet.objects.bulk_create(chunk))
+        self.stdout.write(f"Created {num_tweets} tweets.")
+        return tweet_ids
+
+    def create_likes(self, num_likes, tweet_ids):
+        if not tweet_ids:
+            return
+        # 新しいツイートほどいいねされやすくする
+        tweet_weights = list(accumulate(1 / rank for rank in range(1, len(tweet_ids) + 1)))
+        recent_first = tweet_ids[::-1]
+        likes = (
+            Like(user_id=user_id, tweet_id=tweet_id)
+            for user_id, tweet_id in zip(
+                self.random.choices(self.user_ids, k=num_likes),
+                self.random.choices(recent_first, cum_weights=tweet_weights, k=num_likes),
+            )
+        )
+        for chunk in _chunked(likes, self.chunk_size):
+            Like.objects.bulk_create(chunk, ignore_conflicts=True)
+        self.stdout.write(f"Created up to {num_likes} likes.")
+
+    def fill_timelines(self, tweet_ids):
+        # tweets.timeline.fan_out と同じ内容を、ツイートのまとまりごとに一括で書き込む
+        created = 0
+        for chunk in _chunked(tweet_ids, self.chunk_size):
+            tweets = [
+                row
+                for shard_tweets in Tweet.objects.shards()
+                for row in shard_tweets.filter(pk__in=chunk).values_list("pk", "author_id", "created_at")
+            ]
+            author_ids = {author_id for _, author_id, _ in tweets}
+            followers = {}
+            for follower_id, following_id in FriendShip.objects.filter(following_id__in=author_ids).values_list(
+                "follower_id", "following_id"
+            ):
+                followers.setdefault(following_id, []).append(follower_id)
+            # フォロワーが多い作者は fan-out しない（読み出し時に pull される）
+            for author_id, follower_ids in followers.items():
+                if len(follower_ids) >= settings.TIMELINE_FANOUT_FOLLOWER_LIMIT:
+                    follower_ids.clear()
+            entries = (
+                TimelineEntry(owner_id=owner_id, tweet_id=tweet_id, created_at=created_at)
+                for tweet_id, author_id, created_at in tweets
+                for owner_id in [author_id, *followers.get(author_id, [])]
+            )
+            for entry_chunk in _chunked(entries, self.chunk_size):
+                TimelineEntry.objects.bulk_create(entry_chunk, ignore_conflicts=True)
+                created += len(entry_chunk)
+        timeline.trim(self.user_ids)
+        self.stdout.write(f"Created {created} timeline entries.")
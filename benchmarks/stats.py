@@ -0,0 +1,16 @@
+import statistics
+
+
+def summarize(durations):
+    # 秒単位の計測値をミリ秒のパーセンタイルにまとめる
+    durations = sorted(durations)
+    # quantiles は2件以上必要
+    cuts = statistics.quantiles(durations * 2 if len(durations) == 1 else durations, n=100, method="inclusive")
+    return {
+        "count": len(durations),
+        "mean_ms": round(statistics.fmean(durations) * 1000, 3),
+        "p50_ms": round(cuts[49] * 1000, 3),
+        "p95_ms": round(cuts[94] * 1000, 3),
+        "p99_ms": round(cuts[98] * 1000, 3),
+        "max_ms": round(durations[-1] * 1000, 3),
+    }
@@ -0,0 +1,182 @@
+import json
+import threading
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.signals import request_started
+from django.test import TestCase, TransactionTestCase
+
+from accounts.models import FriendShip
+from tweets.models import Like, TimelineEntry, Tweet
+
+User = get_user_model()
+
+
+class TestSeedDataCommand(TestCase):
+    def test_creates_dataset(self):
+        call_command(
+            "seed_data", "--users=20", "--tweets=50", "--likes=40", "--follows=3", "--chunk-size=7", stdout=StringIO()
+        )
+
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(Tweet.objects.count(), 50)
+        self.assertTrue(FriendShip.objects.exists())
+        self.assertTrue(Like.objects.exists())
+        # 作者本人のタイムラインには必ず入る
+        tweet = Tweet.objects.first()
+        self.assertTrue(TimelineEntry.objects.filter(owner_id=tweet.author_id, tweet=tweet).exists())
+        # 件数カラムも実データと一致している
+        user = User.objects.order_by("-follower_count").first()
+        self.assertEqual(user.follower_count, FriendShip.objects.filter(following=user).count())
+        tweet = Tweet.objects.order_by("-like_count").first()
+        self.assertEqual(tweet.like_count, Like.objects.filter(tweet=tweet).count())
+
+
+class TestBenchmarkCommand(TestCase):
+    def setUp(self):
+        cache.clear()
+        call_command("seed_data", "--users=10", "--tweets=30", "--likes=10", stdout=StringIO())
+
+    def test_reports_latency_and_queries(self):
+        stdout = StringIO()
+        call_command("benchmark", "--requests=2", "--warmup=0", "--host=testserver", stdout=stdout)
+
+        results = json.loads(stdout.getvalue())
+        self.assertEqual(
+            set(results["endpoints"]), {"tweets:home", "accounts:user_profile", "accounts:login", "accounts:signup"}
+        )
+        for result in results["endpoints"].values():
+            self.assertEqual(result["errors"], 0)
+            self.assertEqual(result["count"], 2)
+            self.assertGreater(result["queries_per_request"], 0)
+
+    def test_rejects_invalid_counts(self):
+        for args in [["--requests=0"], ["--requests=-1"], ["--warmup=-1"]]:
+            with self.subTest(args=args), self.assertRaises(CommandError):
+                call_command("benchmark", *args, stdout=StringIO())
+
+
+class TestBenchmarkRenderCommand(TestCase):
+    def setUp(self):
+        cache.clear()
+        call_command("seed_data", "--users=10", "--tweets=30", "--likes=10", stdout=StringIO())
+
+    def test_reports_render_time_per_configuration(self):
+        stdout = StringIO()
+        call_command("benchmark_render", "--tweets=20", "--requests=2", "--warmup=1", stdout=stdout)
+
+        results = json.loads(stdout.getvalue())
+        self.assertEqual(
+            set(results["configurations"]), {"uncached_loader", "cached_loader", "cached_loader_with_card_cache"}
+        )
+        for result in results["configurations"].values():
+            self.assertEqual(result["count"], 2)
+        self.assertIsNotNone(results["speedup"])
+
+
+class TestLoadtestCommand(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        call_command("seed_data", "--users=10", "--tweets=30", "--likes=10", stdout=StringIO())
+
+    def test_reports_throughput_per_scenario(self):
+        stdout = StringIO()
+        call_command(
+            "loadtest",
+            "--users=3",
+            "--requests=20",
+            "--mix=read_timeline=1,post_tweet=1,like=1,follow=1",
+            "--host=testserver",
+            stdout=stdout,
+        )
+
+        results = json.loads(stdout.getvalue())
+        self.assertEqual(results["virtual_users"], 3)
+        self.assertEqual(results["requests"], 20)
+        self.assertEqual(results["error_rate"], 0)
+        self.assertGreater(results["requests_per_s"], 0)
+        for result in results["scenarios"].values():
+            self.assertEqual(sum(result["histogram_ms"].values()), result["count"])
+
+    def test_runs_requests_on_separate_threads(self):
+        thread_ids = set()
+
+        def record_thread(**kwargs):
+            thread_ids.add(threading.get_ident())
+
+        request_started.connect(record_thread)
+        try:
+            call_command(
+                "loadtest",
+                "--users=3",
+                "--requests=12",
+                "--mix=read_timeline=1,post_tweet=1",
+                "--host=testserver",
+                stdout=StringIO(),
+            )
+        finally:
+            request_started.disconnect(record_thread)
+
+        self.assertGreater(len(thread_ids), 1)
+
+
+class TestCompareAsyncCommand(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        call_command("seed_data", "--users=10", "--tweets=30", "--likes=10", stdout=StringIO())
+
+    def test_reports_sync_and_async_throughput(self):
+        stdout = StringIO()
+        call_command("compare_async", "--users=3", "--requests=6", "--warmup=0", "--host=testserver", stdout=stdout)
+
+        results = json.loads(stdout.getvalue())
+        self.assertEqual(set(results["scenarios"]), {"read_timeline", "read_profile", "read_welcome"})
+        for result in results["scenarios"].values():
+            for variant in ("sync", "async"):
+                self.assertEqual(result[variant]["error_rate"], 0)
+                self.assertGreater(result[variant]["requests_per_s"], 0)
+            self.assertIsNotNone(result["speedup"])
+
+    def test_runs_sync_views_on_separate_threads(self):
+        thread_ids = set()
+
+        def record_thread(**kwargs):
+            thread_ids.add(threading.get_ident())
+
+        request_started.connect(record_thread)
+        try:
+            call_command(
+                "compare_async",
+                "--users=3",
+                "--requests=6",
+                "--warmup=0",
+                "--scenario=read_timeline",
+                "--host=testserver",
+                stdout=StringIO(),
+            )
+        finally:
+            request_started.disconnect(record_thread)
+
+        self.assertGreater(len(thread_ids), 1)
+
+
+class TestBenchmarkSqliteCommand(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        call_command("seed_data", "--users=10", "--tweets=30", "--likes=10", stdout=StringIO())
+
+    def test_reports_throughput_per_profile(self):
+        stdout = StringIO()
+        call_command(
+            "benchmark_sqlite", "--writers=2", "--readers=1", "--requests=3", "--host=testserver", stdout=stdout
+        )
+
+        results = json.loads(stdout.getvalue())
+        self.assertEqual(set(results["profiles"]), {"default", "production"})
+        # テスト用のデータベースは共有キャッシュのメモリ上の SQLite で、busy_timeout を待たずにロックエラーになる
+        for result in results["profiles"].values():
+            completed = sum(result[kind]["count"] for kind in ("write", "read") if kind in result)
+            self.assertEqual(completed + sum(result["errors"].values()), 9)
+            self.assertEqual(set(result["errors"]) - {"database_locked"}, set())
@@ -0,0 +1,14 @@
+import os
+
+# DJANGO_ENV で使う設定を選ぶ（DJANGO_SETTINGS_MODULE を指定したときはそちらが優先）
+SETTINGS_MODULES = {
+    "development": "mysite.settings",
+    "production": "mysite.settings_production",
+}
+
+
+def settings_module():
+    env = os.environ.get("DJANGO_ENV", "development")
+    if env not in SETTINGS_MODULES:
+        raise ValueError(f"Unknown DJANGO_ENV {env!r}, expected one of {', '.join(SETTINGS_MODULES)}.")
+    return SETTINGS_MODULES[env]
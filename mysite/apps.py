@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+
+
+class MysiteConfig(AppConfig):
+    name = "mysite"
+
+    def ready(self):
+        from .db import configure_sqlite, install_query_recorder
+
+        connection_created.connect(configure_sqlite, dispatch_uid="mysite.db.configure_sqlite")
+        connection_created.connect(install_query_recorder, dispatch_uid="mysite.db.install_query_recorder")
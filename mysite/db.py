@@ -0,0 +1,75 @@
+import contextlib
+import functools
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import OperationalError, connections
+
+# 実行した SQL を知らせる先（record(sql, alias, duration) を持つもの）。
+# ASGI では1つのスレッドの接続を複数のリクエストが使うので、接続ではなく実行中のコンテキストに持たせる
+_query_recorders = ContextVar("mysite.db.query_recorders", default=())
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    # connection_created で呼ばれる。settings.SQLITE_PRAGMAS を新しい接続ごとに設定する
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    # connection_created で呼ばれる。接続し直しても1つだけ付ける。
+    # execute_wrapper() は抜けるときに末尾を外すので、ほかの一時的なラッパーより前に置く
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _record_query)
+
+
+def _record_query(execute, sql, params, many, context):
+    recorders = _query_recorders.get()
+    if not recorders:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - start
+        for recorder in recorders:
+            recorder.record(sql, context["connection"].alias, duration)
+
+
+@contextlib.contextmanager
+def recording_queries(recorder):
+    # この中（と、ここから sync_to_async で呼んだ処理）で実行した SQL を recorder に知らせる
+    token = _query_recorders.set((*_query_recorders.get(), recorder))
+    try:
+        yield recorder
+    finally:
+        _query_recorders.reset(token)
+
+
+def is_lock_error(error):
+    return isinstance(error, OperationalError) and "locked" in str(error)
+
+
+def retry_on_lock(func):
+    # SQLite の書き込みロックが取れなかったとき（database is locked）、少し待ってやり直す。
+    # やり直すのは func 全体なので、func の書き込みは1つのトランザクションに収まっている必要がある。
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(settings.DATABASE_LOCK_RETRIES + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                # 外側のトランザクションの中ではやり直せない（ロールバックされていない）。
+                # func がどのデータベース（シャード）に書くかは分からないので、すべての接続を見る
+                in_atomic_block = any(conn.in_atomic_block for conn in connections.all())
+                if not is_lock_error(e) or in_atomic_block or attempt == settings.DATABASE_LOCK_RETRIES:
+                    raise
+            # 同時に失敗した書き込みが一斉にやり直さないよう、待ち時間をずらす
+            time.sleep(settings.DATABASE_LOCK_RETRY_DELAY * 2**attempt * random.uniform(0.5, 1.5))
+
+    return wrapper
@@ -0,0 +1,83 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from mysite import profiling
+
+
+def summarize(records, limit, sort):
+    durations = [record["duration_ms"] for record in records]
+    functions = {}
+    queries = {}
+    for record in records:
+        for function in record["functions"]:
+            total = functions.setdefault(
+                function["function"], {"function": function["function"], "calls": 0, "own_ms": 0, "cumulative_ms": 0}
+            )
+            # スタックのサンプリングでは呼び出し回数はわからない
+            total["calls"] += function["calls"] or 0
+            total["own_ms"] += function["own_ms"]
+            total["cumulative_ms"] += function["cumulative_ms"]
+        for query in record["queries"]:
+            total = queries.setdefault(
+                query["sql"],
+                {"sql": query["sql"], "database": query["database"], "count": 0, "total_ms": 0, "max_ms": 0},
+            )
+            total["count"] += 1
+            total["total_ms"] += query["duration_ms"]
+            total["max_ms"] = max(total["max_ms"], query["duration_ms"])
+    for function in functions.values():
+        # 1リクエストあたりの時間にする
+        function["own_ms"] = round(function["own_ms"] / len(records), 3)
+        function["cumulative_ms"] = round(function["cumulative_ms"] / len(records), 3)
+    for query in queries.values():
+        query["total_ms"] = round(query["total_ms"], 3)
+    return {
+        "captures": len(records),
+        "modes": sorted({record["mode"] for record in records}),
+        "mean_ms": round(sum(durations) / len(durations), 3),
+        "max_ms": max(durations),
+        "queries_per_request": round(sum(len(record["queries"]) for record in records) / len(records), 1),
+        "hot_functions": sorted(functions.values(), key=lambda function: function[sort], reverse=True)[:limit],
+        "slowest_queries": sorted(queries.values(), key=lambda query: query["max_ms"], reverse=True)[:limit],
+    }
+
+
+class Command(BaseCommand):
+    help = "ProfilingMiddleware の記録を URL 名ごとに集計し、時間のかかった関数と遅い SQL の上位を出します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dir", default=settings.PROFILING_DIR, help="記録のディレクトリ（既定は PROFILING_DIR）")
+        parser.add_argument("--url-name", action="append", help="集計する URL 名（例: tweets:home。既定はすべて）")
+        parser.add_argument("--limit", type=int, default=20, help="URL 名ごとに出す関数と SQL の件数")
+        parser.add_argument(
+            "--sort",
+            choices=["own_ms", "cumulative_ms"],
+            default="own_ms",
+            help="関数を並べる時間（自身だけか配下を含めるか）",
+        )
+        parser.add_argument("--output", help="結果を書き出すファイル（省略時は標準出力）")
+
+    def handle(self, *args, **options):
+        groups = {}
+        for record in profiling.load(options["dir"]):
+            # URL に一致しなかったリクエストはパスでまとめる
+            name = record["url_name"] or record["path"]
+            if options["url_name"] and name not in options["url_name"]:
+                continue
+            groups.setdefault(name, []).append(record)
+        if not groups:
+            raise CommandError(f"No profiles found in {options['dir']}.")
+
+        results = {
+            name: summarize(records, options["limit"], options["sort"])
+            # 合計で時間のかかっている URL から並べる
+            for name, records in sorted(groups.items(), key=lambda item: -sum(r["duration_ms"] for r in item[1]))
+        }
+        output = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,13 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from mysite import profiling
+
+
+class Command(BaseCommand):
+    help = (
+        "リクエストを cProfile で計るときに PROFILING_HEADER に付ける値を出します（PROFILING_TOKEN_MAX_AGE 秒有効）。"
+    )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{settings.PROFILING_HEADER}: {profiling.make_token()}")
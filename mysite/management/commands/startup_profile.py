@@ -0,0 +1,86 @@
+import json
+import re
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.shortcuts import resolve_url
+
+from mysite.startup import PHASE_MARKER
+
+# -X importtime の行。「import time: 自身の時間 | 配下を含めた時間 | モジュール名」（時間はマイクロ秒、名前の字下げは入れ子の深さ）
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$")
+
+
+def parse_importtime(lines):
+    # 段階ごとに、モジュールの import 時間（ミリ秒）を集める
+    phase = None
+    imports = []
+    for line in lines:
+        if line.startswith(PHASE_MARKER):
+            phase = line[len(PHASE_MARKER) :].strip()
+            continue
+        match = IMPORT_LINE.match(line)
+        if match is None or phase is None:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        imports.append(
+            {
+                "module": module,
+                "phase": phase,
+                # 字下げの無いものは、ほかのモジュールの中からではなく直接 import されたもの
+                "top_level": not indent,
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+            }
+        )
+    return imports
+
+
+class Command(BaseCommand):
+    help = (
+        "新しいプロセスで mysite.wsgi.application を起動し、import・django.setup()・最初のリクエストにかかる時間を計ります。"
+        "--settings（DJANGO_SETTINGS_MODULE）の設定で起動します。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", help="最初のリクエストのパス（既定はログイン画面）")
+        parser.add_argument("--host", default="localhost")
+        parser.add_argument("--limit", type=int, default=20, help="表示する import の件数（配下を含めた時間の長い順）")
+        parser.add_argument(
+            "--skip-imports",
+            action="store_true",
+            help="import ごとの時間を計らない（-X importtime の負荷の分だけ速くなる）",
+        )
+        parser.add_argument("--output", help="結果を書き出すファイル（省略時は標準出力）")
+
+    def handle(self, *args, **options):
+        # 計るプロセスで URLconf を先に読み込まないよう、パスはここで決める
+        path = options["path"] or resolve_url(settings.LOGIN_URL)
+        command = [sys.executable, "-m", "mysite.startup", "--path", path, "--host", options["host"]]
+        if not options["skip_imports"]:
+            command[1:1] = ["-X", "importtime"]
+        # このプロセスで読み込んだモジュールを使わないよう、別のプロセスで計る
+        process = subprocess.run(command, capture_output=True, text=True, cwd=settings.BASE_DIR)
+        if process.returncode:
+            raise CommandError(f"Startup failed:\n{process.stderr[-4000:]}")
+
+        results = json.loads(process.stdout)
+        imports = parse_importtime(process.stderr.splitlines())
+        results["imports_by_phase_ms"] = {
+            phase: round(
+                sum(entry["cumulative_ms"] for entry in imports if entry["phase"] == phase and entry["top_level"]), 3
+            )
+            for phase in dict.fromkeys(entry["phase"] for entry in imports)
+        }
+        results["slowest_imports"] = sorted(imports, key=lambda entry: entry["cumulative_ms"], reverse=True)[
+            : options["limit"]
+        ]
+
+        output = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,180 @@
+import logging
+import threading
+import time
+from contextlib import nullcontext
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+
+from . import profiling
+from .db import recording_queries
+from .routers import use_primary
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def record(self, sql, alias, duration):
+        self.count += 1
+        self.duration += duration
+
+
+class QueryBudgetMiddleware:
+    # リクエストごとの SQL 発行回数と DB 時間を数える。
+    # ビューに query_budget が宣言されていれば、それを超えたときに警告する。
+    # シャードをまたいで読むビューは、default 以外のシャード1つごとの件数を shard_query_budget に宣言する。
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        with recording_queries(QueryStats()) as stats:
+            response = self.get_response(request)
+        return self.finish(request, response, stats, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        # ORM 呼び出しは別のスレッドで実行されるが、sync_to_async がコンテキストを引き継ぐので数えられる
+        start = time.perf_counter()
+        with recording_queries(QueryStats()) as stats:
+            response = await self.get_response(request)
+        return self.finish(request, response, stats, time.perf_counter() - start)
+
+    def finish(self, request, response, stats, total):
+        budget = _query_budget(request)
+        response.query_count = stats.count
+        response.query_budget = budget
+        if settings.DEBUG:
+            response["Server-Timing"] = ", ".join(
+                [
+                    f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} queries"',
+                    f"total;dur={total * 1000:.1f}",
+                ]
+            )
+        if budget is not None and stats.count > budget:
+            logger.warning(
+                "%s issued %d queries (budget %d).",
+                request.path,
+                stats.count,
+                budget,
+                extra={"request": request},
+            )
+        return response
+
+
+def _query_budget(request):
+    resolver_match = getattr(request, "resolver_match", None)
+    if resolver_match is None:
+        return None
+    view = getattr(resolver_match.func, "view_class", None) or resolver_match.func
+    budget = getattr(view, "query_budget", None)
+    if budget is None:
+        return None
+    return budget + getattr(view, "shard_query_budget", 0) * (len(settings.TWEET_SHARDS) - 1)
+
+
+class ProfilingMiddleware:
+    # 選んだリクエストだけ、関数ごとの時間と SQL を記録する（mysite.profiling）
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        mode = profiling.mode_for(request)
+        if mode is None:
+            return self.get_response(request)
+        capture = profiling.Capture(mode)
+        capture.start()
+        try:
+            with recording_queries(capture.queries):
+                response = self.get_response(request)
+        finally:
+            capture.stop()
+        return self.finish(request, response, capture, mode)
+
+    async def __acall__(self, request):
+        mode = profiling.mode_for(request)
+        if mode is None:
+            return await self.get_response(request)
+        # cProfile はスレッドをまたいで追えないので、イベントループと ORM を実行する同期スレッドのスタックをサンプリングする
+        sync_thread_id = await sync_to_async(threading.get_ident)()
+        capture = profiling.Capture(profiling.SAMPLE, [threading.get_ident(), sync_thread_id])
+        capture.start()
+        try:
+            with recording_queries(capture.queries):
+                response = await self.get_response(request)
+        finally:
+            capture.stop()
+        return self.finish(request, response, capture, mode)
+
+    def finish(self, request, response, capture, mode):
+        try:
+            path = capture.save(request, response)
+        except OSError:
+            # 記録できなくてもリクエストは失敗させない
+            logger.warning("Failed to save a profile of %s.", request.path, exc_info=True)
+            return response
+        if mode == profiling.CPROFILE:
+            # ヘッダーを付けて計ったとき（async ではサンプリングになる）は、どのファイルに書いたかを返す
+            response["X-Profile-Capture"] = path.name
+        return response
+
+
+class ReplicaStickinessMiddleware:
+    # 書き込むリクエスト（GET/HEAD/OPTIONS 以外）はプライマリだけを使い、その後しばらくは
+    # Cookie を付けて同じブラウザからの読み出しもプライマリに向ける（自分の書き込みがすぐ見えるように）
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with self.pinned(request):
+            response = self.get_response(request)
+        return self.remember(request, response)
+
+    async def __acall__(self, request):
+        with self.pinned(request):
+            response = await self.get_response(request)
+        return self.remember(request, response)
+
+    def pinned(self, request):
+        if _is_write(request) or settings.DATABASE_REPLICA_STICKY_COOKIE_NAME in request.COOKIES:
+            return use_primary()
+        return nullcontext()
+
+    def remember(self, request, response):
+        if _is_write(request) and settings.DATABASE_REPLICAS:
+            response.set_cookie(
+                settings.DATABASE_REPLICA_STICKY_COOKIE_NAME,
+                "1",
+                max_age=settings.DATABASE_REPLICA_STICKY_SECONDS,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
+
+
+def _is_write(request):
+    return request.method not in ("GET", "HEAD", "OPTIONS")
@@ -0,0 +1,193 @@
+import cProfile
+import json
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+
+# 遅いページを本番で調べるためのプロファイル（mysite.middleware.ProfilingMiddleware）。
+# 署名したヘッダー（manage.py profile_token）を付けたリクエストは cProfile で、
+# それ以外は PROFILING_SAMPLE_RATE の割合でスタックのサンプリング（cProfile よりずっと軽い）で計る。
+# 関数ごとの時間と SQL の記録を PROFILING_DIR に JSON で書き、新しい PROFILING_MAX_FILES 件だけ残す。
+# manage.py profile_report で URL 名ごとに集計する
+CPROFILE = "cprofile"
+SAMPLE = "sample"
+SALT = "mysite.profiling"
+TOKEN_VALUE = "profile"
+
+
+def make_token():
+    return signing.TimestampSigner(salt=SALT).sign(TOKEN_VALUE)
+
+
+def _is_valid_token(token):
+    try:
+        value = signing.TimestampSigner(salt=SALT).unsign(token, max_age=settings.PROFILING_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return value == TOKEN_VALUE
+
+
+def mode_for(request):
+    # 計らないリクエストでは None を返す
+    token = request.headers.get(settings.PROFILING_HEADER)
+    if token and _is_valid_token(token):
+        return CPROFILE
+    if settings.PROFILING_SAMPLE_RATE and random.random() < settings.PROFILING_SAMPLE_RATE:
+        return SAMPLE
+    return None
+
+
+def _label(filename, line, name):
+    # pstats と同じ「ファイル:行(関数名)」
+    return f"{filename}:{line}({name})"
+
+
+class QueryLog:
+    # 発行した SQL と時間を記録する。パラメーターは個人情報を含みうるので残さない
+    def __init__(self):
+        self.queries = []
+
+    def record(self, sql, alias, duration):
+        self.queries.append({"sql": sql, "database": alias, "duration_ms": round(duration * 1000, 3)})
+
+
+class StackSampler:
+    # 別のスレッドから interval 秒ごとに thread_ids のスレッドのスタックを取る
+    def __init__(self, thread_ids, interval):
+        self.thread_ids = thread_ids
+        self.interval = interval
+        self.own = Counter()
+        self.cumulative = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="mysite-profiling", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in self.thread_ids:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self._sample(frame)
+
+    def _sample(self, frame):
+        code = frame.f_code
+        self.own[_label(code.co_filename, code.co_firstlineno, code.co_name)] += 1
+        # 再帰している関数は1回だけ数える
+        seen = set()
+        while frame is not None:
+            code = frame.f_code
+            label = _label(code.co_filename, code.co_firstlineno, code.co_name)
+            if label not in seen:
+                seen.add(label)
+                self.cumulative[label] += 1
+            frame = frame.f_back
+
+    def functions(self):
+        ms = self.interval * 1000
+        return [
+            {
+                "function": label,
+                "calls": None,
+                "own_ms": round(self.own[label] * ms, 3),
+                "cumulative_ms": round(count * ms, 3),
+            }
+            for label, count in self.cumulative.items()
+        ]
+
+
+class Capture:
+    def __init__(self, mode, thread_ids=None):
+        self.mode = mode
+        self.queries = QueryLog()
+        if mode == CPROFILE:
+            self.profiler = cProfile.Profile()
+        else:
+            self.profiler = StackSampler(thread_ids or [threading.get_ident()], settings.PROFILING_SAMPLE_INTERVAL)
+
+    def start(self):
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+        if self.mode == CPROFILE:
+            self.profiler.enable()
+        else:
+            self.profiler.start()
+
+    def stop(self):
+        if self.mode == CPROFILE:
+            self.profiler.disable()
+        else:
+            self.profiler.stop()
+        self.duration = time.perf_counter() - self._start
+
+    def functions(self):
+        if self.mode == SAMPLE:
+            functions = self.profiler.functions()
+        else:
+            functions = [
+                {
+                    "function": pstats.func_std_string(function),
+                    "calls": calls,
+                    "own_ms": round(own * 1000, 3),
+                    "cumulative_ms": round(cumulative * 1000, 3),
+                }
+                for function, (_, calls, own, cumulative, _) in pstats.Stats(self.profiler).stats.items()
+            ]
+        # 自身の時間と配下を含めた時間のそれぞれで上位のものだけ残す
+        limit = settings.PROFILING_MAX_FUNCTIONS
+        by_own = sorted(functions, key=lambda function: function["own_ms"], reverse=True)[:limit]
+        by_cumulative = sorted(functions, key=lambda function: function["cumulative_ms"], reverse=True)[:limit]
+        return list({function["function"]: function for function in by_own + by_cumulative}.values())
+
+    def save(self, request, response):
+        resolver_match = getattr(request, "resolver_match", None)
+        record = {
+            "url_name": resolver_match.view_name if resolver_match else None,
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "mode": self.mode,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round(self.duration * 1000, 3),
+            "queries": self.queries.queries,
+            "functions": self.functions(),
+        }
+        directory = Path(settings.PROFILING_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        # 名前の順が書いた順になる。途中まで書いたファイルを集計で読まないよう、別名で書いてから置き換える
+        path = directory / f"{time.time_ns()}-{os.getpid()}-{threading.get_ident()}.json"
+        temporary = path.with_suffix(".tmp")
+        temporary.write_text(json.dumps(record))
+        os.replace(temporary, path)
+        _rotate(directory)
+        return path
+
+
+def _rotate(directory):
+    for path in sorted(directory.glob("*.json"))[: -settings.PROFILING_MAX_FILES]:
+        # ほかのプロセスが先に消していることがある
+        path.unlink(missing_ok=True)
+
+
+def load(directory):
+    for path in sorted(Path(directory).glob("*.json")):
+        try:
+            yield json.loads(path.read_text())
+        except (OSError, ValueError):
+            # 読んでいる間に消された
+            continue
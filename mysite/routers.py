@@ -0,0 +1,35 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# 書き込みはプライマリ（default）、読み出しは settings.DATABASE_REPLICAS のレプリカに振り分ける。
+# レプリカは遅れて追いつくので、次のときはプライマリから読む。
+# - use_primary() の中（書き込んだ直後のリクエストなど。mysite.middleware.ReplicaStickinessMiddleware）
+# - プライマリのトランザクションの中（書き込む前に読んだ値が古いと困る）
+_use_primary = ContextVar("use_primary", default=False)
+
+
+@contextmanager
+def use_primary():
+    token = _use_primary.set(True)
+    try:
+        yield
+    finally:
+        _use_primary.reset(token)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not settings.DATABASE_REPLICAS or _use_primary.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # どのデータベースも同じ内容を持つ
+        return True
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -40,9 +41,15 @@ INSTALLED_APPS = [
     "accounts.apps.AccountsConfig",
     "tweets.apps.TweetsConfig",
     "welcome.apps.WelcomeConfig",
+    "benchmarks.apps.BenchmarksConfig",
+    "tasks.apps.TasksConfig",
+    "mysite.apps.MysiteConfig",
 ]
 
 MIDDLEWARE = [
+    "mysite.middleware.ProfilingMiddleware",
+    "mysite.middleware.QueryBudgetMiddleware",
+    "mysite.middleware.ReplicaStickinessMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -80,9 +87,71 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
-    }
+        # テストもファイルに置く。インメモリの共有キャッシュはテーブル単位でロックし、待たずに失敗するので、
+        # 負荷試験（benchmarks.loadtest）で書き込みが並ぶと本番と違う失敗になる
+        "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
+    },
+    # 読み出し用のレプリカ（プライマリから複製されたファイル）。テストでは別の SQLite ファイルを使う
+    "replica": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.environ.get("DATABASE_REPLICA_NAME", BASE_DIR / "db.replica.sqlite3"),
+        "TEST": {"NAME": BASE_DIR / "test_db.replica.sqlite3"},
+    },
 }
 
+# ツイートを作者ごとに振り分けるデータベース（tweets.sharding）。例: TWEET_SHARDS=default,shard1,shard2
+TWEET_SHARDS = os.environ.get("TWEET_SHARDS", "default").split(",")
+# ツイートの ID に入れるプロセスの番号（0〜255）。書き込むプロセスごとに違う値を設定する。
+# 未設定ならプロセス ID から決める（重なることがある）
+TWEET_ID_WORKER = int(os.environ["TWEET_ID_WORKER"]) if os.environ.get("TWEET_ID_WORKER") else None
+# default 以外のシャードは別の SQLite ファイルに置く。テストでは shard1 を使う
+for alias in sorted({*TWEET_SHARDS, "shard1"} - DATABASES.keys()):
+    DATABASES[alias] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / f"db.{alias}.sqlite3",
+        "TEST": {"NAME": BASE_DIR / f"test_db.{alias}.sqlite3"},
+    }
+
+DATABASE_ROUTERS = ["tweets.routers.TweetShardRouter", "mysite.routers.PrimaryReplicaRouter"]
+# 読み出しを振り分けるレプリカ。DATABASE_REPLICA_NAME を指定したときだけ使う
+DATABASE_REPLICAS = ["replica"] if os.environ.get("DATABASE_REPLICA_NAME") else []
+# 書き込んだユーザーの読み出しをプライマリに固定しておく時間（秒）。レプリカの遅れより長くする
+DATABASE_REPLICA_STICKY_SECONDS = 5
+DATABASE_REPLICA_STICKY_COOKIE_NAME = "use_primary"
+
+# SQLite の接続ごとに設定する PRAGMA（mysite.db.configure_sqlite）。本番の値は settings_production
+SQLITE_PRAGMAS = {}
+# 書き込みが database is locked で失敗したときにやり直す回数と、最初の待ち時間（秒。回数ごとに倍）
+DATABASE_LOCK_RETRIES = 3
+DATABASE_LOCK_RETRY_DELAY = 0.05
+
+
+# Cache
+# DJANGO_CACHE_DIR を指定するとプロセス間で共有できるファイルキャッシュを使う
+
+if os.environ.get("DJANGO_CACHE_DIR"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.environ["DJANGO_CACHE_DIR"],
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "mysite",
+            "OPTIONS": {"MAX_ENTRIES": 10000},
+        }
+    }
+
+# セッションはキャッシュから読み、書き込みは DB にも行う
+SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
+
+AUTHENTICATION_BACKENDS = [
+    "accounts.backends.CachedModelBackend",
+]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -103,6 +172,18 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# パスワードハッシュの計算コスト。本番は Django の既定値、ローカルやCIでは環境変数で下げられる
+PASSWORD_HASH_ITERATIONS = int(os.environ.get("PASSWORD_HASH_ITERATIONS", 600000))
+
+PASSWORD_HASHERS = [
+    "accounts.hashers.ConfigurablePBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.Argon2PasswordHasher",
+    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+]
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.0/topics/i18n/
 
@@ -135,3 +216,62 @@ AUTH_USER_MODEL = "accounts.User"
 LOGIN_URL = "accounts:login"
 LOGIN_REDIRECT_URL = "tweets:home"
 LOGOUT_REDIRECT_URL = "accounts:login"
+
+# ホームタイムライン
+TIMELINE_PAGE_SIZE = 20
+# 1ユーザーのタイムラインに保持する最大件数
+TIMELINE_MAX_LENGTH = 800
+# 平均してこの回数の書き込みごとに1回タイムラインを切り詰める
+TIMELINE_TRIM_EVERY = 50
+TIMELINE_FANOUT_BATCH_SIZE = 1000
+# これ以上フォロワーがいる作者は fan-out せず、読み出し時に pull する
+TIMELINE_FANOUT_FOLLOWER_LIMIT = 10000
+# フォローしたときに相手の過去ツイートをタイムラインへ取り込む件数
+TIMELINE_BACKFILL_SIZE = 50
+
+# いいね数の書き込みをまとめる件数と間隔（秒）
+LIKE_COUNT_FLUSH_BATCH_SIZE = 100
+LIKE_COUNT_FLUSH_INTERVAL = 5
+
+# ハッシュタグのトレンド（tweets.trending）。直近何時間で数えるか・表示する件数・ランキングを作り直す間隔（秒）
+TRENDING_WINDOW_HOURS = 24
+TRENDING_SIZE = 10
+TRENDING_REFRESH_INTERVAL = 60
+
+# 書き込みの後始末を積むタスクキュー（tasks.queue）。TASKS_EAGER のときは積まずにコミット後にその場で実行する（本番では False にして run_worker を動かす）
+TASKS_EAGER = True
+# ワーカーが1回に取り出す件数・空のときに待つ間隔（秒）・取り出したタスクをほかのワーカーに渡さない時間（秒）
+TASKS_BATCH_SIZE = 100
+TASKS_POLL_INTERVAL = 1
+TASKS_LEASE = 300
+# 失敗したタスクをやり直す回数と、最初の待ち時間（秒。回数ごとに倍）
+TASKS_MAX_ATTEMPTS = 5
+TASKS_RETRY_DELAY = 10
+
+# 新着ツイートの SSE 配信
+# 新着を DB に確認しに行く間隔（秒）。同じプロセス内で作成されたツイートは待たずに届く
+TWEET_STREAM_POLL_INTERVAL = 2
+# 採番してからコミットするまでにかかりうる時間（秒）。この間に採番された ID は読み直して取りこぼさないようにする
+TWEET_STREAM_OVERLAP = 5
+# 接続ごとに溜めておける件数。溢れたらクライアントにページを読み直させる
+TWEET_STREAM_QUEUE_SIZE = 100
+TWEET_STREAM_KEEPALIVE = 15
+# 1本の接続を保つ最長時間（秒）と、切れた後にブラウザが再接続するまでの時間（秒）
+TWEET_STREAM_MAX_DURATION = 300
+TWEET_STREAM_RETRY = 3
+
+# 描画済みツイートカードのキャッシュ時間（秒）。0 にするとキャッシュしない
+TWEET_CARD_CACHE_TIMEOUT = 60 * 60
+
+# 遅いページを調べるプロファイル（mysite.profiling）。manage.py profile_token で作った値を PROFILING_HEADER に付けると cProfile で計る
+PROFILING_HEADER = "X-Profile"
+# profile_token の値の有効期間（秒）
+PROFILING_TOKEN_MAX_AGE = 60 * 60
+# ヘッダーが無くても、この割合のリクエストをスタックのサンプリングで計る（0 から 1）と、サンプリングの間隔（秒）
+PROFILING_SAMPLE_RATE = float(os.environ.get("PROFILING_SAMPLE_RATE", 0))
+PROFILING_SAMPLE_INTERVAL = 0.005
+# 記録を書くディレクトリと、残しておく件数
+PROFILING_DIR = os.environ.get("PROFILING_DIR", BASE_DIR / "profiles")
+PROFILING_MAX_FILES = 500
+# 1件の記録に残す関数の数（自身の時間と配下を含めた時間のそれぞれの上位）
+PROFILING_MAX_FUNCTIONS = 100
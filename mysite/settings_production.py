@@ -0,0 +1,106 @@
+"""
+本番用の設定。DJANGO_ENV=production（または DJANGO_SETTINGS_MODULE=mysite.settings_production）で使う。
+"""
+
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .settings import *  # noqa: F401,F403
+from .settings import DATABASES, INSTALLED_APPS, MIDDLEWARE, TEMPLATES
+
+DEBUG = False
+
+SECRET_KEY = os.environ["DJANGO_SECRET_KEY"]
+
+# カンマ区切り。未設定や空の項目（"a.example.com,"）は除く
+ALLOWED_HOSTS = [host for host in os.environ.get("DJANGO_ALLOWED_HOSTS", "").split(",") if host]
+if not ALLOWED_HOSTS:
+    raise ImproperlyConfigured("Production needs DJANGO_ALLOWED_HOSTS (comma-separated host names).")
+
+# セッション・ログイン中のユーザー・ETag のスタンプ・フォロー中 ID・トレンドは、キャッシュを介してほかのワーカーや
+# run_worker と共有している。プロセスごとの LocMemCache では削除や更新が届かないので、共有できるキャッシュを必須にする
+if os.environ.get("DJANGO_REDIS_URL"):
+    # redis パッケージが必要
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ["DJANGO_REDIS_URL"],
+        }
+    }
+elif os.environ.get("DJANGO_CACHE_DIR"):
+    # 同じマシンのプロセスだけで共有できる
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.environ["DJANGO_CACHE_DIR"],
+        }
+    }
+else:
+    raise ImproperlyConfigured(
+        "Production needs a cache shared by all processes: set DJANGO_REDIS_URL or DJANGO_CACHE_DIR."
+    )
+
+# 管理画面は DJANGO_ADMIN_ENABLED=1 にしたプロセスだけで読み込む。
+# 管理画面と、それだけが使うアプリ（メッセージ・静的ファイル）の import を省き、ワーカーの起動を速くする
+ADMIN_ENABLED = os.environ.get("DJANGO_ADMIN_ENABLED") == "1"
+ADMIN_APPS = ["django.contrib.admin", "django.contrib.messages", "django.contrib.staticfiles"]
+if not ADMIN_ENABLED:
+    INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in ADMIN_APPS]
+    MIDDLEWARE = [
+        middleware for middleware in MIDDLEWARE if middleware != "django.contrib.messages.middleware.MessageMiddleware"
+    ]
+    TEMPLATES = [
+        {
+            **TEMPLATES[0],
+            "OPTIONS": {
+                **TEMPLATES[0]["OPTIONS"],
+                "context_processors": [
+                    processor
+                    for processor in TEMPLATES[0]["OPTIONS"]["context_processors"]
+                    if processor != "django.contrib.messages.context_processors.messages"
+                ],
+            },
+        }
+    ]
+
+# テンプレートは読み込んだものをプロセス内に保持し、ファイルを見に行かない
+TEMPLATES = [
+    {
+        **TEMPLATES[0],
+        "APP_DIRS": False,
+        "OPTIONS": {
+            **TEMPLATES[0]["OPTIONS"],
+            "loaders": [
+                (
+                    "django.template.loaders.cached.Loader",
+                    [
+                        "django.template.loaders.filesystem.Loader",
+                        "django.template.loaders.app_directories.Loader",
+                    ],
+                ),
+            ],
+        },
+    }
+]
+
+# 接続をリクエストをまたいで使い回す（ASGI ではリクエストごとにスレッドが変わるので使い回されない）
+DATABASES = {
+    alias: {**database, "CONN_MAX_AGE": 600, "CONN_HEALTH_CHECKS": True} for alias, database in DATABASES.items()
+}
+
+SQLITE_PRAGMAS = {
+    # 読み出しが書き込みを待たず、書き込みも読み出しを待たない
+    "journal_mode": "wal",
+    # WAL ではコミットごとの fsync を省いても壊れない（電源断で直前のコミットが失われることはある）
+    "synchronous": "normal",
+    # ページキャッシュ 64MiB（負の値は KiB 単位）と、256MiB までのメモリマップ読み出し
+    "cache_size": -64000,
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "memory",
+    # ロックが取れないときにすぐ失敗せず待つ時間（ミリ秒）
+    "busy_timeout": 5000,
+}
+
+# 書き込みの後始末は manage.py run_worker に任せ、レスポンスを待たせない
+TASKS_EAGER = False
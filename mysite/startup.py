@@ -0,0 +1,77 @@
+# 新しいプロセスの起動にかかる時間を計る（manage.py startup_profile が `python -X importtime -m mysite.startup` で実行する）。
+# 段階ごとの時間を JSON で標準出力に書く。import ごとの時間は -X importtime が標準エラーに書くので、
+# どの段階の import かわかるよう、段階の区切りも標準エラーに書いておく
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+from mysite import settings_module
+
+PHASE_MARKER = "startup-phase:"
+
+
+def _phase(name):
+    print(PHASE_MARKER, name, file=sys.stderr, flush=True)
+
+
+def main(path, host):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module())
+    timings = {}
+
+    _phase("import")
+    start = time.perf_counter()
+    import django
+
+    timings["import_ms"] = time.perf_counter() - start
+
+    _phase("setup")
+    start = time.perf_counter()
+    django.setup(set_prefix=False)
+    timings["setup_ms"] = time.perf_counter() - start
+
+    # ミドルウェアを読み込む
+    _phase("application")
+    start = time.perf_counter()
+    from mysite.wsgi import application
+
+    timings["application_ms"] = time.perf_counter() - start
+
+    # URLconf とビューはこのときに読み込まれる
+    _phase("first_request")
+    statuses = []
+    environ = {
+        "REQUEST_METHOD": "GET",
+        "PATH_INFO": path,
+        "QUERY_STRING": "",
+        "SERVER_NAME": host,
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "HTTP_HOST": host,
+        "wsgi.input": io.BytesIO(),
+        "wsgi.errors": sys.stderr,
+        "wsgi.url_scheme": "http",
+    }
+    start = time.perf_counter()
+    response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    try:
+        b"".join(response)
+    finally:
+        response.close()
+    timings["first_request_ms"] = time.perf_counter() - start
+
+    timings = {name: round(seconds * 1000, 3) for name, seconds in timings.items()}
+    timings["total_ms"] = round(sum(timings.values()), 3)
+    json.dump(
+        {"settings": os.environ["DJANGO_SETTINGS_MODULE"], "path": path, "status": statuses[0], **timings}, sys.stdout
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", required=True)
+    parser.add_argument("--host", default="localhost")
+    args = parser.parse_args()
+    main(args.path, args.host)
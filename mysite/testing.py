@@ -0,0 +1,32 @@
+from django.contrib.auth import get_user_model
+
+from accounts import graph
+from tweets import timeline
+from tweets.models import Tweet
+
+User = get_user_model()
+
+
+def seed_follow_graph(viewer, num_users=30, tweets_per_user=10):
+    # viewer と相互フォローしているユーザーたちと、そのツイートを用意する
+    users = User.objects.bulk_create(
+        [User(username=f"seeded{i}", email=f"seeded{i}@example.com") for i in range(num_users)]
+    )
+    for user in users:
+        graph.follow(viewer, user)
+        graph.follow(user, viewer)
+    for author in [viewer, *users]:
+        for i in range(tweets_per_user):
+            timeline.fan_out(Tweet.objects.create(author=author, content=f"{author.username} {i}"))
+    return users
+
+
+class QueryBudgetTestMixin:
+    # QueryBudgetMiddleware が response に付けた件数を、ビューの query_budget と比べる
+    def assertWithinQueryBudget(self, response):
+        self.assertIsNotNone(response.query_budget, "The view does not declare a query_budget.")
+        self.assertLessEqual(
+            response.query_count,
+            response.query_budget,
+            f"{response.query_count} queries issued, budget is {response.query_budget}.",
+        )
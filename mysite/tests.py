@@ -0,0 +1,422 @@
+import asyncio
+import importlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from tweets.views import HomeView
+
+from . import profiling, settings_module
+from .db import configure_sqlite, retry_on_lock
+from .management.commands.startup_profile import parse_importtime
+from .pagination import EstimatedCountPaginator
+from .routers import use_primary
+
+User = get_user_model()
+
+
+class TestQueryBudgetMiddleware(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="tester", password="testpassword")
+        self.client.login(username="tester", password="testpassword")
+        self.async_client.force_login(self.user)
+
+    @override_settings(DEBUG=True)
+    def test_server_timing_header_in_debug(self):
+        response = self.client.get(reverse("tweets:home"))
+
+        self.assertIn(f'desc="{response.query_count} queries"', response["Server-Timing"])
+
+    def test_no_server_timing_header_without_debug(self):
+        response = self.client.get(reverse("tweets:home"))
+        self.assertFalse(response.has_header("Server-Timing"))
+
+    def test_warns_when_budget_is_exceeded(self):
+        with mock.patch.object(HomeView, "query_budget", 1):
+            with self.assertLogs("mysite.middleware", level="WARNING"):
+                response = self.client.get(reverse("tweets:home"))
+
+        self.assertEqual(response.query_budget, 1)
+        self.assertGreater(response.query_count, 1)
+
+    async def test_counts_concurrent_requests_separately(self):
+        # テストの async クライアントでは、どのリクエストの ORM も同じスレッドの同じ接続で動く
+        url = reverse("tweets:home_async")
+        await self.async_client.get(url)
+        alone = (await self.async_client.get(url)).query_count
+
+        responses = await asyncio.gather(*(self.async_client.get(url) for _ in range(3)))
+
+        self.assertEqual([response.query_count for response in responses], [alone] * 3)
+
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class TestPrimaryReplicaRouter(TransactionTestCase):
+    # replica はテスト用の別の SQLite ファイル。複製はされないので、プライマリだけにある行で振り分けを確かめる
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="tester", password="testpassword")
+        self.user.save(using="replica", force_insert=True)
+
+    def test_reads_go_to_replica(self):
+        User.objects.create(username="other")
+
+        self.assertFalse(User.objects.filter(username="other").exists())
+        self.assertTrue(User.objects.using("default").filter(username="other").exists())
+
+    def test_reads_in_transaction_use_primary(self):
+        with transaction.atomic():
+            User.objects.create(username="other")
+            self.assertTrue(User.objects.filter(username="other").exists())
+
+    def test_reads_inside_use_primary_go_to_primary(self):
+        User.objects.create(username="other")
+
+        with use_primary():
+            self.assertTrue(User.objects.filter(username="other").exists())
+
+    def test_write_request_pins_reads_to_primary(self):
+        self.client.force_login(self.user)
+        url = reverse("accounts:user_profile", kwargs={"username": "tester"})
+
+        response = self.client.post(reverse("tweets:create"), {"content": "new tweet"})
+        cookie = response.cookies[settings.DATABASE_REPLICA_STICKY_COOKIE_NAME]
+        self.assertEqual(cookie["max-age"], settings.DATABASE_REPLICA_STICKY_SECONDS)
+        self.assertContains(self.client.get(url), "new tweet")
+
+        # Cookie が切れた後はレプリカから読む
+        del self.client.cookies[settings.DATABASE_REPLICA_STICKY_COOKIE_NAME]
+        self.assertNotContains(self.client.get(url), "new tweet")
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_cookie_without_replicas(self):
+        self.client.force_login(self.user)
+
+        response = self.client.post(reverse("tweets:create"), {"content": "new tweet"})
+
+        self.assertNotIn(settings.DATABASE_REPLICA_STICKY_COOKIE_NAME, response.cookies)
+
+
+class TestSqliteConfiguration(TestCase):
+    # TestCase のトランザクションの中でも変えられる PRAGMA で確かめる
+    @override_settings(SQLITE_PRAGMAS={"cache_size": -4000, "busy_timeout": 1234})
+    def test_applies_pragmas(self):
+        configure_sqlite(sender=None, connection=connection)
+
+        with connection.cursor() as cursor:
+            self.assertEqual(cursor.execute("PRAGMA cache_size").fetchone()[0], -4000)
+            self.assertEqual(cursor.execute("PRAGMA busy_timeout").fetchone()[0], 1234)
+
+
+@override_settings(DATABASE_LOCK_RETRIES=2, DATABASE_LOCK_RETRY_DELAY=0)
+class TestRetryOnLock(TransactionTestCase):
+    databases = {"default", "shard1"}
+
+    def test_retries_until_success(self):
+        func = mock.Mock(side_effect=[OperationalError("database is locked"), "done"])
+
+        self.assertEqual(retry_on_lock(func)(), "done")
+        self.assertEqual(func.call_count, 2)
+
+    def test_gives_up_after_retries(self):
+        func = mock.Mock(side_effect=OperationalError("database is locked"))
+
+        with self.assertRaises(OperationalError):
+            retry_on_lock(func)()
+        self.assertEqual(func.call_count, 3)
+
+    def test_does_not_retry_other_errors(self):
+        func = mock.Mock(side_effect=OperationalError("no such table: foo"))
+
+        with self.assertRaises(OperationalError):
+            retry_on_lock(func)()
+        self.assertEqual(func.call_count, 1)
+
+    def test_does_not_retry_inside_transaction(self):
+        func = mock.Mock(side_effect=OperationalError("database is locked"))
+
+        with self.assertRaises(OperationalError), transaction.atomic():
+            retry_on_lock(func)()
+        self.assertEqual(func.call_count, 1)
+
+    def test_does_not_retry_inside_transaction_on_other_database(self):
+        func = mock.Mock(side_effect=OperationalError("database is locked"))
+
+        with self.assertRaises(OperationalError), transaction.atomic(using="shard1"):
+            retry_on_lock(func)()
+        self.assertEqual(func.call_count, 1)
+
+
+class TestEstimatedCountPaginator(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f"user{i}") for i in range(3)]
+
+    def test_estimate_without_filter(self):
+        paginator = EstimatedCountPaginator(User.objects.order_by("-pk"), 2)
+
+        # 統計が無ければ最大の ID を件数とみなす
+        self.assertEqual(paginator.count, self.users[-1].pk)
+        self.assertTrue(paginator.estimated)
+
+    def test_estimate_from_statistics(self):
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        User.objects.create_user(username="user3")
+
+        self.assertEqual(EstimatedCountPaginator(User.objects.order_by("-pk"), 2).count, 3)
+
+    def test_bounded_count_with_filter(self):
+        queryset = User.objects.filter(username__startswith="user").order_by("-pk")
+
+        self.assertEqual(EstimatedCountPaginator(queryset, 2).count, 3)
+        with mock.patch.object(EstimatedCountPaginator, "count_limit", 2):
+            paginator = EstimatedCountPaginator(queryset, 2)
+            self.assertEqual(paginator.count, 2)
+            self.assertTrue(paginator.estimated)
+
+
+class TestSettingsModule(TestCase):
+    def test_default_is_development(self):
+        with mock.patch.dict(os.environ, clear=True):
+            self.assertEqual(settings_module(), "mysite.settings")
+
+    def test_production(self):
+        with mock.patch.dict(os.environ, {"DJANGO_ENV": "production"}):
+            self.assertEqual(settings_module(), "mysite.settings_production")
+
+    def test_unknown_environment(self):
+        with mock.patch.dict(os.environ, {"DJANGO_ENV": "staging"}):
+            with self.assertRaises(ValueError):
+                settings_module()
+
+
+class TestProductionSettings(TestCase):
+    def load(self, **environ):
+        environ = {"DJANGO_SECRET_KEY": "secret", "DJANGO_ALLOWED_HOSTS": "example.com", **environ}
+        with mock.patch.dict(os.environ, environ):
+            sys.modules.pop("mysite.settings_production", None)
+            try:
+                return importlib.import_module("mysite.settings_production")
+            finally:
+                sys.modules.pop("mysite.settings_production", None)
+
+    def test_allowed_hosts(self):
+        with mock.patch.dict(os.environ, DJANGO_CACHE_DIR="/tmp/mysite-cache"):
+            allowed_hosts = self.load(DJANGO_ALLOWED_HOSTS="example.com,,www.example.com,").ALLOWED_HOSTS
+        self.assertEqual(allowed_hosts, ["example.com", "www.example.com"])
+
+    def test_requires_allowed_hosts(self):
+        with mock.patch.dict(os.environ, DJANGO_CACHE_DIR="/tmp/mysite-cache"):
+            for value in ["", ","]:
+                with self.subTest(value=value), self.assertRaises(ImproperlyConfigured):
+                    self.load(DJANGO_ALLOWED_HOSTS=value)
+
+    def test_requires_shared_cache(self):
+        with mock.patch.dict(os.environ):
+            os.environ.pop("DJANGO_REDIS_URL", None)
+            os.environ.pop("DJANGO_CACHE_DIR", None)
+            with self.assertRaises(ImproperlyConfigured):
+                self.load()
+
+    def test_shared_cache(self):
+        with mock.patch.dict(os.environ):
+            os.environ.pop("DJANGO_REDIS_URL", None)
+            caches = self.load(DJANGO_CACHE_DIR="/tmp/mysite-cache").CACHES
+        self.assertEqual(caches["default"]["BACKEND"], "django.core.cache.backends.filebased.FileBasedCache")
+
+        caches = self.load(DJANGO_REDIS_URL="redis://localhost:6379/0").CACHES
+        self.assertEqual(caches["default"]["BACKEND"], "django.core.cache.backends.redis.RedisCache")
+
+
+class TestStartupProfileCommand(TestCase):
+    IMPORTTIME = "\n".join(
+        [
+            "import time: self [us] | cumulative | imported package",
+            "import time:       100 |        100 | gc",
+            "startup-phase: setup",
+            "import time:       200 |        200 |   django.utils.version",
+            "import time:       300 |        500 | django",
+            "startup-phase: first_request",
+            "import time:      1500 |       1500 | tweets.views",
+        ]
+    )
+
+    def test_parse_importtime(self):
+        imports = parse_importtime(self.IMPORTTIME.splitlines())
+
+        self.assertEqual([entry["module"] for entry in imports], ["django.utils.version", "django", "tweets.views"])
+        self.assertEqual([entry["top_level"] for entry in imports], [False, True, True])
+        self.assertEqual(
+            imports[1], {"module": "django", "phase": "setup", "top_level": True, "self_ms": 0.3, "cumulative_ms": 0.5}
+        )
+
+    def test_report(self):
+        timings = {"path": "/accounts/login/", "status": "200 OK", "setup_ms": 1.0, "first_request_ms": 2.0}
+        process = subprocess.CompletedProcess([], 0, stdout=json.dumps(timings), stderr=self.IMPORTTIME)
+        stdout = StringIO()
+
+        with mock.patch("subprocess.run", return_value=process) as run:
+            call_command("startup_profile", "--limit", "2", stdout=stdout)
+
+        command = run.call_args.args[0]
+        self.assertEqual(command[1:5], ["-X", "importtime", "-m", "mysite.startup"])
+        self.assertIn(reverse(settings.LOGIN_URL), command)
+        results = json.loads(stdout.getvalue())
+        self.assertEqual(results["first_request_ms"], 2.0)
+        self.assertEqual(results["imports_by_phase_ms"], {"setup": 0.5, "first_request": 1.5})
+        self.assertEqual([entry["module"] for entry in results["slowest_imports"]], ["tweets.views", "django"])
+
+    def test_startup_failure(self):
+        process = subprocess.CompletedProcess([], 1, stdout="", stderr="ImportError")
+
+        with mock.patch("subprocess.run", return_value=process):
+            with self.assertRaises(CommandError):
+                call_command("startup_profile", stdout=StringIO())
+
+
+class TestProfilingMiddleware(TestCase):
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.enterContext(override_settings(PROFILING_DIR=self.directory))
+        self.user = User.objects.create_user(username="tester", password="testpassword")
+        self.client.force_login(self.user)
+
+    def captures(self):
+        return list(profiling.load(self.directory))
+
+    def test_no_capture_by_default(self):
+        response = self.client.get(reverse("tweets:home"))
+
+        self.assertFalse(response.has_header("X-Profile-Capture"))
+        self.assertEqual(self.captures(), [])
+
+    def test_capture_with_signed_header(self):
+        response = self.client.get(reverse("tweets:home"), headers={"X-Profile": profiling.make_token()})
+
+        [capture] = self.captures()
+        self.assertTrue((self.directory / response["X-Profile-Capture"]).exists())
+        self.assertEqual(capture["url_name"], "tweets:home")
+        self.assertEqual(capture["mode"], profiling.CPROFILE)
+        self.assertEqual(capture["status"], 200)
+        self.assertEqual(len(capture["queries"]), response.query_count)
+        self.assertTrue(any("tweets/views.py" in function["function"] for function in capture["functions"]))
+
+    def test_ignores_invalid_header(self):
+        self.client.get(reverse("tweets:home"), headers={"X-Profile": "profile:forged"})
+
+        self.assertEqual(self.captures(), [])
+
+    @override_settings(PROFILING_TOKEN_MAX_AGE=-1)
+    def test_ignores_expired_header(self):
+        self.client.get(reverse("tweets:home"), headers={"X-Profile": profiling.make_token()})
+
+        self.assertEqual(self.captures(), [])
+
+    @override_settings(PROFILING_SAMPLE_RATE=1, PROFILING_SAMPLE_INTERVAL=0.001)
+    def test_sampled_capture(self):
+        self.client.get(reverse("tweets:home"))
+
+        [capture] = self.captures()
+        self.assertEqual(capture["mode"], profiling.SAMPLE)
+        self.assertTrue(capture["queries"])
+
+    @override_settings(PROFILING_SAMPLE_RATE=1, PROFILING_SAMPLE_INTERVAL=0.001)
+    def test_sampled_capture_async(self):
+        self.client.get(reverse("tweets:home_async"))
+
+        [capture] = self.captures()
+        self.assertEqual(capture["url_name"], "tweets:home_async")
+        self.assertTrue(capture["queries"])
+
+    @override_settings(PROFILING_SAMPLE_RATE=1, PROFILING_MAX_FILES=2)
+    def test_keeps_latest_captures(self):
+        for _ in range(3):
+            self.client.get(reverse("tweets:home"))
+        self.client.get(reverse("tweets:search"))
+
+        self.assertEqual([capture["url_name"] for capture in self.captures()], ["tweets:home", "tweets:search"])
+
+
+class TestProfileReportCommand(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def write(self, name, record):
+        (self.directory / name).write_text(json.dumps(record))
+
+    def test_report(self):
+        query = {"sql": "SELECT 1", "database": "default"}
+        for i, own_ms in enumerate([2.0, 4.0]):
+            self.write(
+                f"{i}.json",
+                {
+                    "url_name": "tweets:home",
+                    "path": "/tweets/home/",
+                    "mode": profiling.CPROFILE,
+                    "duration_ms": 10.0 * (i + 1),
+                    "queries": [{**query, "duration_ms": 1.0 + i}],
+                    "functions": [
+                        {"function": "views.py:1(get)", "calls": 1, "own_ms": own_ms, "cumulative_ms": 8.0},
+                        {"function": "base.py:1(render)", "calls": 2, "own_ms": 1.0, "cumulative_ms": 1.0},
+                    ],
+                },
+            )
+        self.write(
+            "2.json",
+            {
+                "url_name": None,
+                "path": "/missing/",
+                "mode": profiling.SAMPLE,
+                "duration_ms": 1.0,
+                "queries": [],
+                "functions": [],
+            },
+        )
+        stdout = StringIO()
+
+        call_command("profile_report", "--dir", str(self.directory), "--limit", "1", stdout=stdout)
+
+        results = json.loads(stdout.getvalue())
+        self.assertEqual(list(results), ["tweets:home", "/missing/"])
+        home = results["tweets:home"]
+        self.assertEqual((home["captures"], home["mean_ms"], home["max_ms"]), (2, 15.0, 20.0))
+        self.assertEqual(
+            home["hot_functions"], [{"function": "views.py:1(get)", "calls": 2, "own_ms": 3.0, "cumulative_ms": 8.0}]
+        )
+        self.assertEqual(home["slowest_queries"], [{**query, "count": 2, "total_ms": 3.0, "max_ms": 2.0}])
+
+    def test_no_profiles(self):
+        with self.assertRaises(CommandError):
+            call_command("profile_report", "--dir", str(self.directory), stdout=StringIO())
+
+
+class TestProfileTokenCommand(TestCase):
+    def test_prints_header(self):
+        stdout = StringIO()
+
+        call_command("profile_token", stdout=stdout)
+
+        name, token = stdout.getvalue().strip().split(": ")
+        self.assertEqual(name, settings.PROFILING_HEADER)
+        self.assertTrue(profiling._is_valid_token(token))
@@ -0,0 +1,80 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+
+from django.core.cache import cache
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+# ページの検証子（ETag / Last-Modified）に使うバージョンスタンプ。
+# 表示内容が変わる書き込みのたびに bump() で更新時刻を書き込み、読み出し側はキャッシュを1回引くだけで
+# 変更の有無がわかる。キャッシュから消えていたら今の時刻を入れる（＝変更ありとみなす）。
+CACHE_KEY = "versions:{}"
+CACHE_TIMEOUT = 60 * 60 * 24 * 7
+BUMP_BATCH_SIZE = 1000
+
+# 全員のページに関わるもの（ランキングが変わったときだけ更新する）
+TRENDING = "trending"
+
+
+def timeline(user_id):
+    return f"timeline:{user_id}"
+
+
+def user(user_id):
+    return f"user:{user_id}"
+
+
+def author(user_id):
+    # その作者のツイートを並べるページ（フォロワーのホーム・プロフィール）に関わるもの。
+    # いいね数の反映・pull 対象の作者のツイート・名前の変更で更新する
+    return f"author:{user_id}"
+
+
+def profile(username):
+    return f"profile:{username}"
+
+
+def tweet(tweet_id):
+    return f"tweet:{tweet_id}"
+
+
+def bump(*names):
+    now = time.time()
+    for start in range(0, len(names), BUMP_BATCH_SIZE):
+        cache.set_many({CACHE_KEY.format(name): now for name in names[start : start + BUMP_BATCH_SIZE]}, CACHE_TIMEOUT)
+
+
+def stamps(*names):
+    keys = [CACHE_KEY.format(name) for name in names]
+    found = cache.get_many(keys)
+    missing = {key: time.time() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, CACHE_TIMEOUT)
+    return [found.get(key) or missing[key] for key in keys]
+
+
+def conditional(names):
+    # names(request, **kwargs) が返すスタンプがどれも変わっていなければ、ビューを呼ばずに 304 を返す。
+    # ETag には閲覧者とクエリ文字列（カーソル）も含める。
+    def get_stamps(request, **kwargs):
+        if not hasattr(request, "_version_stamps"):
+            request._version_stamps = stamps(*names(request, **kwargs))
+        return request._version_stamps
+
+    def etag(request, *args, **kwargs):
+        key = repr((request.user.pk, request.get_full_path(), get_stamps(request, **kwargs)))
+        return hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        return datetime.fromtimestamp(max(get_stamps(request, **kwargs)), tz=timezone.utc)
+
+    def decorator(view_class):
+        view_class = method_decorator(condition(etag_func=etag, last_modified_func=last_modified), name="get")(
+            view_class
+        )
+        # ブラウザが推測で古いページを使わないよう、毎回検証させる（304 にも付ける）
+        return method_decorator(cache_control(private=True, no_cache=True), name="get")(view_class)
+
+    return decorator
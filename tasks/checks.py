@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core import checks
+
+# プロセスの中だけで使われるキャッシュ
+LOCAL_CACHE_BACKENDS = {
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+}
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    # ワーカーで実行するタスクは、タイムラインやプロフィールのスタンプ・トレンドをキャッシュに書く。
+    # キャッシュがプロセスごとだと、Web のプロセスからは見えない
+    if settings.TASKS_EAGER or settings.CACHES["default"]["BACKEND"] not in LOCAL_CACHE_BACKENDS:
+        return []
+    return [
+        checks.Error(
+            "Tasks run in a separate worker process, but the default cache is local to each process.",
+            hint="Use a shared cache (DJANGO_REDIS_URL or DJANGO_CACHE_DIR) or set TASKS_EAGER = True.",
+            id="tasks.E001",
+        )
+    ]
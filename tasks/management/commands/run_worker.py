@@ -0,0 +1,39 @@
+import signal
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from tasks import queue
+
+
+class Command(BaseCommand):
+    help = "Task テーブルに積まれたタスクを取り出して実行し続けます。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.TASKS_BATCH_SIZE)
+        parser.add_argument("--poll-interval", type=float, default=settings.TASKS_POLL_INTERVAL)
+        parser.add_argument("--once", action="store_true", help="実行できるタスクが無くなったら終了する")
+
+    def handle(self, *args, batch_size, poll_interval, once, **options):
+        worker = uuid.uuid4().hex
+        self.stopping = False
+        # 実行中のまとまりは最後まで済ませてから止まる
+        signal.signal(signal.SIGTERM, self.stop)
+        processed = 0
+        while not self.stopping:
+            count = queue.run_pending(batch_size, worker=worker)
+            processed += count
+            if count:
+                continue
+            if once:
+                break
+            # 待っている間に接続を持ち続けない
+            connections.close_all()
+            time.sleep(poll_interval)
+        self.stdout.write(f"Processed {processed} tasks.")
+
+    def stop(self, signum, frame):
+        self.stopping = True
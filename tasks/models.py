@@ -0,0 +1,25 @@
+from django.db import models
+
+
+class Task(models.Model):
+    # 実行を待っているタスク（tasks.queue）。成功したら行を消し、失敗し続けたら failed_at を入れて残す
+    name = models.CharField(max_length=200)
+    args = models.JSONField(default=list)
+    # 同じ key のタスクは実行を待っている間は1つにまとめる
+    key = models.CharField(max_length=200, null=True, blank=True, unique=True)
+    run_after = models.DateTimeField()
+    attempts = models.PositiveIntegerField(default=0)
+    # 取り出したワーカーと、ほかのワーカーに渡さない期限（過ぎたらワーカーが落ちたとみなして取り出し直す）
+    locked_by = models.CharField(max_length=32, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    failed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["run_after"], condition=models.Q(failed_at__isnull=True), name="task_ready_idx"),
+        ]
+
+    def __str__(self):
+        return self.name
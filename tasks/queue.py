@@ -0,0 +1,104 @@
+import functools
+import logging
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from mysite.db import retry_on_lock
+from mysite.routers import use_primary
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+# 書き込みのリクエストの後始末（fan-out など）を Task テーブルに積み、manage.py run_worker で実行する。
+# 呼び出し側のトランザクションの中で積めば、書き込みと一緒にコミットされる。
+# 同じタスクが2回以上実行されることがある（ワーカーが途中で落ちたときなど）ので、タスクは何度実行してもよいように書く。
+# settings.TASKS_EAGER のときは積まずに、呼び出し側のトランザクションがコミットされた後に実行する（開発とテスト）。
+# 本番と同じく、タスクの失敗で書き込みが巻き戻らず、タスクからはコミット済みの状態だけが見える。
+
+
+def task(func):
+    # 引数は JSON にできる値だけにする（モデルのインスタンスではなく ID を渡す）
+    func.task_name = f"{func.__module__}.{func.__qualname__}"
+    return func
+
+
+def enqueue(func, *args, key=None, delay=0):
+    if settings.TASKS_EAGER:
+        # delay は待たない
+        transaction.on_commit(functools.partial(func, *args))
+        return
+    Task.objects.bulk_create(
+        [Task(name=func.task_name, args=list(args), key=key, run_after=timezone.now() + timedelta(seconds=delay))],
+        # 同じ key のタスクが待っていれば積まない
+        ignore_conflicts=True,
+    )
+
+
+@retry_on_lock
+def _claim(worker, limit):
+    # 取り出せるタスクに印を付けてから読む（UPDATE は1文なので、ほかのワーカーと同じタスクを取り合わない）
+    now = timezone.now()
+    ready = (
+        Task.objects.filter(failed_at__isnull=True, run_after__lte=now)
+        .exclude(locked_until__gt=now)
+        .order_by("run_after", "pk")
+        .values("pk")[:limit]
+    )
+    Task.objects.filter(pk__in=ready).update(
+        locked_by=worker, locked_until=now + timedelta(seconds=settings.TASKS_LEASE)
+    )
+    return list(Task.objects.filter(locked_by=worker, locked_until__gt=now).order_by("run_after", "pk"))
+
+
+@retry_on_lock
+def _complete(pks):
+    Task.objects.filter(pk__in=pks).delete()
+
+
+@retry_on_lock
+def _fail(task, error):
+    task.attempts += 1
+    task.last_error = error
+    task.locked_by = ""
+    task.locked_until = None
+    if task.attempts >= settings.TASKS_MAX_ATTEMPTS:
+        task.failed_at = timezone.now()
+    else:
+        # 1回目は TASKS_RETRY_DELAY 秒後、以降は待ち時間を倍にしていく
+        task.run_after = timezone.now() + timedelta(seconds=settings.TASKS_RETRY_DELAY * 2 ** (task.attempts - 1))
+    task.save(update_fields=["attempts", "last_error", "locked_by", "locked_until", "failed_at", "run_after"])
+
+
+def _run(task):
+    func = import_string(task.name)
+    if getattr(func, "task_name", None) != task.name:
+        raise ValueError(f"{task.name} is not a task.")
+    func(*task.args)
+
+
+def run_pending(limit=None, worker=None):
+    # 実行できるタスクを limit 件まで取り出して実行し、取り出した件数を返す
+    limit = limit or settings.TASKS_BATCH_SIZE
+    worker = worker or uuid.uuid4().hex
+    # 積んだ直後のタスクを読むので、レプリカには向けない
+    with use_primary():
+        tasks = _claim(worker, limit)
+        done = []
+        for task in tasks:
+            try:
+                _run(task)
+            except Exception:
+                logger.warning("Task %s (%s) failed.", task.name, task.pk, exc_info=True)
+                _fail(task, traceback.format_exc())
+            else:
+                done.append(task.pk)
+        # 成功した分はまとめて消す
+        _complete(done)
+    return len(tasks)
@@ -0,0 +1,208 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts import graph
+from tweets.models import Hashtag, TimelineEntry, Tweet
+
+from . import checks, queue
+from .models import Task
+
+User = get_user_model()
+
+calls = []
+
+
+@queue.task
+def record_call(*args):
+    calls.append(args)
+
+
+@queue.task
+def always_fail():
+    raise RuntimeError("boom")
+
+
+def not_a_task():
+    pass
+
+
+@override_settings(TASKS_EAGER=False, TASKS_MAX_ATTEMPTS=3, TASKS_RETRY_DELAY=10, TASKS_LEASE=300)
+class TestQueue(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueue_stores_task(self):
+        queue.enqueue(record_call, 1, "a")
+
+        task = Task.objects.get()
+        self.assertEqual(task.name, "tasks.tests.record_call")
+        self.assertEqual(task.args, [1, "a"])
+        self.assertEqual(calls, [])
+
+    def test_enqueue_with_same_key_once(self):
+        queue.enqueue(record_call, 1, key="once")
+        queue.enqueue(record_call, 2, key="once")
+
+        self.assertEqual(queue.run_pending(), 1)
+        self.assertEqual(calls, [(1,)])
+        # 実行し終えたら同じ key をまた積める
+        queue.enqueue(record_call, 3, key="once")
+        self.assertEqual(Task.objects.count(), 1)
+
+    @override_settings(TASKS_EAGER=True)
+    def test_eager_runs_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            queue.enqueue(record_call, 1)
+            # 呼び出し側のトランザクションがコミットされるまでは実行しない
+            self.assertEqual(calls, [])
+
+        self.assertEqual(calls, [(1,)])
+        self.assertFalse(Task.objects.exists())
+
+    def test_run_pending_in_batches(self):
+        for i in range(3):
+            queue.enqueue(record_call, i)
+
+        with self.assertNumQueries(3):
+            self.assertEqual(queue.run_pending(2), 2)
+        self.assertEqual(queue.run_pending(2), 1)
+        self.assertEqual(queue.run_pending(2), 0)
+
+        self.assertEqual(calls, [(0,), (1,), (2,)])
+        self.assertFalse(Task.objects.exists())
+
+    def test_delayed_task_waits(self):
+        queue.enqueue(record_call, 1, delay=60)
+
+        self.assertEqual(queue.run_pending(), 0)
+        with mock.patch("tasks.queue.timezone.now", return_value=timezone.now() + timedelta(seconds=61)):
+            self.assertEqual(queue.run_pending(), 1)
+
+    def test_failed_task_retries_with_backoff(self):
+        queue.enqueue(always_fail)
+        start = timezone.now()
+
+        for attempt in range(1, 3):
+            with self.assertLogs("tasks.queue", "WARNING"):
+                queue.run_pending()
+            task = Task.objects.get()
+            self.assertEqual(task.attempts, attempt)
+            self.assertIn("RuntimeError: boom", task.last_error)
+            self.assertGreaterEqual(task.run_after, start + timedelta(seconds=10 * 2 ** (attempt - 1)))
+            self.assertEqual(queue.run_pending(), 0)
+            Task.objects.update(run_after=timezone.now())
+
+        with self.assertLogs("tasks.queue", "WARNING"):
+            queue.run_pending()
+        task = Task.objects.get()
+        self.assertEqual(task.attempts, 3)
+        self.assertIsNotNone(task.failed_at)
+        self.assertEqual(queue.run_pending(), 0)
+
+    def test_refuses_functions_that_are_not_tasks(self):
+        Task.objects.create(name="tasks.tests.not_a_task", run_after=timezone.now())
+
+        with self.assertLogs("tasks.queue", "WARNING"):
+            queue.run_pending()
+
+        self.assertIn("is not a task", Task.objects.get().last_error)
+
+    def test_claimed_task_is_not_shared_until_lease_expires(self):
+        queue.enqueue(record_call, 1)
+        queue._claim("crashed", 10)
+
+        self.assertEqual(queue.run_pending(), 0)
+        with mock.patch("tasks.queue.timezone.now", return_value=timezone.now() + timedelta(seconds=301)):
+            self.assertEqual(queue.run_pending(), 1)
+        self.assertEqual(calls, [(1,)])
+
+    def test_run_worker_command(self):
+        queue.enqueue(record_call, 1)
+        queue.enqueue(record_call, 2)
+        out = StringIO()
+
+        call_command("run_worker", "--once", "--batch-size", "1", stdout=out)
+
+        self.assertIn("Processed 2 tasks.", out.getvalue())
+        self.assertEqual(calls, [(1,), (2,)])
+
+
+@override_settings(TASKS_EAGER=False)
+class TestDeferredWrites(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="tester", password="testpassword")
+        self.follower = User.objects.create_user(username="follower", password="testpassword")
+        graph.follow(self.follower, self.user)
+        queue.run_pending()
+        self.client.force_login(self.user)
+
+    def test_create_tweet_defers_fan_out(self):
+        self.client.post(reverse("tweets:create"), {"content": "hello #django"})
+
+        tweet = Tweet.objects.get()
+        # 自分のタイムラインにはすぐに入る
+        self.assertEqual(list(TimelineEntry.objects.values_list("owner", flat=True)), [self.user.pk])
+        self.assertFalse(Hashtag.objects.exists())
+
+        queue.run_pending()
+
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.follower, tweet=tweet).exists())
+        self.assertTrue(Hashtag.objects.filter(tweet=tweet, name="django").exists())
+
+    def test_deleted_tweet_is_skipped(self):
+        self.client.post(reverse("tweets:create"), {"content": "hello"})
+        Tweet.objects.all().delete()
+
+        queue.run_pending()
+
+        self.assertFalse(Task.objects.exists())
+        self.assertFalse(TimelineEntry.objects.exists())
+
+    def test_follow_defers_backfill(self):
+        other = User.objects.create_user(username="other", password="testpassword")
+        tweet = Tweet.objects.create(author=other, content="old tweet")
+
+        graph.follow(self.user, other)
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.user, tweet=tweet).exists())
+        queue.run_pending()
+
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.user, tweet=tweet).exists())
+
+    def test_backfill_skipped_after_unfollow(self):
+        other = User.objects.create_user(username="other", password="testpassword")
+        Tweet.objects.create(author=other, content="old tweet")
+
+        graph.follow(self.user, other)
+        graph.unfollow(self.user, other)
+        queue.run_pending()
+
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.user).exists())
+
+
+class TestChecks(TestCase):
+    @override_settings(TASKS_EAGER=False)
+    def test_worker_needs_shared_cache(self):
+        [error] = checks.check_shared_cache(None)
+
+        self.assertEqual(error.id, "tasks.E001")
+
+    @override_settings(
+        TASKS_EAGER=False,
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": "/tmp/tasks"}
+        },
+    )
+    def test_shared_cache(self):
+        self.assertEqual(checks.check_shared_cache(None), [])
+
+    def test_eager(self):
+        self.assertEqual(checks.check_shared_cache(None), [])
@@ -1 +1,7 @@
-# from django.contrib import admin
+from django.contrib import admin
+
+from .models import Like, TimelineEntry, Tweet
+
+admin.site.register(Tweet)
+admin.site.register(TimelineEntry)
+admin.site.register(Like)
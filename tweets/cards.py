@@ -0,0 +1,91 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+from accounts import graph
+
+from . import likes
+
+# 描画済みのツイートカード（tweets/tweet_card.html）をツイートごとにキャッシュする。
+# カードの中身は閲覧者によらず、変わるのはいいね数と作者のユーザー名だけなので、それをキーに含める。
+# どちらかが変われば別のキーになり、古いものは参照されずに期限切れで消える。
+# 閲覧者ごとに変わる部分（いいね済みか・作者をフォローしているか）は tweets/tweet_actions.html に分けて毎回描画する。
+CACHE_KEY = "tweets:card:{}:{}:{}"
+
+
+def _key(tweet):
+    return CACHE_KEY.format(tweet.pk, tweet.like_count, tweet.author.username)
+
+
+def _render(tweet):
+    return mark_safe(render_to_string("tweets/tweet_card.html", {"tweet": tweet}))
+
+
+def _body(tweet):
+    html = getattr(tweet, "_card_html", None)
+    if html is not None:
+        return html
+    if not settings.TWEET_CARD_CACHE_TIMEOUT:
+        return _render(tweet)
+    html = cache.get(_key(tweet))
+    if html is None:
+        html = _render(tweet)
+        cache.set(_key(tweet), html, settings.TWEET_CARD_CACHE_TIMEOUT)
+    tweet._card_html = html
+    return html
+
+
+def render(tweet):
+    # annotate() していないツイートは、いいねしておらずフォローもしていないものとして描画する
+    actions = render_to_string("tweets/tweet_actions.html", {"tweet": tweet})
+    return format_html("<article>\n{}{}</article>\n", _body(tweet), actions)
+
+
+def annotate(tweets, user):
+    # 閲覧者がいいね済みか（シャードごとに1クエリ）と、作者をフォローしているか（キャッシュ）をページ分まとめて調べる
+    liked = likes.liked_ids(user.pk, [tweet.pk for tweet in tweets])
+    _set_flags(tweets, user, liked, graph.followee_ids(user.pk))
+
+
+async def aannotate(tweets, user):
+    liked = await likes.aliked_ids(user.pk, [tweet.pk for tweet in tweets])
+    _set_flags(tweets, user, liked, await graph.afollowee_ids(user.pk))
+
+
+def _set_flags(tweets, user, liked, followees):
+    for tweet in tweets:
+        tweet.liked_by_viewer = tweet.pk in liked
+        tweet.viewer_follows_author = tweet.author_id != user.pk and tweet.author_id in followees
+
+
+def _fill(tweets, found):
+    missing = {}
+    for tweet in tweets:
+        html = found.get(_key(tweet))
+        if html is None:
+            html = missing[_key(tweet)] = _render(tweet)
+        tweet._card_html = html
+    return missing
+
+
+def prefetch(tweets):
+    # 1ページ分のカードをまとめて1回で読み、無いものだけ描画して書き込む
+    if not settings.TWEET_CARD_CACHE_TIMEOUT:
+        return
+    missing = _fill(tweets, cache.get_many([_key(tweet) for tweet in tweets]))
+    if missing:
+        cache.set_many(missing, settings.TWEET_CARD_CACHE_TIMEOUT)
+
+
+async def aprefetch(tweets):
+    if not settings.TWEET_CARD_CACHE_TIMEOUT:
+        return
+    missing = _fill(tweets, await cache.aget_many([_key(tweet) for tweet in tweets]))
+    if missing:
+        await cache.aset_many(missing, settings.TWEET_CARD_CACHE_TIMEOUT)
+
+
+def invalidate(tweet):
+    cache.delete(_key(tweet))
@@ -0,0 +1,70 @@
+import re
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.db.models.functions import Lower
+
+from accounts import usernames as accounts_usernames
+from mysite.pagination import filter_before
+
+from . import sharding
+from .models import Hashtag, Mention
+
+User = get_user_model()
+
+# 本文のハッシュタグとメンションはツイートを作成したときに1回だけ取り出して保存し、読み出し時には解析しない
+HASHTAG_RE = re.compile(r"(?<![\w#])#(\w{1,100})")
+# ユーザー名に使える文字（UnicodeUsernameValidator）。末尾の記号は文の区切りとみなす
+MENTION_RE = re.compile(r"(?<![\w@])@([\w.@+-]+)")
+
+
+def normalize_hashtag(name):
+    return name.casefold()
+
+
+def parse_hashtags(content):
+    return list(dict.fromkeys(normalize_hashtag(name) for name in HASHTAG_RE.findall(content)))
+
+
+def parse_mentions(content):
+    return list(dict.fromkeys(name.rstrip(".+-@") for name in MENTION_RE.findall(content)))
+
+
+def save(tweet):
+    # ツイートと同じシャードに書き込む。取り出したハッシュタグを返す
+    hashtags = parse_hashtags(tweet.content)
+    Hashtag.objects.bulk_create(
+        [Hashtag(tweet=tweet, name=name, created_at=tweet.created_at) for name in hashtags], ignore_conflicts=True
+    )
+    # プロフィールの URL と同じく大文字と小文字は区別しない（user_username_lower_unique の一意インデックスを使う）
+    usernames = {accounts_usernames.normalize(name) for name in parse_mentions(tweet.content)}
+    if usernames:
+        users = User.objects.alias(username_lower=Lower("username")).filter(username_lower__in=usernames)
+        Mention.objects.bulk_create(
+            [
+                Mention(tweet=tweet, user_id=user_id, created_at=tweet.created_at)
+                for user_id in users.values_list("pk", flat=True)
+            ],
+            ignore_conflicts=True,
+        )
+    return hashtags
+
+
+def _tweets(querysets, limit, before):
+    streams = []
+    for rows in querysets:
+        if before is not None:
+            rows = rows.filter(filter_before(before, keys=("created_at", "tweet_id")))
+        rows = rows.select_users("tweet__author", prefetch=False).order_by("-created_at", "-tweet_id")[:limit]
+        streams.append(row.tweet for row in rows)
+    merged = sharding.merge(streams, key=lambda tweet: (tweet.created_at, tweet.pk), reverse=True)
+    return sharding.load_users(list(islice(merged, limit)), "author")
+
+
+def hashtag_tweets(name, limit, before=None):
+    name = normalize_hashtag(name)
+    return _tweets([rows.filter(name=name) for rows in Hashtag.objects.shards()], limit, before)
+
+
+def mentioning_tweets(user_id, limit, before=None):
+    return _tweets([rows.filter(user_id=user_id) for rows in Mention.objects.shards()], limit, before)
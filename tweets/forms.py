@@ -0,0 +1,23 @@
+from django import forms
+
+from . import search
+from .models import Tweet
+
+
+class TweetForm(forms.ModelForm):
+    class Meta:
+        model = Tweet
+        fields = ("content",)
+        widgets = {
+            "content": forms.Textarea(attrs={"rows": 4}),
+        }
+
+
+class SearchForm(forms.Form):
+    q = forms.CharField(label="検索", max_length=100)
+
+    def clean_q(self):
+        terms = self.cleaned_data["q"].split()
+        if any(len(term) < search.MIN_TERM_LENGTH for term in terms):
+            raise forms.ValidationError(f"{search.MIN_TERM_LENGTH}文字以上の語で検索してください。")
+        return terms
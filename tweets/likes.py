@@ -0,0 +1,196 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, connections, transaction
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from mysite import versions
+from mysite.db import is_lock_error, retry_on_lock
+
+from . import sharding
+from .models import Like, Tweet
+
+logger = logging.getLogger(__name__)
+
+# いいねされたツイートと増減はプロセス内に溜めておき、まとめて Tweet.like_count を UPDATE する。
+# 人気のツイートにいいねが集中しても、1クリックごとに同じ行を更新せずに済む。
+# 反映するときは増減を足さずに Like の件数で置き換えるので、ほかのプロセスや reconcile_like_counts が
+# 先に反映していても二重に数えない。いいねが止まったプロセスにも残さないよう、LIKE_COUNT_FLUSH_INTERVAL 秒後にも反映する
+_lock = threading.Lock()
+_pending = Counter()
+# 溜めているツイートの作者の ID（反映したら作者のスタンプを更新する）
+_authors = {}
+_last_flush = time.monotonic()
+_timer = None
+
+
+@retry_on_lock
+def _create(user, tweet):
+    try:
+        with transaction.atomic(using=sharding.shard_for_id(tweet.pk)):
+            Like.objects.create(user=user, tweet=tweet)
+    except IntegrityError:
+        # いいね済み
+        return False
+    return True
+
+
+@retry_on_lock
+def _delete(user, tweet):
+    deleted, _ = Like.objects.shard(sharding.shard_for_id(tweet.pk)).filter(user=user, tweet=tweet).delete()
+    return bool(deleted)
+
+
+def like(user, tweet):
+    if not _create(user, tweet):
+        return False
+    # いいねボタンの表示が変わる
+    versions.bump(versions.user(user.pk))
+    add_pending(tweet, 1)
+    return True
+
+
+def unlike(user, tweet):
+    if not _delete(user, tweet):
+        return False
+    versions.bump(versions.user(user.pk))
+    add_pending(tweet, -1)
+    return True
+
+
+def add_pending(tweet, delta):
+    with _lock:
+        _pending[tweet.pk] += delta
+        _authors[tweet.pk] = tweet.author_id
+        should_flush = (
+            len(_pending) >= settings.LIKE_COUNT_FLUSH_BATCH_SIZE
+            or time.monotonic() - _last_flush >= settings.LIKE_COUNT_FLUSH_INTERVAL
+        )
+        if not should_flush:
+            _schedule_flush()
+    if should_flush:
+        try:
+            flush()
+        except OperationalError as e:
+            # いいね自体は記録できているので失敗させない。件数は次の flush で反映する
+            if not is_lock_error(e):
+                raise
+            logger.warning("Failed to flush pending like counts, will retry later.", exc_info=True)
+            with _lock:
+                _schedule_flush()
+
+
+def _schedule_flush():
+    # _lock を取ってから呼ぶ
+    global _timer
+    if _timer is None:
+        _timer = threading.Timer(settings.LIKE_COUNT_FLUSH_INTERVAL, _flush_later)
+        _timer.daemon = True
+        _timer.start()
+
+
+def _flush_later():
+    try:
+        flush()
+    except Exception:
+        logger.warning("Failed to flush pending like counts, will retry later.", exc_info=True)
+        with _lock:
+            if _pending:
+                _schedule_flush()
+    finally:
+        # このスレッドで開いた接続
+        connections.close_all()
+
+
+def _liked(user_id, tweet_ids):
+    groups = {}
+    for tweet_id in tweet_ids:
+        groups.setdefault(sharding.shard_for_id(tweet_id), []).append(tweet_id)
+    return [
+        Like.objects.shard(shard).filter(user_id=user_id, tweet_id__in=ids).values_list("tweet_id", flat=True)
+        for shard, ids in groups.items()
+    ]
+
+
+def liked_ids(user_id, tweet_ids):
+    # tweet_ids のうち user_id がいいねしたもの。Like はツイートと同じシャードにあるので、シャードごとに1回で読む
+    return {tweet_id for rows in _liked(user_id, tweet_ids) for tweet_id in rows}
+
+
+async def aliked_ids(user_id, tweet_ids):
+    return {tweet_id for rows in _liked(user_id, tweet_ids) async for tweet_id in rows}
+
+
+def pending_delta(tweet_id):
+    with _lock:
+        return _pending.get(tweet_id, 0)
+
+
+def like_count(tweet):
+    # まだ反映していない増減も含めた件数
+    return tweet.like_count + pending_delta(tweet.pk)
+
+
+def flush():
+    global _last_flush, _timer
+    with _lock:
+        if _timer is not None:
+            _timer.cancel()
+            _timer = None
+        batch = {tweet_id: delta for tweet_id, delta in _pending.items() if delta}
+        batch_authors = {tweet_id: _authors[tweet_id] for tweet_id in batch}
+        _pending.clear()
+        _authors.clear()
+        _last_flush = time.monotonic()
+    if not batch:
+        return 0
+
+    tweet_ids = list(batch)
+    shards = {}
+    for tweet_id, delta in batch.items():
+        shards.setdefault(sharding.shard_for_id(tweet_id), {})[tweet_id] = delta
+    while shards:
+        shard, deltas = shards.popitem()
+        try:
+            _apply(shard, deltas)
+        except Exception:
+            # 反映できなかった分は次回に持ち越す
+            with _lock:
+                for remaining in [deltas, *shards.values()]:
+                    _pending.update(remaining)
+                    _authors.update({tweet_id: batch_authors[tweet_id] for tweet_id in remaining})
+            raise
+    # 件数はツイートの詳細と、作者のツイートを並べるページ（ホーム・プロフィール）に出る
+    versions.bump(
+        *(versions.tweet(tweet_id) for tweet_id in tweet_ids),
+        *(versions.author(author_id) for author_id in set(batch_authors.values())),
+    )
+    return len(batch)
+
+
+@retry_on_lock
+def _apply(shard, batch):
+    tweet_ids = list(batch)
+    # Like はツイートと同じシャードにある
+    counts = Like.objects.filter(tweet=OuterRef("pk")).order_by().values("tweet").annotate(count=Count("pk"))
+    with transaction.atomic(using=shard):
+        for start in range(0, len(tweet_ids), settings.LIKE_COUNT_FLUSH_BATCH_SIZE):
+            chunk = tweet_ids[start : start + settings.LIKE_COUNT_FLUSH_BATCH_SIZE]
+            Tweet.objects.shard(shard).filter(pk__in=chunk).update(
+                like_count=Coalesce(Subquery(counts.values("count")), Value(0))
+            )
+
+
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        logger.exception("Failed to flush pending like counts at exit.")
+
+
+atexit.register(_flush_at_exit)
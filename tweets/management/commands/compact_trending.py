@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from tweets import trending
+
+
+class Command(BaseCommand):
+    help = (
+        "ハッシュタグの分ごとの集計を時間ごとにまとめ、トレンドのランキングを作り直します（cron で毎分実行する想定）。"
+    )
+
+    def handle(self, *args, **options):
+        ranking = trending.compact()
+        self.stdout.write(f"Ranked {len(ranking)} hashtags.")
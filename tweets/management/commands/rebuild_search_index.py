@@ -0,0 +1,62 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from tweets.models import Tweet
+from tweets.search import TABLE
+
+
+class Command(BaseCommand):
+    help = "既存のツイートを全文検索インデックスに入れ直し、消えたツイートの分を取り除きます。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, chunk_size, **options):
+        indexed = removed = 0
+        for shard in settings.TWEET_SHARDS:
+            indexed += self.index(shard, chunk_size)
+            removed += self.remove_stale(shard, chunk_size)
+            with connections[shard].cursor() as cursor:
+                # 細かく分かれたインデックスの b-tree を1つにまとめ、検索を速くする
+                cursor.execute(f"INSERT INTO {TABLE}({TABLE}) VALUES ('optimize')")
+
+        self.stdout.write(f"Indexed {indexed} tweets, removed {removed} stale entries.")
+
+    def index(self, shard, chunk_size):
+        # 書き込みのロックを長く持たないよう、まとまりごとにコミットする。
+        # 作成中のツイートはトリガーが入れるが、REPLACE なので重複しない
+        indexed = 0
+        last_pk = 0
+        while True:
+            rows = list(
+                Tweet.objects.using(shard)
+                .filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", "content")[:chunk_size]
+            )
+            if not rows:
+                return indexed
+            last_pk = rows[-1][0]
+            with transaction.atomic(using=shard), connections[shard].cursor() as cursor:
+                cursor.executemany(f"INSERT OR REPLACE INTO {TABLE}(rowid, content) VALUES (%s, %s)", rows)
+            indexed += len(rows)
+
+    def remove_stale(self, shard, chunk_size):
+        removed = 0
+        last_rowid = 0
+        while True:
+            with connections[shard].cursor() as cursor:
+                cursor.execute(
+                    f"SELECT rowid FROM {TABLE} WHERE rowid > %s ORDER BY rowid LIMIT %s", [last_rowid, chunk_size]
+                )
+                rowids = [rowid for (rowid,) in cursor.fetchall()]
+            if not rowids:
+                return removed
+            last_rowid = rowids[-1]
+            existing = set(Tweet.objects.using(shard).filter(pk__in=rowids).values_list("pk", flat=True))
+            stale = [(rowid,) for rowid in rowids if rowid not in existing]
+            if stale:
+                with transaction.atomic(using=shard), connections[shard].cursor() as cursor:
+                    cursor.executemany(f"DELETE FROM {TABLE} WHERE rowid = %s", stale)
+                removed += len(stale)
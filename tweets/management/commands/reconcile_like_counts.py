@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F
+
+from mysite import versions
+from mysite.routers import use_primary
+from tweets.models import Tweet
+
+
+class Command(BaseCommand):
+    help = "Tweet.like_count を Like テーブルの実件数に合わせて修復します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    @use_primary()
+    def handle(self, *args, chunk_size, **options):
+        # Like の件数に合わせる。Web のプロセスに溜まっているいいねも Like には入っていて、
+        # それらを後で反映するときも Like の件数で置き換えるので、二重に数えることはない
+        checked = repaired = 0
+        # Like はツイートと同じシャードにあるので、シャードごとに数え直す
+        for tweets in Tweet.objects.shards():
+            last_pk = 0
+            while True:
+                chunk = list(tweets.filter(pk__gt=last_pk).order_by("pk").values_list("pk", flat=True)[:chunk_size])
+                if not chunk:
+                    break
+                last_pk = chunk[-1]
+                drifted = [
+                    Tweet(pk=pk, author_id=author_id, like_count=actual)
+                    for pk, author_id, actual in tweets.filter(pk__in=chunk)
+                    .annotate(actual=Count("likes"))
+                    .exclude(like_count=F("actual"))
+                    .values_list("pk", "author_id", "actual")
+                ]
+                tweets.bulk_update(drifted, ["like_count"])
+                versions.bump(
+                    *(versions.tweet(tweet.pk) for tweet in drifted),
+                    *(versions.author(author_id) for author_id in {tweet.author_id for tweet in drifted}),
+                )
+                checked += len(chunk)
+                repaired += len(drifted)
+
+        self.stdout.write(f"Checked {checked} tweets, repaired {repaired}.")
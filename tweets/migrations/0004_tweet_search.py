@@ -0,0 +1,54 @@
+from django.db import migrations
+
+# Tweet.content の全文検索インデックス（SQLite の FTS5。tweets.search で使う）。
+# trigram で分割するので、日本語のように空白で区切らない文章も3文字以上の部分文字列で探せる。
+# 中身はトリガーで更新する。既存のツイートは rebuild_search_index で入れる。
+# SQLite でテーブルを作り直すマイグレーション（tweets_tweet の AlterField など）はトリガーも消すので、作り直すこと。
+CREATE = [
+    "CREATE VIRTUAL TABLE tweets_tweet_search USING fts5(content, tokenize='trigram')",
+    """
+    CREATE TRIGGER tweets_tweet_search_insert AFTER INSERT ON tweets_tweet BEGIN
+        INSERT OR REPLACE INTO tweets_tweet_search(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER tweets_tweet_search_update AFTER UPDATE OF content ON tweets_tweet BEGIN
+        INSERT OR REPLACE INTO tweets_tweet_search(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER tweets_tweet_search_delete AFTER DELETE ON tweets_tweet BEGIN
+        DELETE FROM tweets_tweet_search WHERE rowid = old.id;
+    END
+    """,
+]
+
+DROP = [
+    "DROP TRIGGER IF EXISTS tweets_tweet_search_insert",
+    "DROP TRIGGER IF EXISTS tweets_tweet_search_update",
+    "DROP TRIGGER IF EXISTS tweets_tweet_search_delete",
+    "DROP TABLE IF EXISTS tweets_tweet_search",
+]
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        for sql in CREATE:
+            schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        for sql in DROP:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0003_tweet_shards"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -1,4 +1,125 @@
-# from django.db import models
+from django.conf import settings
+from django.db import IntegrityError, models, router, transaction
 
+from . import sharding
 
-# class Tweet(models.Model):
+# プロセスの番号（sharding.next_id）が重なって同じ ID を採番したときに、採番し直す回数
+ID_COLLISION_RETRIES = 3
+
+
+# ツイートとユーザーは別のデータベースに置くことがあるので（tweets.sharding）、ユーザーへの外部キー制約は作らない
+class Tweet(models.Model):
+    author = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="tweets", db_constraint=False
+    )
+    content = models.CharField(max_length=140)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Like の件数を非正規化して持つ（tweets.likes がまとめて反映する）
+    like_count = models.IntegerField(default=0)
+
+    objects = sharding.TweetQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["author", "-created_at", "-id"], name="tweet_author_created_idx"),
+        ]
+
+    def __str__(self):
+        return self.content
+
+    def assign_id(self):
+        # ID にシャードを含めるので、保存する前に決めておく
+        if self.pk is None:
+            self.pk = sharding.next_id(sharding.shard_for_author(self.author_id))
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            super().save(*args, **kwargs)
+            return
+        # ID は保存する前に決める新しい行なので、UPDATE を試さずに INSERT する
+        kwargs["force_insert"] = True
+        using = kwargs.get("using") or router.db_for_write(Tweet, instance=self)
+        for attempt in range(ID_COLLISION_RETRIES + 1):
+            self.assign_id()
+            try:
+                # ほかのプロセスと ID が重なったときに外側のトランザクションを壊さないよう、セーブポイントを置く
+                with transaction.atomic(using=using):
+                    super().save(*args, **kwargs)
+                return
+            except IntegrityError:
+                collided = Tweet.objects.using(using).filter(pk=self.pk).exists()
+                self.pk = None
+                if not collided or attempt == ID_COLLISION_RETRIES:
+                    raise
+
+
+class TimelineEntry(models.Model):
+    # ホームタイムラインの実体（fan-out on write で書き込まれる受信箱）
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="timeline_entries", db_constraint=False
+    )
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name="timeline_entries")
+    # 並び替えのために tweet.created_at をコピーしておく（JOIN なしで範囲走査できる）
+    created_at = models.DateTimeField()
+
+    objects = sharding.ShardedQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["owner", "tweet"], name="unique_timeline_entry"),
+        ]
+        indexes = [
+            models.Index(fields=["owner", "-created_at", "-tweet"], name="timeline_owner_created_idx"),
+        ]
+
+
+class Like(models.Model):
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="likes", db_constraint=False
+    )
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name="likes")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = sharding.ShardedQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "tweet"], name="unique_like"),
+        ]
+
+
+# ツイートを作成したときに本文から取り出したハッシュタグとメンション（tweets.entities）。
+# ツイートと同じシャードに置き、ツイートの作成日時をコピーしておく（JOIN なしで新しい順に範囲走査できる）
+class Hashtag(models.Model):
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name="hashtags")
+    # 小文字にそろえた名前（# は含まない）
+    name = models.CharField(max_length=100)
+    created_at = models.DateTimeField()
+
+    objects = sharding.ShardedQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["tweet", "name"], name="unique_hashtag"),
+        ]
+        indexes = [
+            models.Index(fields=["name", "-created_at", "-tweet"], name="hashtag_name_created_idx"),
+        ]
+
+
+class Mention(models.Model):
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name="mentions")
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="mentions", db_constraint=False
+    )
+    created_at = models.DateTimeField()
+
+    objects = sharding.ShardedQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["tweet", "user"], name="unique_mention"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "-created_at", "-tweet"], name="mention_user_created_idx"),
+        ]
@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from itertools import islice
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Max
+
+from accounts import graph
+
+from . import cards, sharding, timeline
+from .models import Tweet
+
+logger = logging.getLogger(__name__)
+
+# 新しいツイートをプロセス内の購読者（SSE の接続）に配る。
+# DB を見に行くのはイベントループに1つのポーリングタスクだけで、何人つながっていても問い合わせは1回で済む。
+# ツイートを作成したときは notify() で起こし、次のポーリングを待たずに読みに行かせる。
+
+
+def render_event(tweet):
+    # カードの HTML は閲覧者によらないので、1ツイートにつき1回だけ描画して全員に同じものを送る
+    html = cards.render(tweet)
+    data = "".join(f"data: {line}\n" for line in html.splitlines())
+    return f"id: {tweet.pk}\nevent: tweet\n{data}\n"
+
+
+class Subscription:
+    def __init__(self, user_id, followee_ids, last_id):
+        self.user_id = user_id
+        self.followee_ids = followee_ids
+        # これ以下の ID は接続時に読み、これより新しいツイートはポーリングタスクが届ける
+        self.last_id = last_id
+        # 接続時に読んだツイートの ID。遅れてコミットされたものとしてポーリングタスクから届いても送らない
+        self.sent_ids = set()
+        self.queue = asyncio.Queue(maxsize=settings.TWEET_STREAM_QUEUE_SIZE)
+        self.overflowed = False
+
+    def wants(self, tweet):
+        return tweet.author_id == self.user_id or tweet.author_id in self.followee_ids
+
+    def put(self, tweet_id, event):
+        try:
+            self.queue.put_nowait((tweet_id, event))
+        except asyncio.QueueFull:
+            # 読み出しが追いつかない接続には再読み込みさせる
+            self.overflowed = True
+
+
+class Broker:
+    # イベントループごとに1つ作る（ASGI ならプロセスに1つ。WSGI ではリクエストごとにループが作られる）
+    def __init__(self, loop):
+        self.loop = loop
+        self.subscriptions = set()
+        self.wakeup = asyncio.Event()
+        self.lock = asyncio.Lock()
+        self.task = None
+        # 配ったツイートの中で一番新しい ID
+        self.last_id = 0
+        # 直近 TWEET_STREAM_OVERLAP 秒に採番された ID のうち、配った（または購読を始める前にあった）もの
+        self.delivered_ids = set()
+
+    async def subscribe(self, user_id):
+        followee_ids = await graph.afollowee_ids(user_id)
+        async with self.lock:
+            if self.task is None:
+                # 最初の購読者でポーリングを始める。その時点であるツイートは配らない
+                floor = _overlap_floor()
+                for tweets in Tweet.objects.shards():
+                    self.delivered_ids.update(
+                        [pk async for pk in tweets.filter(pk__gt=floor).values_list("pk", flat=True)]
+                    )
+                    last_id = (await tweets.aaggregate(last_id=Max("pk")))["last_id"] or 0
+                    self.last_id = max(self.last_id, last_id)
+                self.task = self.loop.create_task(self.poll())
+                self.task.add_done_callback(self.poll_done)
+                # 待っている間に最後の購読者が抜けて外されていたら登録し直す
+                with _brokers_lock:
+                    _brokers.setdefault(self.loop, self)
+        subscription = Subscription(user_id, followee_ids, self.last_id)
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscriptions.discard(subscription)
+        if not self.subscriptions:
+            if self.task is not None:
+                self.task.cancel()
+                self.task = None
+            with _brokers_lock:
+                if _brokers.get(self.loop) is self:
+                    del _brokers[self.loop]
+
+    def notify(self):
+        # ツイート作成（同期ビューのスレッド）から呼ばれるので、イベントループのスレッドに渡す
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def poll(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), settings.TWEET_STREAM_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.dispatch()
+            except Exception:
+                # database is locked やシャードの読み出しの失敗で止めず、次の周期に読み直す
+                logger.exception("Failed to dispatch new tweets.")
+
+    def poll_done(self, task):
+        # それでも止まったポーリングタスクは、次の購読者が作り直す
+        if self.task is task:
+            self.task = None
+
+    async def dispatch(self):
+        # ID は採番した順にコミットされるとは限らないので、last_id より後だけを読むと、
+        # 採番からコミットまでの間に後の ID が配られたツイートを取りこぼす。
+        # 直近 TWEET_STREAM_OVERLAP 秒に採番された分は毎回読み直し、配った ID を除く
+        limit = settings.TWEET_STREAM_QUEUE_SIZE
+        floor = _overlap_floor()
+        self.delivered_ids = {pk for pk in self.delivered_ids if pk > floor}
+        streams = []
+        for tweets in Tweet.objects.shards():
+            tweets = tweets.filter(pk__gt=min(floor, self.last_id)).exclude(pk__in=self.delivered_ids)
+            tweets = tweets.select_users("author", prefetch=False).order_by("pk")[:limit]
+            streams.append([tweet async for tweet in tweets])
+        tweets = list(islice(sharding.merge(streams, key=lambda tweet: tweet.pk), limit))
+        await sharding.aload_users(tweets, "author")
+        for tweet in tweets:
+            self.last_id = max(self.last_id, tweet.pk)
+            self.delivered_ids.add(tweet.pk)
+            recipients = [subscription for subscription in self.subscriptions if subscription.wants(tweet)]
+            if recipients:
+                event = render_event(tweet)
+                for subscription in recipients:
+                    subscription.put(tweet.pk, event)
+        if len(tweets) == limit:
+            # まだ残っているのですぐ次を読む
+            self.wakeup.set()
+
+
+def _overlap_floor():
+    return sharding.first_id_at(time.time() - settings.TWEET_STREAM_OVERLAP)
+
+
+_brokers = weakref.WeakKeyDictionary()
+_brokers_lock = threading.Lock()
+
+
+def _broker():
+    loop = asyncio.get_running_loop()
+    with _brokers_lock:
+        broker = _brokers.get(loop)
+        if broker is None:
+            broker = _brokers[loop] = Broker(loop)
+    return broker
+
+
+def notify():
+    with _brokers_lock:
+        brokers = list(_brokers.values())
+    for broker in brokers:
+        broker.notify()
+
+
+def is_available(request):
+    # WSGI では応答をストリーミングできず、接続の間ワーカーを1つ占有するので ASGI のときだけ使う
+    return isinstance(request, ASGIRequest)
+
+
+async def stream(user_id, after=None):
+    # after（ツイート ID）より新しいツイートを SSE の形式で送り続ける
+    broker = _broker()
+    subscription = await broker.subscribe(user_id)
+    try:
+        yield f"retry: {settings.TWEET_STREAM_RETRY * 1000}\n\n"
+        if after is not None:
+            # 接続していなかった間の分。多すぎるときはページを読み直してもらう
+            limit = settings.TIMELINE_PAGE_SIZE
+            tweets = await timeline.anewer_tweets(user_id, after, subscription.last_id, limit + 1)
+            if len(tweets) > limit:
+                yield "event: reload\ndata: \n\n"
+                return
+            for tweet in reversed(tweets):
+                subscription.sent_ids.add(tweet.pk)
+                yield render_event(tweet)
+
+        # 接続を張りっぱなしにしないよう、一定時間で切ってクライアントに再接続させる
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.TWEET_STREAM_MAX_DURATION
+        while True:
+            if subscription.overflowed and subscription.queue.empty():
+                yield "event: reload\ndata: \n\n"
+                return
+            timeout = min(settings.TWEET_STREAM_KEEPALIVE, deadline - loop.time())
+            if timeout <= 0:
+                return
+            try:
+                tweet_id, event = await asyncio.wait_for(subscription.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if tweet_id not in subscription.sent_ids:
+                yield event
+    finally:
+        broker.unsubscribe(subscription)
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from .models import Hashtag, Like, Mention, TimelineEntry, Tweet
+from .sharding import shard_for_author, shard_for_id
+
+
+def _shard(model, instance):
+    # tweet.author などユーザーの読み出しはシャードに向けない
+    if model._meta.app_label != "tweets":
+        return None
+    # フォームの検証中など、まだシャードが決まらないインスタンスもある
+    if isinstance(instance, Tweet):
+        if instance.pk is not None:
+            return shard_for_id(instance.pk)
+        return shard_for_author(instance.author_id) if instance.author_id is not None else None
+    if isinstance(instance, (Like, TimelineEntry, Hashtag, Mention)):
+        return shard_for_id(instance.tweet_id) if instance.tweet_id is not None else None
+    # user.tweets.all()
+    if model is Tweet and instance is not None and instance._meta.label == settings.AUTH_USER_MODEL:
+        return shard_for_author(instance.pk)
+    return None
+
+
+class TweetShardRouter:
+    # インスタンスが分かるとき（保存・削除・関連の読み出し）だけシャードを選ぶ。
+    # それ以外の検索は ShardedQuerySet.shard() / shards() でシャードを指定する。
+    # default のシャードは None を返し、後ろのルーター（レプリカへの振り分け）に任せる
+    def db_for_read(self, model, **hints):
+        shard = _shard(model, hints.get("instance"))
+        return shard if shard != DEFAULT_DB_ALIAS else None
+
+    def db_for_write(self, model, **hints):
+        shard = _shard(model, hints.get("instance"))
+        return shard if shard != DEFAULT_DB_ALIAS else None
@@ -0,0 +1,69 @@
+from itertools import islice
+
+from django.core import signing
+from django.core.exceptions import BadRequest
+
+from mysite.pagination import CursorPaginator
+
+from . import sharding
+from .models import Tweet
+
+# Tweet と同じシャードにある FTS5 の仮想テーブル（migrations/0004_tweet_search）。rowid がツイートの ID
+TABLE = "tweets_tweet_search"
+# trigram で分割しているので、これより短い語は何にも一致しない
+MIN_TERM_LENGTH = 3
+
+
+def match_expression(terms):
+    # 語は FTS5 の文字列として引用し、演算子として解釈させない。すべての語を含むツイートを探す
+    return " ".join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+
+def position(tweet):
+    return (tweet.search_rank, tweet.pk)
+
+
+def _sort_key(tweet):
+    # BM25 のスコアは小さいほど関連が高い。同じスコアなら新しい順
+    return (tweet.search_rank, -tweet.pk)
+
+
+def _search_shard(tweets, expression, limit, after):
+    sql = (
+        f"SELECT tweets_tweet.*, bm25({TABLE}) AS search_rank FROM {TABLE} "
+        f"JOIN tweets_tweet ON tweets_tweet.id = {TABLE}.rowid WHERE {TABLE} MATCH %s"
+    )
+    params = [expression]
+    if after is not None:
+        rank, pk = after
+        sql += f" AND (bm25({TABLE}) > %s OR (bm25({TABLE}) = %s AND tweets_tweet.id < %s))"
+        params += [rank, rank, pk]
+    sql += " ORDER BY search_rank, tweets_tweet.id DESC LIMIT %s"
+    return tweets.raw(sql, [*params, limit])
+
+
+def search(terms, limit, after=None):
+    # after は (スコア, id)。指定するとそれより後に並ぶツイートだけを返す。
+    # スコアはシャードごとの統計で計算するので、シャードをまたぐと厳密には比べられない
+    expression = match_expression(terms)
+    streams = [_search_shard(tweets, expression, limit, after) for tweets in Tweet.objects.shards()]
+    tweets = list(islice(sharding.merge(streams, key=_sort_key), limit))
+    return sharding.load_users(tweets, "author")
+
+
+class SearchPaginator(CursorPaginator):
+    # 検索結果を (スコア, id) で区切る
+    salt = "tweets.search.cursor"
+
+    def encode(self, position):
+        rank, pk = position
+        return signing.dumps([rank, pk], salt=self.salt, compress=True)
+
+    def decode(self, cursor):
+        if not cursor:
+            return None
+        try:
+            rank, pk = signing.loads(cursor, salt=self.salt)
+            return (float(rank), int(pk))
+        except (signing.BadSignature, TypeError, ValueError):
+            raise BadRequest("Invalid cursor.")
@@ -0,0 +1,132 @@
+import heapq
+import os
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, models, router
+from django.db.models import prefetch_related_objects
+
+# ツイートは作者ごとに settings.TWEET_SHARDS のどれかのデータベースに置く。
+# Like と TimelineEntry はツイートと同じシャードに置くので、ツイートとの JOIN はシャードの中で済む。
+# ユーザーやフォロー関係は default（とそのレプリカ）にしかない。
+
+# ツイートの ID（Snowflake 形式）: EPOCH からのミリ秒 41bit | 連番 6bit | シャード 8bit | プロセスの番号 8bit
+# 連番を時刻のすぐ下に置くので、1つのプロセスが採番する ID はシャードによらず増えていく
+EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+SEQUENCE_BITS = 6
+SHARD_BITS = 8
+WORKER_BITS = 8
+# これより小さい ID は採番を始める前の連番なので default にある
+LEGACY_ID_LIMIT = 1 << 32
+
+_lock = threading.Lock()
+_last_ms = 0
+_sequence = 0
+
+
+def shard_for_author(author_id):
+    # シャード数を変えると振り分け先が変わるので、運用を始めた後は変えない
+    return settings.TWEET_SHARDS[author_id % len(settings.TWEET_SHARDS)]
+
+
+def shard_for_id(tweet_id):
+    if tweet_id < LEGACY_ID_LIMIT:
+        return DEFAULT_DB_ALIAS
+    return settings.TWEET_SHARDS[(tweet_id >> WORKER_BITS) & ((1 << SHARD_BITS) - 1)]
+
+
+def next_id(shard):
+    global _last_ms, _sequence
+    with _lock:
+        now = max(int(time.time() * 1000), _last_ms)
+        if now == _last_ms:
+            _sequence = (_sequence + 1) & ((1 << SEQUENCE_BITS) - 1)
+            if _sequence == 0:
+                # 同じミリ秒の連番を使い切ったら次のミリ秒の分を使う
+                now += 1
+        else:
+            _sequence = 0
+        _last_ms = now
+        sequence = _sequence
+    # 同じシャードに書き込むプロセスどうしで ID が重ならないよう、プロセスの番号を混ぜる。
+    # 設定が無ければプロセス ID の下位ビットを使う（重なることがあるので、Tweet.save は重なったら採番し直す）
+    worker = settings.TWEET_ID_WORKER
+    if worker is None:
+        worker = os.getpid()
+    worker &= (1 << WORKER_BITS) - 1
+    return (
+        (now - EPOCH_MS) << (SEQUENCE_BITS + SHARD_BITS + WORKER_BITS)
+        | sequence << (SHARD_BITS + WORKER_BITS)
+        | settings.TWEET_SHARDS.index(shard) << WORKER_BITS
+        | worker
+    )
+
+
+def first_id_at(timestamp):
+    # timestamp（秒）以降に採番された ID はこれより大きい
+    return max(int(timestamp * 1000) - EPOCH_MS, 0) << (SEQUENCE_BITS + SHARD_BITS + WORKER_BITS)
+
+
+def merge(streams, key, reverse=False):
+    # シャードごとに並んだ結果を、必要な分だけ読みながら1列にまとめる
+    return heapq.merge(*streams, key=key, reverse=reverse)
+
+
+def load_users(objs, lookup):
+    # JOIN で読めなかった（default 以外のシャードの）分のユーザーを、シャードの数によらず1回で読む
+    prefetch_related_objects(objs, lookup)
+    return objs
+
+
+async def aload_users(objs, lookup):
+    return await sync_to_async(load_users)(objs, lookup)
+
+
+class ShardedQuerySet(models.QuerySet):
+    def shard(self, alias):
+        # default のシャードは読み出しをレプリカに振り分けられるよう、using() で固定しない
+        return self if alias == DEFAULT_DB_ALIAS else self.using(alias)
+
+    def shards(self):
+        return [self.shard(alias) for alias in settings.TWEET_SHARDS]
+
+    def select_users(self, *lookups, prefetch=True):
+        # ユーザーは default にしかないので、ほかのシャードでは JOIN せずに別のクエリで読む。
+        # 複数のシャードの結果をまとめるときは prefetch=False にし、まとめた後に load_users() で1回で読む
+        if self.db == DEFAULT_DB_ALIAS or self.db not in settings.TWEET_SHARDS:
+            return self.select_related(*lookups)
+        related = {lookup.rpartition("__")[0] for lookup in lookups} - {""}
+        queryset = self.select_related(*related) if related else self
+        return queryset.prefetch_related(*lookups) if prefetch else queryset
+
+    def create(self, **kwargs):
+        if self._db is not None:
+            return super().create(**kwargs)
+        # using を渡さずに保存すると、ルーターがインスタンスからシャードを選ぶ
+        obj = self.model(**kwargs)
+        obj.save(force_insert=True)
+        return obj
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if self._db is not None:
+            return super().bulk_create(objs, *args, **kwargs)
+        objs = list(objs)
+        groups = {}
+        for obj in objs:
+            groups.setdefault(router.db_for_write(self.model, instance=obj), []).append(obj)
+        for alias, group in groups.items():
+            self.using(alias).bulk_create(group, *args, **kwargs)
+        return objs
+
+
+class TweetQuerySet(ShardedQuerySet):
+    def for_author(self, author_id):
+        return self.shard(shard_for_author(author_id)).filter(author_id=author_id)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.assign_id()
+        return super().bulk_create(objs, *args, **kwargs)
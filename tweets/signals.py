@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Like, Mention, TimelineEntry, Tweet
+
+
+@receiver(post_delete, sender=get_user_model())
+def delete_sharded_rows(sender, instance, **kwargs):
+    # default にある行はユーザーと一緒に CASCADE で消えるので、ほかのシャードの分を消す
+    for shard in settings.TWEET_SHARDS:
+        if shard == DEFAULT_DB_ALIAS:
+            continue
+        Tweet.objects.using(shard).filter(author_id=instance.pk).delete()
+        Like.objects.using(shard).filter(user_id=instance.pk).delete()
+        TimelineEntry.objects.using(shard).filter(owner_id=instance.pk).delete()
+        Mention.objects.using(shard).filter(user_id=instance.pk).delete()
@@ -0,0 +1,25 @@
+from accounts.models import FriendShip
+from mysite import versions
+from tasks.queue import task
+
+from . import entities, sharding, timeline, trending
+from .models import Tweet
+
+
+@task
+def process_tweet(tweet_id):
+    # ツイートを作成した後の後始末。実行するまでに削除されていたら何もしない
+    tweet = Tweet.objects.shard(sharding.shard_for_id(tweet_id)).filter(pk=tweet_id).first()
+    if tweet is None:
+        return
+    hashtags = entities.save(tweet)
+    timeline.fan_out(tweet)
+    trending.record(hashtags)
+
+
+@task
+def backfill(follower_id, followee_id):
+    # 実行するまでにフォローを解除していたら取り込まない
+    if FriendShip.objects.filter(follower_id=follower_id, following_id=followee_id).exists():
+        timeline.backfill(follower_id, followee_id)
+        versions.bump(versions.timeline(follower_id))
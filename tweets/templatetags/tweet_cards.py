@@ -0,0 +1,10 @@
+from django import template
+
+from tweets import cards
+
+register = template.Library()
+
+
+@register.simple_tag
+def tweet_card(tweet):
+    return cards.render(tweet)
@@ -0,0 +1,189 @@
+import random
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from accounts.models import FriendShip
+from mysite import versions
+from mysite.db import retry_on_lock
+from mysite.pagination import filter_before
+
+from . import sharding
+from .models import TimelineEntry, Tweet
+
+User = get_user_model()
+
+
+# フォロワー数が TIMELINE_FANOUT_FOLLOWER_LIMIT 以上の作者は fan-out せず、
+# 読み出し時にその作者のツイートを直接取りに行く（pull）。
+def is_pull_author(author_id):
+    return User.objects.filter(pk=author_id, follower_count__gte=settings.TIMELINE_FANOUT_FOLLOWER_LIMIT).exists()
+
+
+def _pull_authors(user):
+    return User.objects.filter(
+        follower_relations__follower=user, follower_count__gte=settings.TIMELINE_FANOUT_FOLLOWER_LIMIT
+    ).values_list("pk", flat=True)
+
+
+def pull_author_ids(user):
+    return list(_pull_authors(user))
+
+
+def _recipient_ids(tweet, pull):
+    yield tweet.author_id
+    if pull:
+        return
+    yield from (
+        FriendShip.objects.filter(following_id=tweet.author_id)
+        .values_list("follower_id", flat=True)
+        .iterator(chunk_size=settings.TIMELINE_FANOUT_BATCH_SIZE)
+    )
+
+
+def fan_out(tweet):
+    pull = is_pull_author(tweet.author_id)
+    if pull:
+        # フォロワーのホームには読み出し時に混ぜるので、受信箱の代わりに作者のスタンプを更新する
+        versions.bump(versions.author(tweet.author_id))
+    recipients = _recipient_ids(tweet, pull)
+    while True:
+        batch = list(islice(recipients, settings.TIMELINE_FANOUT_BATCH_SIZE))
+        if not batch:
+            break
+        deliver(tweet, batch)
+
+
+def deliver(tweet, owner_ids):
+    _insert([TimelineEntry(owner_id=owner_id, tweet=tweet, created_at=tweet.created_at) for owner_id in owner_ids])
+    versions.bump(*(versions.timeline(owner_id) for owner_id in owner_ids))
+    # 毎回全員分を切り詰めると書き込みが重くなるので、一部の受信者だけをならしで切り詰める
+    trim(
+        [owner_id for owner_id in owner_ids if random.random() * settings.TIMELINE_TRIM_EVERY < 1],
+        shards=[sharding.shard_for_id(tweet.pk)],
+    )
+
+
+@retry_on_lock
+def _insert(entries):
+    # 重複は無視するので、途中で失敗してもそのままやり直せる
+    TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+def trim(owner_ids, shards=None):
+    # シャードごとに TIMELINE_MAX_LENGTH 件まで残す（全体ではシャード数倍まで残ることがある）
+    for shard in settings.TWEET_SHARDS if shards is None else shards:
+        entries = TimelineEntry.objects.shard(shard)
+        for owner_id in owner_ids:
+            overflow = (
+                entries.filter(owner_id=owner_id)
+                .order_by("-created_at", "-tweet_id")
+                .values_list("pk", flat=True)[settings.TIMELINE_MAX_LENGTH :]
+            )
+            entries.filter(pk__in=overflow).delete()
+
+
+def backfill(follower_id, followee_id):
+    # フォローした相手の最近のツイートを取り込む。pull 対象の作者は読み出し時に混ぜるので不要
+    if is_pull_author(followee_id):
+        return
+    recent = Tweet.objects.for_author(followee_id).order_by("-created_at", "-id")[: settings.TIMELINE_BACKFILL_SIZE]
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(owner_id=follower_id, tweet=tweet, created_at=tweet.created_at) for tweet in recent],
+        ignore_conflicts=True,
+    )
+
+
+def reader_versions(tweet):
+    # そのツイートを表示しているタイムラインのバージョンスタンプ名（削除する前に集める）
+    names = [
+        versions.timeline(owner_id)
+        for owner_id in TimelineEntry.objects.shard(sharding.shard_for_id(tweet.pk))
+        .filter(tweet=tweet)
+        .values_list("owner_id", flat=True)
+    ]
+    if is_pull_author(tweet.author_id):
+        names.append(versions.author(tweet.author_id))
+    return names
+
+
+def purge(follower_id, followee_id):
+    entries = TimelineEntry.objects.shard(sharding.shard_for_author(followee_id))
+    entries.filter(owner_id=follower_id, tweet__author_id=followee_id).delete()
+
+
+def _sort_key(tweet):
+    return (tweet.created_at, tweet.pk)
+
+
+def _by_shard(author_ids):
+    groups = {}
+    for author_id in author_ids:
+        groups.setdefault(sharding.shard_for_author(author_id), []).append(author_id)
+    return groups
+
+
+def _pushed_entries(user, limit, before):
+    # 受信箱はツイートと同じシャードにあるので、シャードごとに読む
+    querysets = []
+    for entries in TimelineEntry.objects.shards():
+        entries = entries.filter(owner=user)
+        if before is not None:
+            entries = entries.filter(filter_before(before, keys=("created_at", "tweet_id")))
+        entries = entries.select_users("tweet__author", prefetch=False)
+        querysets.append(entries.order_by("-created_at", "-tweet_id")[:limit])
+    return querysets
+
+
+def _pulled_tweets(pull_ids, limit, before):
+    querysets = []
+    for shard, author_ids in _by_shard(pull_ids).items():
+        tweets = Tweet.objects.shard(shard).filter(author_id__in=author_ids)
+        if before is not None:
+            tweets = tweets.filter(filter_before(before))
+        querysets.append(tweets.select_users("author", prefetch=False).order_by("-created_at", "-id")[:limit])
+    return querysets
+
+
+def _merge(streams, limit):
+    # 作者が途中で pull 対象になった場合は両方に同じツイートが含まれるので重複を除く
+    seen = set()
+    tweets = []
+    for tweet in sharding.merge(streams, key=_sort_key, reverse=True):
+        if tweet.pk in seen:
+            continue
+        seen.add(tweet.pk)
+        tweets.append(tweet)
+        if len(tweets) == limit:
+            break
+    return tweets
+
+
+def home_timeline(user, limit, before=None):
+    # before は (created_at, id)。指定するとそれより古いツイートだけを返す
+    streams = [(entry.tweet for entry in entries) for entries in _pushed_entries(user, limit, before)]
+    streams += _pulled_tweets(pull_author_ids(user), limit, before)
+    return sharding.load_users(_merge(streams, limit), "author")
+
+
+async def ahome_timeline(user, limit, before=None):
+    streams = [[entry.tweet async for entry in entries] for entries in _pushed_entries(user, limit, before)]
+    pull_ids = [pk async for pk in _pull_authors(user)]
+    streams += [[tweet async for tweet in tweets] for tweets in _pulled_tweets(pull_ids, limit, before)]
+    return await sharding.aload_users(_merge(streams, limit), "author")
+
+
+async def anewer_tweets(user_id, after, until, limit):
+    # after < id <= until のツイートを新しい順に返す（SSE の再接続時に取りこぼした分）
+    streams = []
+    for entries in TimelineEntry.objects.shards():
+        entries = entries.filter(owner_id=user_id, tweet_id__gt=after, tweet_id__lte=until)
+        entries = entries.select_users("tweet__author", prefetch=False).order_by("-tweet_id")[:limit]
+        streams.append([entry.tweet async for entry in entries])
+    pull_ids = [pk async for pk in _pull_authors(user_id)]
+    for shard, author_ids in _by_shard(pull_ids).items():
+        tweets = Tweet.objects.shard(shard).filter(author_id__in=author_ids, pk__gt=after, pk__lte=until)
+        tweets = tweets.select_users("author", prefetch=False).order_by("-pk")[:limit]
+        streams.append([tweet async for tweet in tweets])
+    return await sharding.aload_users(_merge(streams, limit), "author")
@@ -0,0 +1,92 @@
+import time
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from mysite import versions
+
+# ハッシュタグが使われた回数を分ごとのバケットに数え、直近 TRENDING_WINDOW_HOURS 時間のランキングを作る。
+# - record(): 今の分のバケットに足す
+# - compact(): 終わった時間の分バケットを時間バケットにまとめ、ランキングを作り直して置いておく
+# - top(): ランキングをキャッシュの1回の読み出しで返す。TRENDING_REFRESH_INTERVAL 秒より古ければ compact() する
+# バケットは読んでから書くので、同時に書き込むと少し取りこぼすことがある（ランキングなので許容する）
+MINUTE_KEY = "tweets:trending:minute:{}"
+HOUR_KEY = "tweets:trending:hour:{}"
+TOP_KEY = "tweets:trending:top"
+LOCK_KEY = "tweets:trending:lock"
+
+
+def _timeout():
+    return (settings.TRENDING_WINDOW_HOURS + 1) * 60 * 60
+
+
+def record(hashtags, now=None):
+    if not hashtags:
+        return
+    now = time.time() if now is None else now
+    key = MINUTE_KEY.format(int(now // 60))
+    bucket = cache.get(key, {})
+    for name in hashtags:
+        bucket[name] = bucket.get(name, 0) + 1
+    cache.set(key, bucket, _timeout())
+
+
+def _compact_hour(hour):
+    minute_keys = [MINUTE_KEY.format(hour * 60 + minute) for minute in range(60)]
+    bucket = Counter()
+    for counts in cache.get_many(minute_keys).values():
+        bucket.update(counts)
+    cache.set(HOUR_KEY.format(hour), dict(bucket), _timeout())
+    cache.delete_many(minute_keys)
+    return bucket
+
+
+def counts(now=None):
+    # 今の時間は途中までの分バケットから、それより前の時間は時間バケットから数える
+    now = time.time() if now is None else now
+    minute = int(now // 60)
+    hour = minute // 60
+    hours = range(hour - settings.TRENDING_WINDOW_HOURS + 1, hour)
+    found = cache.get_many([HOUR_KEY.format(past) for past in hours])
+    total = Counter()
+    for past in hours:
+        bucket = found.get(HOUR_KEY.format(past))
+        total.update(bucket if bucket is not None else _compact_hour(past))
+    for bucket in cache.get_many([MINUTE_KEY.format(current) for current in range(hour * 60, minute + 1)]).values():
+        total.update(bucket)
+    return total
+
+
+def compact(now=None):
+    now = time.time() if now is None else now
+    ranking = counts(now).most_common(settings.TRENDING_SIZE)
+    previous = cache.get(TOP_KEY)
+    cache.set(TOP_KEY, {"computed_at": now, "hashtags": ranking}, _timeout())
+    if ranking != (previous["hashtags"] if previous else []):
+        # ランキングはホームタイムラインに出る
+        versions.bump(versions.TRENDING)
+    return ranking
+
+
+def top(now=None):
+    now = time.time() if now is None else now
+    snapshot = cache.get(TOP_KEY)
+    if snapshot is None:
+        return compact(now)
+    if now - snapshot["computed_at"] < settings.TRENDING_REFRESH_INTERVAL:
+        return snapshot["hashtags"]
+    # 作り直すのは1つのリクエストだけにして、ほかは古いランキングを返す
+    if not cache.add(LOCK_KEY, True, settings.TRENDING_REFRESH_INTERVAL):
+        return snapshot["hashtags"]
+    return compact(now)
+
+
+async def atop(now=None):
+    now = time.time() if now is None else now
+    snapshot = await cache.aget(TOP_KEY)
+    if snapshot is not None and now - snapshot["computed_at"] < settings.TRENDING_REFRESH_INTERVAL:
+        return snapshot["hashtags"]
+    # 作り直すのはまれなので、同期版をスレッドで動かす
+    return await sync_to_async(top)(now)
@@ -6,9 +6,14 @@ app_name = "tweets"
 
 urlpatterns = [
     path("home/", views.HomeView.as_view(), name="home"),
-    # path('create/', views.TweetCreateView.as_view(), name='create'),
-    # path('<int:pk>/', views.TweetDetailView.as_view(), name='detail'),
-    # path('<int:pk>/delete/', views.TweetDeleteView.as_view(), name='delete'),
-    # path('<int:pk>/like/', views.LikeView, name='like'),
-    # path('<int:pk>/unlike/', views.UnlikeView, name='unlike'),
+    path("home/async/", views.AsyncHomeView.as_view(), name="home_async"),
+    path("home/stream/", views.TweetStreamView.as_view(), name="stream"),
+    path("create/", views.TweetCreateView.as_view(), name="create"),
+    path("search/", views.SearchView.as_view(), name="search"),
+    path("tags/<str:name>/", views.HashtagView.as_view(), name="hashtag"),
+    path("mentions/", views.MentionsView.as_view(), name="mentions"),
+    path("<int:pk>/", views.TweetDetailView.as_view(), name="detail"),
+    path("<int:pk>/delete/", views.TweetDeleteView.as_view(), name="delete"),
+    path("<int:pk>/like/", views.LikeView.as_view(), name="like"),
+    path("<int:pk>/unlike/", views.UnlikeView.as_view(), name="unlike"),
 ]
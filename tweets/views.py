@@ -1,6 +1,244 @@
-from django.contrib.auth.mixins import LoginRequiredMixin
-from django.views.generic import TemplateView
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.core.exceptions import BadRequest
+from django.db import transaction
+from django.db.models import F
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse_lazy
+from django.views.generic import CreateView, DeleteView, DetailView, TemplateView, View
 
+from accounts import graph
+from accounts.backends import invalidate_user
+from accounts.mixins import AsyncLoginRequiredMixin
+from mysite import versions
+from mysite.db import retry_on_lock
+from mysite.pagination import CursorPaginator
+from tasks import queue
 
+from . import cards, entities, likes, pubsub, search, sharding, tasks, timeline, trending
+from .forms import SearchForm, TweetForm
+from .models import Tweet
+
+User = get_user_model()
+
+
+@versions.conditional(
+    lambda request, **kwargs: [
+        versions.timeline(request.user.pk),
+        versions.user(request.user.pk),
+        versions.TRENDING,
+        # ホームに並ぶのは自分とフォロー中のユーザーのツイート
+        versions.author(request.user.pk),
+        *(versions.author(user_id) for user_id in graph.followee_ids(request.user.pk)),
+    ]
+)
 class HomeView(LoginRequiredMixin, TemplateView):
     template_name = "tweets/home.html"
+    # ユーザーとフォロー中 ID（キャッシュが無いとき）・タイムライン・pull 対象の作者とそのツイート・いいね済みか。
+    # トレンドはキャッシュから読む
+    query_budget = 6
+    # シャードが1つ増えるごとに、そのシャードの受信箱・pull 対象のツイート・いいね済みか。
+    # default 以外のシャードのツイートの作者はまとめて1回で読むので、その分も1つ見込む
+    shard_query_budget = 4
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        paginator = CursorPaginator(settings.TIMELINE_PAGE_SIZE)
+        before = paginator.decode(self.request.GET.get("cursor"))
+        # 1件多く取って次のページの有無を判定する
+        tweets = timeline.home_timeline(self.request.user, paginator.per_page + 1, before=before)
+        context["page_obj"] = page = paginator.make_page(tweets)
+        cards.prefetch(page.object_list)
+        cards.annotate(page.object_list, self.request.user)
+        context["tweet_list"] = page.object_list
+        context["trending"] = trending.top()
+        context["stream_enabled"] = pubsub.is_available(self.request)
+        return context
+
+
+class AsyncHomeView(AsyncLoginRequiredMixin, TemplateView):
+    # HomeView と同じ内容を ASGI 上でスレッドプールを介さずに返す
+    template_name = "tweets/home.html"
+    query_budget = 6
+    shard_query_budget = 4
+
+    async def get(self, request, *args, **kwargs):
+        paginator = CursorPaginator(settings.TIMELINE_PAGE_SIZE)
+        before = paginator.decode(request.GET.get("cursor"))
+        tweets = await timeline.ahome_timeline(request.user, paginator.per_page + 1, before=before)
+        page = paginator.make_page(tweets)
+        await cards.aprefetch(page.object_list)
+        await cards.aannotate(page.object_list, request.user)
+        context = self.get_context_data(
+            page_obj=page,
+            tweet_list=page.object_list,
+            trending=await trending.atop(),
+            stream_enabled=pubsub.is_available(request),
+        )
+        return self.render_to_response(context)
+
+
+class TweetStreamView(AsyncLoginRequiredMixin, View):
+    # ホームタイムラインの新着を Server-Sent Events で送る。
+    # 接続を張り続けるので ASGI で動かす（WSGI ではワーカーを1つ占有してしまう）
+    async def get(self, request, *args, **kwargs):
+        if not pubsub.is_available(request):
+            # 204 を返すとブラウザは再接続をやめる
+            return HttpResponse(status=204)
+        # ブラウザは再接続時に最後に受け取った id を Last-Event-ID で送ってくる
+        after = request.headers.get("Last-Event-ID") or request.GET.get("after")
+        try:
+            after = int(after) if after else None
+        except ValueError:
+            raise BadRequest("Invalid cursor.")
+        response = StreamingHttpResponse(pubsub.stream(request.user.pk, after), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        # nginx などのプロキシにバッファさせない
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+
+class TweetCreateView(LoginRequiredMixin, CreateView):
+    form_class = TweetForm
+    template_name = "tweets/tweet_create.html"
+    success_url = reverse_lazy("tweets:home")
+
+    def form_valid(self, form):
+        form.instance.author = self.request.user
+        response = self.save(form)
+        # tweet_count は update() で変えたので、キャッシュしたユーザーを消す
+        invalidate_user(self.request.user.pk)
+        versions.bump(versions.user(self.request.user.pk), versions.profile(self.request.user.username))
+        # 自分のタイムラインにはすぐに入れる（フォロワーへの fan-out は process_tweet で行う）
+        timeline.deliver(self.object, [self.request.user.pk])
+        return response
+
+    @retry_on_lock
+    def save(self, form):
+        with transaction.atomic():
+            response = super().form_valid(form)
+            User.objects.filter(pk=self.request.user.pk).update(tweet_count=F("tweet_count") + 1)
+            queue.enqueue(tasks.process_tweet, self.object.pk, key=f"process_tweet:{self.object.pk}")
+            # SSE の購読者へ配るポーリングをすぐに走らせる
+            transaction.on_commit(pubsub.notify)
+        return response
+
+
+@versions.conditional(lambda request, **kwargs: [versions.tweet(kwargs["pk"]), versions.user(request.user.pk)])
+class TweetDetailView(LoginRequiredMixin, DetailView):
+    model = Tweet
+    template_name = "tweets/tweet_detail.html"
+
+    def get_queryset(self):
+        return Tweet.objects.shard(sharding.shard_for_id(self.kwargs["pk"])).select_users("author")
+
+    def get_context_data(self, **kwargs):
+        cards.annotate([self.object], self.request.user)
+        return super().get_context_data(**kwargs)
+
+
+class TweetDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
+    model = Tweet
+    template_name = "tweets/tweet_confirm_delete.html"
+    success_url = reverse_lazy("tweets:home")
+
+    def get_queryset(self):
+        return Tweet.objects.shard(sharding.shard_for_id(self.kwargs["pk"])).select_users("author")
+
+    def test_func(self):
+        return self.get_object().author == self.request.user
+
+    def form_valid(self, form):
+        # 削除すると TimelineEntry も消えるので、先に表示しているタイムラインを集めておく。
+        # delete() の後は pk が None になるので、ツイートのスタンプとカードもここで決めておく
+        stale = [*timeline.reader_versions(self.object), versions.tweet(self.object.pk)]
+        cards.invalidate(self.object)
+        response = self.delete_tweet(form)
+        invalidate_user(self.request.user.pk)
+        # 削除できるのは作者本人だけ
+        versions.bump(
+            *stale,
+            versions.user(self.request.user.pk),
+            versions.profile(self.request.user.username),
+        )
+        return response
+
+    @retry_on_lock
+    def delete_tweet(self, form):
+        with transaction.atomic():
+            response = super().form_valid(form)
+            User.objects.filter(pk=self.object.author_id).update(tweet_count=F("tweet_count") - 1)
+        return response
+
+
+class SearchView(LoginRequiredMixin, TemplateView):
+    template_name = "tweets/search.html"
+    # ユーザーとフォロー中 ID（キャッシュが無いとき）・全文検索・作者・いいね済みか
+    query_budget = 5
+    # シャードが1つ増えるごとに、そのシャードの全文検索・いいね済みか（作者はシャードによらず1回で読む）
+    shard_query_budget = 2
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["form"] = form = SearchForm(self.request.GET if "q" in self.request.GET else None)
+        if form.is_valid():
+            paginator = search.SearchPaginator(settings.TIMELINE_PAGE_SIZE)
+            after = paginator.decode(self.request.GET.get("cursor"))
+            tweets = search.search(form.cleaned_data["q"], paginator.per_page + 1, after=after)
+            context["page_obj"] = page = paginator.make_page(tweets, key=search.position)
+            cards.prefetch(page.object_list)
+            cards.annotate(page.object_list, self.request.user)
+            context["tweet_list"] = page.object_list
+        return context
+
+
+class TweetListView(LoginRequiredMixin, TemplateView):
+    # ツイートを新しい順に並べるページ。get_tweets() で1ページ分（と1件）を返す
+    template_name = "tweets/tweet_list.html"
+    # ユーザーとフォロー中 ID（キャッシュが無いとき）・ハッシュタグ／メンションとツイート・いいね済みか
+    query_budget = 4
+    # シャードが1つ増えるごとに、そのシャードのハッシュタグ／メンションとツイート・いいね済みか。
+    # default 以外のシャードのツイートの作者はまとめて1回で読むので、その分も1つ見込む
+    shard_query_budget = 3
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        paginator = CursorPaginator(settings.TIMELINE_PAGE_SIZE)
+        before = paginator.decode(self.request.GET.get("cursor"))
+        context["page_obj"] = page = paginator.make_page(self.get_tweets(paginator.per_page + 1, before))
+        cards.prefetch(page.object_list)
+        cards.annotate(page.object_list, self.request.user)
+        context["tweet_list"] = page.object_list
+        return context
+
+
+class HashtagView(TweetListView):
+    def get_tweets(self, limit, before):
+        return entities.hashtag_tweets(self.kwargs["name"], limit, before=before)
+
+    def get_context_data(self, **kwargs):
+        return super().get_context_data(heading=f"#{entities.normalize_hashtag(self.kwargs['name'])}", **kwargs)
+
+
+class MentionsView(TweetListView):
+    def get_tweets(self, limit, before):
+        return entities.mentioning_tweets(self.request.user.pk, limit, before=before)
+
+    def get_context_data(self, **kwargs):
+        return super().get_context_data(heading=f"@{self.request.user.get_username()} へのメンション", **kwargs)
+
+
+class LikeView(LoginRequiredMixin, View):
+    def post(self, request, *args, **kwargs):
+        tweet = get_object_or_404(Tweet.objects.shard(sharding.shard_for_id(kwargs["pk"])), pk=kwargs["pk"])
+        likes.like(request.user, tweet)
+        return JsonResponse({"liked": True, "like_count": likes.like_count(tweet)})
+
+
+class UnlikeView(LoginRequiredMixin, View):
+    def post(self, request, *args, **kwargs):
+        tweet = get_object_or_404(Tweet.objects.shard(sharding.shard_for_id(kwargs["pk"])), pk=kwargs["pk"])
+        likes.unlike(request.user, tweet)
+        return JsonResponse({"liked": False, "like_count": likes.like_count(tweet)})
@@ -5,4 +5,5 @@ from . import views
 app_name = "welcome"
 urlpatterns = [
     path("", views.WelcomeView.as_view(), name="welcome"),
+    path("async/", views.AsyncWelcomeView.as_view(), name="welcome_async"),
 ]
@@ -3,3 +3,10 @@ from django.views.generic import TemplateView
 
 class WelcomeView(TemplateView):
     template_name = "welcome/welcome.html"
+
+
+class AsyncWelcomeView(TemplateView):
+    template_name = "welcome/welcome.html"
+
+    async def get(self, request, *args, **kwargs):
+        return self.render_to_response(self.get_context_data(**kwargs))